@@ -3,33 +3,18 @@ import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
-from io import BytesIO
+from types import SimpleNamespace
 from datetime import datetime
+from engine import (NY, TL, TLL, GD, W, G50, G200, G400, G600, G800, BA, RD, GN, SEQ,
+                    STAGE_ORDER, read_upload, apply_schema, merge_masterfile, prepare_frame,
+                    editor_frame, build_cube, rollup, cross, build_filter_index, filter_mask,
+                    kpis, fc, pct, pl, to_excel)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIG
 # ═══════════════════════════════════════════════════════════════════════════════
 st.set_page_config(page_title="Solutions Pipeline | Marken", page_icon="📋", layout="wide", initial_sidebar_state="expanded")
 
-# ── Marken Brand Palette ─────────────────────────────────────────────────────
-NY    = "#002B49"    # Marken navy
-NY2   = "#003A63"
-TL    = "#00857C"    # Marken teal
-TLL   = "#E8F5F3"
-GD    = "#FFB500"    # UPS gold
-W     = "#FFFFFF"
-G50   = "#FAFBFC"
-G100  = "#F4F5F7"
-G200  = "#E1E4E8"
-G400  = "#A0A8B4"
-G600  = "#6B7280"
-G800  = "#2D3748"
-BA    = "#2E86AB"
-RD    = "#DC3545"
-GN    = "#28A745"
-OR    = "#E06C47"
-SEQ   = [NY, TL, GD, BA, "#6C5B7B", OR, GN, "#9B59B6", "#F39C12", "#1ABC9C"]
-
 # ── CSS ──────────────────────────────────────────────────────────────────────
 st.markdown(f"""
 <style>
@@ -94,96 +79,6 @@ section[data-testid="stSidebar"] hr {{ border-color:rgba(255,255,255,0.12); }}
 </style>
 """, unsafe_allow_html=True)
 
-# ═══════════════════════════════════════════════════════════════════════════════
-# CONSTANTS & HELPERS
-# ═══════════════════════════════════════════════════════════════════════════════
-SF_COLS   = ["Stage","Solution Resource","Account Name","Owner Role","Opportunity Name",
-             "Opportunity Owner","Main Primary Service","Opportunity PAR","Stage Duration","Close Date","Notes"]
-TEAM_COLS = ["Solutions Notes","Tasks","Action Items","Comments / Results"]
-ALL_COLS  = SF_COLS + TEAM_COLS
-
-STAGE_ORDER = ["Information Gathering","Solutions Design","Proposal/Price Quote","Proposal Price/Quote","Negotiations","Closed/Won","Closed/Lost"]
-
-def clean_upload(df):
-    df = df.loc[:, ~df.columns.str.startswith("Unnamed")].copy()
-    rn = {}
-    for c in df.columns:
-        for s in SF_COLS + TEAM_COLS:
-            if c.strip().lower().replace(" ","") == s.lower().replace(" ",""):
-                rn[c] = s
-    df.rename(columns=rn, inplace=True)
-    if "Opportunity PAR" in df.columns:
-        df["Opportunity PAR"] = pd.to_numeric(df["Opportunity PAR"], errors="coerce").fillna(0)
-    if "Stage Duration" in df.columns:
-        df["Stage Duration"] = pd.to_numeric(df["Stage Duration"], errors="coerce").fillna(0).astype(int)
-    if "Close Date" in df.columns:
-        df["Close Date"] = pd.to_datetime(df["Close Date"], errors="coerce", dayfirst=False).dt.strftime("%m/%d/%Y")
-    return df.reset_index(drop=True)
-
-def merge_masterfile(master, new_sf):
-    for c in TEAM_COLS:
-        if c not in master.columns: master[c] = ""
-    old_o = set(master["Opportunity Name"].dropna())
-    new_o = set(new_sf["Opportunity Name"].dropna())
-    upd = 0
-    for i, r in master.iterrows():
-        o = r.get("Opportunity Name")
-        if o in new_o:
-            m = new_sf[new_sf["Opportunity Name"]==o].iloc[0]
-            for c in SF_COLS:
-                if c in new_sf.columns: master.at[i,c] = m[c]
-            upd += 1
-    added = new_o - old_o
-    nr = new_sf[new_sf["Opportunity Name"].isin(added)].copy()
-    for c in TEAM_COLS: nr[c] = ""
-    master = pd.concat([master,nr], ignore_index=True)
-    removed = old_o - new_o
-    for o in removed:
-        mask = master["Opportunity Name"]==o
-        master.loc[mask,"Solutions Notes"] = master.loc[mask,"Solutions Notes"].fillna("").astype(str) + " [Removed from SF]"
-    cols = [c for c in ALL_COLS if c in master.columns]
-    return master[cols].reset_index(drop=True), {"updated":upd,"added":len(added),"removed":len(removed),"total":len(master)}
-
-def fc(v):
-    if pd.isna(v) or v==0: return "$0"
-    if abs(v)>=1e6: return f"${v/1e6:,.1f}M"
-    if abs(v)>=1e3: return f"${v/1e3:,.0f}K"
-    return f"${v:,.0f}"
-
-def pct(part, whole):
-    return f"{part/whole*100:.0f}%" if whole else "0%"
-
-def pl(fig, h=340, mb=30):
-    fig.update_layout(
-        font=dict(family="DM Sans,sans-serif", size=11, color=G800),
-        paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
-        height=h, margin=dict(l=10,r=10,t=28,b=mb),
-        legend=dict(font=dict(size=9.5), orientation="h", y=-0.2, x=0.5, xanchor="center"),
-    )
-    fig.update_xaxes(gridcolor=G200, showline=True, linecolor=G200, linewidth=1)
-    fig.update_yaxes(gridcolor=G200, showline=True, linecolor=G200, linewidth=1)
-    return fig
-
-def to_excel(df):
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as w:
-        df.to_excel(w, index=False, sheet_name="Masterfile")
-        ws = w.sheets["Masterfile"]
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        hf=PatternFill("solid",fgColor="002B49"); hw=Font(name="Calibri",bold=True,color="FFFFFF",size=10)
-        tf=PatternFill("solid",fgColor="E8F5F3"); bd=Border(*(Side(style="thin",color="E1E4E8"),)*4)
-        for ci,cn in enumerate(df.columns,1):
-            c=ws.cell(1,ci); c.fill,c.font,c.border=hf,hw,bd; c.alignment=Alignment(horizontal="center",vertical="center",wrap_text=True)
-            if cn in TEAM_COLS:
-                for ri in range(2,len(df)+2): ws.cell(ri,ci).fill=tf
-            ml=max(len(str(cn)),*(len(str(x)) for x in df[cn].head(50))) if len(df) else len(str(cn))
-            ws.column_dimensions[ws.cell(1,ci).column_letter].width=min(ml+4,42)
-        bf=Font(name="Calibri",size=10)
-        for ri in range(2,len(df)+2):
-            for ci in range(1,len(df.columns)+1):
-                c=ws.cell(ri,ci); c.font,c.border=bf,bd; c.alignment=Alignment(vertical="center",wrap_text=True)
-    return buf.getvalue()
-
 # ═══════════════════════════════════════════════════════════════════════════════
 # SESSION STATE
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -224,19 +119,13 @@ if st.session_state.master is None:
     st.markdown("""<div class="wf"><b>Getting started</b> — Upload your Salesforce export or existing Masterfile (.xlsx / .csv). The app detects the format and adds team columns if needed.</div>""", unsafe_allow_html=True)
     f = st.file_uploader("Upload Salesforce Export or Masterfile", type=["xlsx","xls","csv"], label_visibility="collapsed")
     if f:
-        raw = pd.read_csv(f) if f.name.endswith(".csv") else pd.read_excel(f)
-        cl = clean_upload(raw)
-        for c in TEAM_COLS:
-            if c not in cl.columns: cl[c] = ""
-        cols = [c for c in ALL_COLS if c in cl.columns]
-        st.session_state.master = cl[cols]
+        st.session_state.master = read_upload(f.name, f.getvalue())
         st.rerun()
     st.stop()
 
-df = st.session_state.master.copy()
-df["Opportunity PAR"] = pd.to_numeric(df.get("Opportunity PAR",0), errors="coerce").fillna(0)
-df["Stage Duration"]  = pd.to_numeric(df.get("Stage Duration",0), errors="coerce").fillna(0).astype(int)
-df["Close Date Parsed"] = pd.to_datetime(df["Close Date"], errors="coerce")
+df = prepare_frame(st.session_state.master)
+cube = build_cube(df)
+fidx, cidx = build_filter_index(df), build_filter_index(cube)
 TODAY = pd.Timestamp.now().normalize()
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -247,20 +136,17 @@ if page == "Dashboard":
     # ── Filters ──────────────────────────────────────────────────────────────
     with st.expander("Filters", expanded=False):
         f1,f2,f3,f4 = st.columns(4)
-        sel_st = f1.multiselect("Stage", sorted(df["Stage"].dropna().unique()), default=sorted(df["Stage"].dropna().unique()))
-        sel_sv = f2.multiselect("Service", sorted(df["Main Primary Service"].dropna().unique()), default=sorted(df["Main Primary Service"].dropna().unique()))
-        sel_rg = f3.multiselect("Region", sorted(df["Owner Role"].dropna().unique()), default=sorted(df["Owner Role"].dropna().unique()))
-        sel_rs = f4.multiselect("Solution Resource", sorted(df["Solution Resource"].dropna().unique()), default=sorted(df["Solution Resource"].dropna().unique()))
-    fdf = df[df["Stage"].isin(sel_st) & df["Main Primary Service"].isin(sel_sv) & df["Owner Role"].isin(sel_rg) & df["Solution Resource"].isin(sel_rs)]
-
-    total = fdf["Opportunity PAR"].sum()
-    n_opp = len(fdf)
-    n_cust = fdf["Account Name"].nunique()
-    n_svc = fdf["Main Primary Service"].nunique()
-    avg_deal = fdf["Opportunity PAR"].mean() if n_opp else 0
-    avg_dur = fdf["Stage Duration"].mean() if n_opp else 0
-    past_due = fdf[fdf["Close Date Parsed"] < TODAY]
-    aging_60 = fdf[fdf["Stage Duration"] > 60]
+        opts = lambda c: cidx[c][0]
+        sel_st = f1.multiselect("Stage", opts("Stage"), default=opts("Stage"))
+        sel_sv = f2.multiselect("Service", opts("Main Primary Service"), default=opts("Main Primary Service"))
+        sel_rg = f3.multiselect("Region", opts("Owner Role"), default=opts("Owner Role"))
+        sel_rs = f4.multiselect("Solution Resource", opts("Solution Resource"), default=opts("Solution Resource"))
+    sel = {"Stage": sel_st, "Main Primary Service": sel_sv, "Owner Role": sel_rg, "Solution Resource": sel_rs}
+    fdf   = df[filter_mask(fidx, sel)]
+    fcube = cube[filter_mask(cidx, sel)]
+    k = SimpleNamespace(**kpis(fdf, fcube, TODAY))
+    total, n_opp, n_cust, n_svc, avg_deal, avg_dur = k.total, k.n_opp, k.n_cust, k.n_svc, k.avg_deal, k.avg_dur
+    past_due, aging_60 = k.past_due, k.aging_60
 
     # ── KPIs ─────────────────────────────────────────────────────────────────
     st.markdown(f"""
@@ -284,7 +170,7 @@ if page == "Dashboard":
 
     with p1a:
         st.markdown('<p class="so">Solutions Design holds the bulk of the pipeline — most value is still in early stages</p>', unsafe_allow_html=True)
-        sg = fdf.groupby("Stage").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count")).reset_index()
+        sg = rollup(fcube, "Stage")
         sg["StageOrd"] = sg["Stage"].apply(lambda x: STAGE_ORDER.index(x) if x in STAGE_ORDER else 99)
         sg = sg.sort_values("StageOrd")
         colors = []
@@ -332,7 +218,7 @@ if page == "Dashboard":
     c2a, c2b = st.columns([1.15, 0.85])
 
     with c2a:
-        cu = fdf.groupby("Account Name").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count")).reset_index().sort_values("Value", ascending=False)
+        cu = rollup(fcube, "Account Name").sort_values("Value", ascending=False)
         top5_pct = cu.head(5)["Value"].sum()/cu["Value"].sum()*100 if cu["Value"].sum()>0 else 0
         st.markdown(f'<p class="so">Top 5 accounts represent {top5_pct:.0f}% of total pipeline — high concentration risk</p>', unsafe_allow_html=True)
         cu_top = cu.head(10).sort_values("Value", ascending=True)
@@ -379,8 +265,7 @@ if page == "Dashboard":
     s3a, s3b = st.columns([0.55, 0.45])
 
     with s3a:
-        sv = fdf.groupby("Main Primary Service").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-            Avg=("Opportunity PAR","mean")).reset_index().sort_values("Value", ascending=False)
+        sv = rollup(fcube, "Main Primary Service").sort_values("Value", ascending=False)
         top_svc = sv.iloc[0]["Main Primary Service"] if len(sv) else "N/A"
         top_svc_pct = sv.iloc[0]["Value"]/sv["Value"].sum()*100 if len(sv) and sv["Value"].sum()>0 else 0
         st.markdown(f'<p class="so">{top_svc} accounts for {top_svc_pct:.0f}% of pipeline value by service</p>', unsafe_allow_html=True)
@@ -408,7 +293,7 @@ if page == "Dashboard":
 
     # Service × Region Heatmap
     st.markdown('<p class="so">Service demand mapped by region — Next Flight Out dominates both EMEA and NORAM</p>', unsafe_allow_html=True)
-    ht = pd.crosstab(fdf["Main Primary Service"], fdf["Owner Role"], values=fdf["Opportunity PAR"], aggfunc="sum").fillna(0)
+    ht = cross(fcube, "Main Primary Service", "Owner Role")
     fig7 = go.Figure(go.Heatmap(
         z=ht.values, x=ht.columns.tolist(), y=ht.index.tolist(),
         colorscale=[[0,W],[.3,TLL],[.7,TL],[1,NY]],
@@ -430,8 +315,7 @@ if page == "Dashboard":
     r4a, r4b = st.columns(2)
 
     with r4a:
-        rg = fdf.groupby("Owner Role").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-            Avg=("Opportunity PAR","mean"), AvgDur=("Stage Duration","mean")).reset_index().sort_values("Value", ascending=False)
+        rg = rollup(fcube, "Owner Role").sort_values("Value", ascending=False)
         top_reg = rg.iloc[0]["Owner Role"] if len(rg) else "N/A"
         st.markdown(f'<p class="so">{top_reg} leads the pipeline by value</p>', unsafe_allow_html=True)
         fig8 = go.Figure(go.Bar(
@@ -447,7 +331,7 @@ if page == "Dashboard":
 
     with r4b:
         st.markdown('<p class="so">Region × stage: which regions are further in the pipeline?</p>', unsafe_allow_html=True)
-        rs_ht = pd.crosstab(fdf["Owner Role"], fdf["Stage"], values=fdf["Opportunity PAR"], aggfunc="sum").fillna(0)
+        rs_ht = cross(fcube, "Owner Role", "Stage")
         ordered = [s for s in STAGE_ORDER if s in rs_ht.columns]
         extra = [s for s in rs_ht.columns if s not in STAGE_ORDER]
         rs_ht = rs_ht[ordered + extra]
@@ -472,8 +356,7 @@ if page == "Dashboard":
     # ══════════════════════════════════════════════════════════════════════════
     st.markdown('<div class="sec">5 · Solution Resource Workload</div>', unsafe_allow_html=True)
 
-    rw = fdf.groupby("Solution Resource").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-        AvgDur=("Stage Duration","mean"), Cust=("Account Name","nunique")).reset_index().sort_values("Value", ascending=False)
+    rw = rollup(fcube, "Solution Resource", cust=True)[["Solution Resource","Value","Count","AvgDur","Cust"]].sort_values("Value", ascending=False)
 
     r5a, r5b = st.columns([0.6, 0.4])
 
@@ -502,7 +385,7 @@ if page == "Dashboard":
 
     # Resource × Region
     st.markdown('<p class="so">Resource allocation by region</p>', unsafe_allow_html=True)
-    rr = pd.crosstab(fdf["Solution Resource"], fdf["Owner Role"], values=fdf["Opportunity Name"], aggfunc="count").fillna(0).astype(int)
+    rr = cross(fcube, "Solution Resource", "Owner Role", m="Count").astype(int)
     fig11 = go.Figure(go.Heatmap(
         z=rr.values, x=rr.columns.tolist(), y=rr.index.tolist(),
         colorscale=[[0,W],[.5,TLL],[1,NY]],
@@ -587,7 +470,8 @@ if page == "Dashboard":
     ag_flagged = ag[ag["Flag"].str.len() > 0].sort_values("Stage Duration", ascending=False)
     if len(ag_flagged):
         st.dataframe(
-            ag_flagged[["Flag","Account Name","Opportunity Name","Stage","Opportunity PAR","Stage Duration","Close Date","Notes"]].style.format({"Opportunity PAR":"${:,.0f}"}),
+            ag_flagged[["Flag","Account Name","Opportunity Name","Stage","Opportunity PAR","Stage Duration","Close Date Display","Notes"]]
+                .rename(columns={"Close Date Display":"Close Date"}).style.format({"Opportunity PAR":"${:,.0f}"}),
             use_container_width=True, height=min(300, 35*len(ag_flagged)+38), hide_index=True,
         )
     else:
@@ -638,8 +522,7 @@ if page == "Dashboard":
     # ══════════════════════════════════════════════════════════════════════════
     st.markdown('<div class="sec">8 · Opportunity Owner Performance</div>', unsafe_allow_html=True)
 
-    ow = fdf.groupby("Opportunity Owner").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-        Avg=("Opportunity PAR","mean"), AvgDur=("Stage Duration","mean")).reset_index().sort_values("Value", ascending=False)
+    ow = rollup(fcube, "Opportunity Owner")[["Opportunity Owner","Value","Count","Avg","AvgDur"]].sort_values("Value", ascending=False)
 
     o8a, o8b = st.columns([0.55, 0.45])
     with o8a:
@@ -668,7 +551,8 @@ if page == "Dashboard":
     # ══════════════════════════════════════════════════════════════════════════
     st.markdown('<div class="sec">9 · Full Pipeline Detail</div>', unsafe_allow_html=True)
     tbl = fdf[["Stage","Account Name","Opportunity Name","Solution Resource","Opportunity Owner",
-               "Main Primary Service","Opportunity PAR","Stage Duration","Close Date","Notes"]].copy()
+               "Main Primary Service","Opportunity PAR","Stage Duration","Close Date Display","Notes"]]
+    tbl = tbl.rename(columns={"Close Date Display":"Close Date"})
     tbl = tbl.sort_values(["Stage","Opportunity PAR"], ascending=[True,False])
     st.dataframe(
         tbl.style.format({"Opportunity PAR":"${:,.0f}"}),
@@ -686,12 +570,13 @@ if page == "Dashboard":
     # ══════════════════════════════════════════════════════════════════════════
     st.markdown('<div class="sec">10 · Executive Summary</div>', unsafe_allow_html=True)
 
-    top_c = fdf.groupby("Account Name")["Opportunity PAR"].sum().idxmax() if n_opp else "N/A"
-    top_cv = fdf.groupby("Account Name")["Opportunity PAR"].sum().max() if n_opp else 0
-    top_sv = fdf.groupby("Main Primary Service")["Opportunity PAR"].sum().idxmax() if n_opp else "N/A"
-    n_des = len(fdf[fdf["Stage"]=="Solutions Design"])
-    n_pro = len(fdf[fdf["Stage"].str.contains("Proposal|Price", case=False, na=False)])
-    n_neg = len(fdf[fdf["Stage"]=="Negotiations"])
+    top_c = cu.iloc[0]["Account Name"] if len(cu) else "N/A"
+    top_cv = cu.iloc[0]["Value"] if len(cu) else 0
+    top_sv = sv.iloc[0]["Main Primary Service"] if len(sv) else "N/A"
+    sgr = sg.set_index("Stage")["Rows"]
+    n_des = int(sgr.get("Solutions Design", 0))
+    n_pro = int(sgr[sgr.index.astype(str).str.contains("Proposal|Price", case=False)].sum())
+    n_neg = int(sgr.get("Negotiations", 0))
     top5p = cu.head(5)["Value"].sum()/cu["Value"].sum()*100 if len(cu) and cu["Value"].sum()>0 else 0
 
     reg_lead = f"with <b>{top_reg}</b> leading at <b>{fc(rg.iloc[0]['Value'])}</b>" if len(rg) else ""
@@ -738,20 +623,18 @@ elif page == "Masterfile Manager":
 
     st.markdown('<div class="sec">Upload New Salesforce Export to Merge</div>', unsafe_allow_html=True)
     mf = st.file_uploader("Upload new SF export. Team columns will be preserved.", type=["xlsx","xls","csv"], key="mu")
-    if mf:
-        raw = pd.read_csv(mf) if mf.name.endswith(".csv") else pd.read_excel(mf)
-        new_sf = clean_upload(raw)
-        merged, stats = merge_masterfile(st.session_state.master.copy(), new_sf)
-        st.session_state.master = merged
+    # The uploader keeps its file across reruns — merge each upload once
+    if mf and st.session_state.get("merged_id") != mf.file_id:
+        new_sf = read_upload(mf.name, mf.getvalue())
+        merged, stats = merge_masterfile(st.session_state.master, new_sf)
+        st.session_state.master, st.session_state.merged_id = merged, mf.file_id
         st.success(f"Merge complete — **{stats['updated']}** updated · **{stats['added']}** added · **{stats['removed']}** flagged · **{stats['total']}** total")
         st.rerun()
 
     st.markdown('<div class="sec">Masterfile — Editable</div>', unsafe_allow_html=True)
     st.caption("Salesforce columns are locked. Edit the four team columns (teal-highlighted in Excel download).")
 
-    edf = st.session_state.master.copy()
-    for c in TEAM_COLS:
-        if c not in edf.columns: edf[c] = ""
+    edf = editor_frame(st.session_state.master, df)
 
     edited = st.data_editor(
         edf, use_container_width=True, height=min(600, 35*len(edf)+38), num_rows="dynamic",
@@ -776,7 +659,7 @@ elif page == "Masterfile Manager":
     )
 
     if st.button("Save edits", type="primary"):
-        st.session_state.master = edited.copy()
+        st.session_state.master = apply_schema(edited)
         st.success("Edits saved to session.")
 
     st.markdown("---")
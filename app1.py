@@ -3,38 +3,32 @@ import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
-import re
-from io import BytesIO
+import os
+import json
+import hashlib
+import threading
+import multiprocessing
+from collections import defaultdict
+from types import SimpleNamespace
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from engine import (NY, NY2, TL, TLL, GD, W, G50, G200, G400, G600, G800, BA, RD, GN, SEQ,
+                    DATE_FMT, STAGE_ORDER, STATUS_COLORS, FILTER_COLS, PARSER_VERSION,
+                    CSV_EXT, read_upload, export_date, export_order, cow_copy, schema_memory, prepare_frame,
+                    editor_frame, apply_edits, build_cube, rollup, cross, build_filter_index,
+                    filter_mask, filter_sig, kpis, fc, pct, pl, to_excel, LRUCache, measure)
+from store import MasterStore
+
+# Copy-on-write: frames built from the shared masterfile (slices, prepared
+# frames, shallow copies) share its columns until one of them is written
+pd.set_option("mode.copy_on_write", True)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONFIG
 # ═══════════════════════════════════════════════════════════════════════════════
 st.set_page_config(page_title="Solutions Pipeline | Marken", page_icon="📋", layout="wide", initial_sidebar_state="expanded")
 
-# ── Marken Brand Palette ─────────────────────────────────────────────────────
-NY    = "#002B49"
-NY2   = "#003A63"
-TL    = "#00857C"
-TLL   = "#E8F5F3"
-GD    = "#FFB500"
-W     = "#FFFFFF"
-G50   = "#FAFBFC"
-G100  = "#F4F5F7"
-G200  = "#E1E4E8"
-G400  = "#A0A8B4"
-G600  = "#6B7280"
-G800  = "#2D3748"
-BA    = "#2E86AB"
-RD    = "#DC3545"
-GN    = "#28A745"
-OR    = "#E06C47"
-AM    = "#F6AD55"
-SEQ   = [NY, TL, GD, BA, "#6C5B7B", OR, GN, "#9B59B6", "#F39C12", "#1ABC9C"]
-
-# Date display format
-DATE_FMT = "%d-%b-%Y"   # e.g. 09-Feb-2026
-
 # ── CSS ──────────────────────────────────────────────────────────────────────
 st.markdown(f"""
 <style>
@@ -114,16 +108,24 @@ section[data-testid="stSidebar"] hr {{ border-color:rgba(255,255,255,0.10); }}
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONSTANTS & HELPERS
 # ═══════════════════════════════════════════════════════════════════════════════
-SF_COLS   = ["Stage","Solution Resource","Account Name","Owner Role","Opportunity Name",
-             "Opportunity Owner","Main Primary Service","Opportunity PAR","Stage Duration",
-             "Close Date","Notes","Status","Received by Solutions","Closed by Solutions","Product"]
-TEAM_COLS = ["Solutions Notes","Tasks","Action Items","Comments / Results"]
-ALL_COLS  = SF_COLS + TEAM_COLS
+# Solutions lifecycle (Gantt) chart — bars per view: top-N by value, or page size
+LF_ROWS = 25
 
-STAGE_ORDER = ["Information Gathering","Solutions Design","Proposal/Price Quote",
-               "Proposal Price/Quote","Negotiations","Closed/Won","Closed/Lost"]
+# Shared (cross-session) caches for parsed uploads and built figures
+INGEST_CACHE_MB = 512
+INGEST_WORKERS = min(4, os.cpu_count() or 1)     # processes parsing a multi-file upload
+INGEST_PROGRESS_MB = 50                           # CSV uploads above this show a progress bar
+UPLOAD_TYPES = ["xlsx", "xls", "csv", "gz", "zip"]   # .csv.gz / zipped CSV exports too
+FIGURE_CACHE_MB = 256
 
-STATUS_COLORS = {"Working": GN, "Pending": AM, "Completed": BA, "Unassigned": G400}
+# Profiling mode — stage records kept per session (newest last)
+PROFILE_KEEP = 1000
+
+# Persistent masterfile store (SQLite). Above PUSHDOWN_ROWS the dashboard filters
+# and aggregates in SQL and a session only loads its filtered close-year window.
+STORE_PATH = os.environ.get("SOLUTIONS_STORE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "solutions_master.db"))
+PUSHDOWN_ROWS = 200_000
+PUSHDOWN_YEARS = 2       # default window: this year and the year before, plus anything later
 
 # ── Spacer helper ────────────────────────────────────────────────────────────
 def spacer(size="md"):
@@ -132,185 +134,164 @@ def spacer(size="md"):
     st.markdown(f'<div style="height:{h}"></div>', unsafe_allow_html=True)
 
 
-def parse_par(val):
-    if pd.isna(val): return 0.0
-    if isinstance(val, (int, float)): return float(val)
-    s = str(val).strip().upper().replace("USD","").replace("$","").replace(",","").strip()
-    try: return float(s)
-    except ValueError: return 0.0
-
-
-def fix_excel_eu_date(val):
-    """Robust parser for Solutions date columns with mixed formats.
-    Handles: DD/M/YYYY strings, M/D/YY strings (2-digit year),
-    and Excel datetimes where month↔day was swapped on import.
-    Examples:
-        '27/1/2026'  → 27-Jan-2026   (DD/M/YYYY string)
-        '2/10/26'    → 10-Feb-2026   (M/DD/YY string)
-        '2/9/26'     → 09-Feb-2026   (M/D/YY string)
-        datetime(2026,10,2) → 10-Feb-2026  (Excel swapped 2/10/26)
-    """
-    if pd.isna(val):
-        return pd.NaT
-
-    # ── String input ─────────────────────────────────────────────────────
-    if isinstance(val, str):
-        val = val.strip()
-        if not val:
-            return pd.NaT
-        parts = re.split(r'[/\-]', val)
-        if len(parts) == 3:
-            try:
-                a, b, c = [int(p) for p in parts]
-            except ValueError:
-                return pd.to_datetime(val, dayfirst=True, errors="coerce")
-            # Fix 2-digit year → 4-digit
-            yr = c if c > 100 else (2000 + c)
-            if a > 12:
-                # First number > 12 → must be the day → DD/MM/YYYY
-                return pd.Timestamp(year=yr, month=b, day=a)
-            elif b > 12:
-                # Second number > 12 → must be the day → MM/DD/YYYY
-                return pd.Timestamp(year=yr, month=a, day=b)
-            else:
-                # Both ≤ 12 — ambiguous: use M/D/YY (US short, common in SF)
-                try:
-                    return pd.Timestamp(year=yr, month=a, day=b)
-                except Exception:
-                    return pd.Timestamp(year=yr, month=b, day=a)
-        return pd.to_datetime(val, dayfirst=True, errors="coerce")
-
-    # ── Datetime / Timestamp from Excel ──────────────────────────────────
-    try:
-        ts = pd.Timestamp(val)
-        # Excel read '2/10/26' as 2026-10-02 (Oct 2) — should be Feb 10
-        if ts.day <= 12 and ts.month > 2:
-            return pd.Timestamp(year=ts.year, month=ts.day, day=ts.month)
-        return ts
-    except Exception:
-        return pd.NaT
-
-
-def fmt_date(val):
-    """Format a date value to DD-MMM-YYYY. Returns '—' for NaT/None."""
-    if pd.isna(val): return "—"
-    try:
-        ts = pd.Timestamp(val)
-        return ts.strftime(DATE_FMT)
-    except Exception:
-        return str(val)
-
-
-def clean_upload(df):
-    df = df.loc[:, ~df.columns.str.startswith("Unnamed")].copy()
-    rn = {}
-    for c in df.columns:
-        cl = c.strip()
-        for s in SF_COLS + TEAM_COLS:
-            if cl.lower().replace(" ","") == s.lower().replace(" ",""):
-                rn[c] = s
-    df.rename(columns=rn, inplace=True)
-    if "Opportunity PAR" in df.columns:
-        df["Opportunity PAR"] = df["Opportunity PAR"].apply(parse_par)
-    if "Stage Duration" in df.columns:
-        df["Stage Duration"] = pd.to_numeric(df["Stage Duration"], errors="coerce").fillna(0).astype(int)
-    # Close Date uses US format (MM/DD/YYYY)
-    if "Close Date" in df.columns:
-        df["Close Date"] = pd.to_datetime(df["Close Date"], errors="coerce", dayfirst=False)
-    # Received / Closed by Solutions use EU format (DD/MM/YYYY) — fix Excel swap
-    if "Received by Solutions" in df.columns:
-        df["Received by Solutions"] = df["Received by Solutions"].apply(fix_excel_eu_date)
-    if "Closed by Solutions" in df.columns:
-        df["Closed by Solutions"] = df["Closed by Solutions"].apply(fix_excel_eu_date)
-    if "Status" in df.columns:  df["Status"] = df["Status"].fillna("Unassigned")
-    if "Product" in df.columns: df["Product"] = df["Product"].fillna("General")
-    return df.reset_index(drop=True)
-
-
-def merge_masterfile(master, new_sf):
-    for c in TEAM_COLS:
-        if c not in master.columns: master[c] = ""
-    old_o = set(master["Opportunity Name"].dropna())
-    new_o = set(new_sf["Opportunity Name"].dropna())
-    upd = 0
-    for i, r in master.iterrows():
-        o = r.get("Opportunity Name")
-        if o in new_o:
-            m = new_sf[new_sf["Opportunity Name"]==o].iloc[0]
-            for c in SF_COLS:
-                if c in new_sf.columns: master.at[i,c] = m[c]
-            upd += 1
-    added = new_o - old_o
-    nr = new_sf[new_sf["Opportunity Name"].isin(added)].copy()
-    for c in TEAM_COLS: nr[c] = ""
-    master = pd.concat([master,nr], ignore_index=True)
-    removed = old_o - new_o
-    for o in removed:
-        mask = master["Opportunity Name"]==o
-        master.loc[mask,"Solutions Notes"] = master.loc[mask,"Solutions Notes"].fillna("").astype(str)+" [Removed from SF]"
-    cols = [c for c in ALL_COLS if c in master.columns]
-    return master[cols].reset_index(drop=True), {"updated":upd,"added":len(added),"removed":len(removed),"total":len(master)}
-
-
-def fc(v):
-    if pd.isna(v) or v==0: return "$0"
-    if abs(v)>=1e6: return f"${v/1e6:,.1f}M"
-    if abs(v)>=1e3: return f"${v/1e3:,.0f}K"
-    return f"${v:,.0f}"
-
-
-def pct(part, whole):
-    return f"{part/whole*100:.0f}%" if whole else "0%"
-
-
-def pl(fig, h=380, mb=40, mt=32):
-    """Apply MBB-style layout to any Plotly figure — generous spacing."""
-    fig.update_layout(
-        font=dict(family="DM Sans, sans-serif", size=11.5, color=G800),
-        paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
-        height=h, margin=dict(l=16, r=16, t=mt, b=mb),
-        legend=dict(font=dict(size=9.5), orientation="h", y=-0.18, x=0.5, xanchor="center",
-                    bgcolor="rgba(0,0,0,0)"),
-    )
-    fig.update_xaxes(gridcolor=G200, gridwidth=0.5, showline=True, linecolor=G200, linewidth=0.8,
-                     tickfont=dict(size=10, color=G600))
-    fig.update_yaxes(gridcolor=G200, gridwidth=0.5, showline=True, linecolor=G200, linewidth=0.8,
-                     tickfont=dict(size=10, color=G600))
-    return fig
-
-
-def to_excel(df):
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as w:
-        exp = df.copy()
-        # Format date columns for export
-        for dc in ["Close Date", "Received by Solutions", "Closed by Solutions"]:
-            if dc in exp.columns:
-                exp[dc] = pd.to_datetime(exp[dc], errors="coerce").apply(lambda x: x.strftime(DATE_FMT) if pd.notna(x) else "")
-        exp.to_excel(w, index=False, sheet_name="Masterfile")
-        ws = w.sheets["Masterfile"]
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        hf=PatternFill("solid",fgColor="002B49"); hw=Font(name="Calibri",bold=True,color="FFFFFF",size=10)
-        tf=PatternFill("solid",fgColor="E8F5F3"); bd=Border(*(Side(style="thin",color="E1E4E8"),)*4)
-        for ci,cn in enumerate(exp.columns,1):
-            c=ws.cell(1,ci); c.fill,c.font,c.border=hf,hw,bd
-            c.alignment=Alignment(horizontal="center",vertical="center",wrap_text=True)
-            if cn in TEAM_COLS:
-                for ri in range(2,len(exp)+2): ws.cell(ri,ci).fill=tf
-            ml=max(len(str(cn)),*(len(str(x)) for x in exp[cn].head(50))) if len(exp) else len(str(cn))
-            ws.column_dimensions[ws.cell(1,ci).column_letter].width=min(ml+4,42)
-        bf=Font(name="Calibri",size=10)
-        for ri in range(2,len(exp)+2):
-            for ci in range(1,len(exp.columns)+1):
-                c=ws.cell(ri,ci); c.font,c.border=bf,bd; c.alignment=Alignment(vertical="center",wrap_text=True)
-    return buf.getvalue()
+@st.cache_resource
+def ingest_cache():
+    """Parsed uploads shared by every session, keyed by content hash."""
+    return LRUCache(INGEST_CACHE_MB * 2**20)
+
+
+def ingest_key(name, data):
+    return hashlib.sha256(data).hexdigest(), name.lower().endswith(CSV_EXT), PARSER_VERSION
+
+
+def ingest_upload(f):
+    """read_upload through the shared cache — re-opening the same file skips
+    parsing. Large CSV exports report progress as their chunks come in."""
+    data = f.getvalue()
+    key = ingest_key(f.name, data)
+    cl = ingest_cache().get(key)
+    if cl is None:
+        big = f.name.lower().endswith(CSV_EXT) and len(data) > INGEST_PROGRESS_MB * 2**20
+        bar = st.progress(0.0, text=f"Reading {f.name}") if big else None
+        try: cl = read_upload(f.name, data, bar and (lambda x: bar.progress(x, text=f"Reading {f.name} — {x:.0%}")))
+        finally:
+            if bar: bar.empty()
+        ingest_cache().put(key, cl, int(cl.memory_usage(deep=True).sum()))
+    return cow_copy(cl)
+
+
+@st.cache_resource
+def ingest_pool():
+    """Worker processes shared by every session for multi-file uploads —
+    parsing is pure-Python (openpyxl) and holds the GIL, so threads would not
+    overlap. Spawned, not forked: the server process has threads running."""
+    return ProcessPoolExecutor(INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def ingest_uploads(files):
+    """Several uploads → [(name, date, frame or error)], oldest export first
+    (export_date). Files already in the ingest cache are taken from it, the
+    rest are parsed side by side in ingest_pool and then cached."""
+    keys = [ingest_key(f.name, f.getvalue()) for f in files]
+    out = [ingest_cache().get(k) for k in keys]
+    todo = {i: ingest_pool().submit(read_upload, f.name, f.getvalue()) for i, f in enumerate(files) if out[i] is None}
+    for i, fut in todo.items():
+        try:
+            out[i] = fut.result()
+            ingest_cache().put(keys[i], out[i], int(out[i].memory_usage(deep=True).sum()))
+        except Exception as e:
+            out[i] = e
+    dates = [export_date(f.name, f.getvalue()) for f in files]
+    return [(files[i].name, dates[i], out[i] if isinstance(out[i], Exception) else cow_copy(out[i]))
+            for i in export_order([f.name for f in files], dates)]
+
+
+class FrozenFigure(go.Figure):
+    """A figure kept as its serialized JSON. st.plotly_chart reads figures via
+    to_dict(), so a cached figure is shown without being rebuilt or revalidated."""
+    def __init__(self, js):
+        self._js = js
+
+    def to_dict(self):
+        return json.loads(self._js)
+
+
+@st.cache_resource
+def figure_cache():
+    """Built dashboard sections (figures as JSON) shared by every session,
+    keyed by section, data version and filter signature."""
+    return LRUCache(FIGURE_CACHE_MB * 2**20)
+
+
+def cached(key, build):
+    """build() through the figure cache. Figures in the result (a figure or a
+    dict of parts) are stored frozen; the size charged is their JSON plus
+    any tables."""
+    r = figure_cache().get(key)
+    if r is None:
+        out = build()
+        parts = out if isinstance(out, dict) else {"": out}
+        frozen, nbytes = {}, 0
+        for k, x in parts.items():
+            if isinstance(x, go.Figure) and not isinstance(x, FrozenFigure): x = FrozenFigure(x.to_json())
+            if isinstance(x, FrozenFigure): nbytes += len(x._js)
+            elif isinstance(x, pd.DataFrame): nbytes += int(x.memory_usage(deep=True).sum())
+            else: nbytes += len(x) if isinstance(x, str) else 64
+            frozen[k] = x
+        r = frozen if isinstance(out, dict) else frozen[""]
+        figure_cache().put(key, r, nbytes)
+    return r
+
+
+@st.cache_resource
+def master_store(path):
+    """The masterfile store, one per process."""
+    return MasterStore(path)
+
+
+def sync_master():
+    """Follow the store's version — a write from any session moves every
+    session onto the new version's derived values."""
+    st.session_state.master_ver = master_store(STORE_PATH).version()
+
+
+def current_master():
+    """The masterfile, loaded from the store once per version and process.
+    Only ever the session's version: if a write has landed since, the run
+    starts over on the new one rather than memoising a newer frame under
+    the old version."""
+    ver = st.session_state.master_ver
+    def load():
+        df = master_store(STORE_PATH).load(version=ver)
+        if df is None and master_store(STORE_PATH).version() != ver:
+            sync_master()
+            st.rerun()
+        return df
+    return derived("master", load)
+
+
+def set_master(df, kind="save", label=""):
+    """Write the masterfile through to the store (upload, save) and follow it.
+    Returns the rows written (0: nothing changed, no new version)."""
+    n = master_store(STORE_PATH).save(df, kind, label)
+    sync_master()
+    return n
+
+
+def stage(name, rows=None):
+    """Profile a dashboard section or Masterfile Manager step — wall time, rows
+    and tracemalloc peak — when profiling is on; a no-op otherwise."""
+    ss = st.session_state
+    if not ss.get("profile"): return nullcontext()
+    rec = {"Run": ss.prof_run, "Page": page, "Stage": name, "Rows": rows}
+    ss.prof_log.append(rec)
+    return measure(rec)
+
+
+@st.cache_resource(max_entries=2)
+def version_memo(path, ver):
+    """Values derived from one store version, shared by every session on it."""
+    return {}, defaultdict(threading.Lock)
+
+
+def derived(key, build):
+    """Process-wide memo of anything computed from the masterfile — built once
+    per store version by whichever session asks first. Frames come back as
+    shallow copies: with copy-on-write on, a session that writes to one
+    copies just the columns it touches and the shared frame stays intact."""
+    memo, locks = version_memo(STORE_PATH, st.session_state.master_ver)
+    if key not in memo:
+        with locks[key]:
+            if key not in memo: memo[key] = build()
+    v = memo[key]
+    return v.copy(deep=False) if isinstance(v, pd.DataFrame) else v
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # SESSION STATE
 # ═══════════════════════════════════════════════════════════════════════════════
-if "master" not in st.session_state:
-    st.session_state.master = None
+store = master_store(STORE_PATH)
+sync_master()
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # SIDEBAR
@@ -325,9 +306,17 @@ with st.sidebar:
     """, unsafe_allow_html=True)
     st.divider()
     page = st.radio("", ["Dashboard","Masterfile Manager"], label_visibility="collapsed")
+    st.toggle("Profile sections", value=st.query_params.get("profile") == "1", key="profile",
+              help="Time each section and Masterfile step (wall time, rows, tracemalloc peak). Tracing slows the app.")
     st.divider()
     st.markdown(f'<div style="font-size:.56rem; color:rgba(255,255,255,0.22); text-align:center; line-height:1.5;">Report generated<br>{datetime.now().strftime("%d %b %Y · %H:%M")}</div>', unsafe_allow_html=True)
 
+# Profiling: number each run, keep the log bounded. Tracing is on only while
+# some session's stage is being measured (engine.measure), never left running
+if st.session_state.profile:
+    st.session_state.prof_run = st.session_state.get("prof_run", 0) + 1
+    st.session_state.prof_log = st.session_state.get("prof_log", [])[-PROFILE_KEEP:]
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # HEADER
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -343,182 +332,213 @@ st.markdown(f"""
 # ═══════════════════════════════════════════════════════════════════════════════
 # INITIAL UPLOAD
 # ═══════════════════════════════════════════════════════════════════════════════
-if st.session_state.master is None:
-    st.markdown("""<div class="wf"><b>Getting started</b> — Upload your Salesforce export or existing Masterfile (.xlsx / .csv). The app detects the format and adds team columns if needed.</div>""", unsafe_allow_html=True)
-    f = st.file_uploader("Upload Salesforce Export or Masterfile", type=["xlsx","xls","csv"], label_visibility="collapsed")
+n_rows = derived("n_rows", store.count)
+if not n_rows:
+    st.markdown("""<div class="wf"><b>Getting started</b> — Upload your Salesforce export or existing Masterfile (.xlsx / .csv, gzip/zip CSV too). The app detects the format and adds team columns if needed.</div>""", unsafe_allow_html=True)
+    f = st.file_uploader("Upload Salesforce Export or Masterfile", type=UPLOAD_TYPES, label_visibility="collapsed")
     if f:
-        raw = pd.read_csv(f) if f.name.endswith(".csv") else pd.read_excel(f)
-        cl = clean_upload(raw)
-        for c in TEAM_COLS:
-            if c not in cl.columns: cl[c] = ""
-        cols = [c for c in ALL_COLS if c in cl.columns]
-        st.session_state.master = cl[cols]
+        cl = ingest_upload(f)
+        set_master(cl, "upload", f.name)
+        st.session_state.par_unparsed = cl.attrs.get("par_unparsed", 0)
         st.rerun()
     st.stop()
-
-df = st.session_state.master.copy()
-df["Opportunity PAR"] = df["Opportunity PAR"].apply(parse_par)
-df["Stage Duration"]  = pd.to_numeric(df.get("Stage Duration",0), errors="coerce").fillna(0).astype(int)
-df["Close Date Parsed"] = pd.to_datetime(df["Close Date"], errors="coerce")
-
-# Format display date columns
-df["Close Date Display"] = df["Close Date Parsed"].apply(fmt_date)
-
-if "Received by Solutions" in df.columns:
-    df["Received by Solutions Parsed"] = pd.to_datetime(df["Received by Solutions"], errors="coerce")
-    df["Received Display"] = df["Received by Solutions Parsed"].apply(fmt_date)
-else:
-    df["Received by Solutions Parsed"] = pd.NaT
-    df["Received Display"] = "—"
-
-if "Closed by Solutions" in df.columns:
-    df["Closed by Solutions Parsed"] = pd.to_datetime(df["Closed by Solutions"], errors="coerce")
-    df["Closed Display"] = df["Closed by Solutions Parsed"].apply(fmt_date)
-else:
-    df["Closed by Solutions Parsed"] = pd.NaT
-    df["Closed Display"] = "—"
-
-if "Status" not in df.columns: df["Status"] = "Unassigned"
-else: df["Status"] = df["Status"].fillna("Unassigned")
-if "Product" not in df.columns: df["Product"] = "General"
-else: df["Product"] = df["Product"].fillna("General")
-
+if st.session_state.get("par_unparsed"):
+    st.warning(f"{st.session_state.pop('par_unparsed'):,} Opportunity PAR value(s) in the upload could not be read as a number and were set to 0.")
+
+# Small stores are loaded whole and filtered in memory (bitmap index); large
+# ones stay in SQLite, which filters and rolls up before anything is loaded.
+pushdown = n_rows > PUSHDOWN_ROWS
+data_ver = st.session_state.master_ver
+with stage("Prepare · frame, cube, filter index", n_rows):
+    if pushdown:
+        opts = derived("opts", store.options)
+        years = derived("years", store.close_years)
+    else:
+        df = derived("df", lambda: prepare_frame(current_master()))
+        cube = derived("cube", lambda: build_cube(df))
+        fidx = derived("fidx", lambda: build_filter_index(df))
+        cidx = derived("cidx", lambda: build_filter_index(cube))
+        opts = {c: cidx[c][0] for c in FILTER_COLS}
+        mem_now, mem_saved = derived("mem", lambda: schema_memory(current_master()))
+with st.sidebar:
+    if pushdown:
+        st.markdown(f'<div style="font-size:.56rem; color:rgba(255,255,255,0.22); text-align:center; line-height:1.5; margin-top:.6rem;">Masterfile in store<br>{n_rows:,} rows · filtered in SQL</div>', unsafe_allow_html=True)
+    else:
+        st.markdown(f'<div style="font-size:.56rem; color:rgba(255,255,255,0.22); text-align:center; line-height:1.5; margin-top:.6rem;">Masterfile in memory<br>{mem_now/2**20:.1f} MB · {mem_saved/2**20:.1f} MB saved by typed columns</div>', unsafe_allow_html=True)
 TODAY = pd.Timestamp.now().normalize()
 
-# Solutions Cycle Time
-if "Received by Solutions Parsed" in df.columns and "Closed by Solutions Parsed" in df.columns:
-    df["Solutions Cycle Days"] = (df["Closed by Solutions Parsed"] - df["Received by Solutions Parsed"]).dt.days
-else:
-    df["Solutions Cycle Days"] = np.nan
+
+def filtered_view(key, build):
+    """Single-slot memo of the pushed-down (fdf, fcube) — only the current
+    filter state's rows are held, replaced when the filters or data change."""
+    ss = st.session_state
+    if ss.get("view_key") != (ss.master_ver, key):
+        ss.view_key, ss.view = (ss.master_ver, key), build()
+    return ss.view
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-#  DASHBOARD
+#  DASHBOARD SECTIONS
 # ═══════════════════════════════════════════════════════════════════════════════
-if page == "Dashboard":
-
-    # ── Filters ──────────────────────────────────────────────────────────────
-    with st.expander("Filters", expanded=False):
-        f1,f2,f3 = st.columns(3)
-        sel_st = f1.multiselect("Stage", sorted(df["Stage"].dropna().unique()), default=sorted(df["Stage"].dropna().unique()))
-        sel_sv = f2.multiselect("Service", sorted(df["Main Primary Service"].dropna().unique()), default=sorted(df["Main Primary Service"].dropna().unique()))
-        sel_rg = f3.multiselect("Region", sorted(df["Owner Role"].dropna().unique()), default=sorted(df["Owner Role"].dropna().unique()))
-        f4,f5,f6 = st.columns(3)
-        sel_rs = f4.multiselect("Solution Resource", sorted(df["Solution Resource"].dropna().unique()), default=sorted(df["Solution Resource"].dropna().unique()))
-        sel_status = f5.multiselect("Status", sorted(df["Status"].dropna().unique()), default=sorted(df["Status"].dropna().unique()))
-        sel_product = f6.multiselect("Product", sorted(df["Product"].dropna().unique()), default=sorted(df["Product"].dropna().unique()))
-
-    fdf = df[
-        df["Stage"].isin(sel_st) & df["Main Primary Service"].isin(sel_sv) &
-        df["Owner Role"].isin(sel_rg) & df["Solution Resource"].isin(sel_rs) &
-        df["Status"].isin(sel_status) & df["Product"].isin(sel_product)
-    ]
-
-    total    = fdf["Opportunity PAR"].sum()
-    n_opp    = len(fdf)
-    n_cust   = fdf["Account Name"].nunique()
-    n_svc    = fdf["Main Primary Service"].nunique()
-    avg_deal = fdf["Opportunity PAR"].mean() if n_opp else 0
-    avg_dur  = fdf["Stage Duration"].mean() if n_opp else 0
-    past_due = fdf[fdf["Close Date Parsed"] < TODAY]
-    aging_60 = fdf[fdf["Stage Duration"] > 60]
-
-    n_working    = len(fdf[fdf["Status"]=="Working"])
-    n_pending    = len(fdf[fdf["Status"]=="Pending"])
-    n_unassigned = len(fdf[fdf["Status"]=="Unassigned"])
-    n_products   = fdf[fdf["Product"]!="General"]["Product"].nunique()
-
-    # Solutions date metrics (used in KPIs and Section 2)
-    _rcv = fdf.dropna(subset=["Received by Solutions Parsed"]) if "Received by Solutions Parsed" in fdf.columns else pd.DataFrame()
-    _cls = fdf.dropna(subset=["Closed by Solutions Parsed"]) if "Closed by Solutions Parsed" in fdf.columns else pd.DataFrame()
-    n_received   = len(_rcv)
-    pct_received = f"{n_received/n_opp*100:.0f}%" if n_opp else "0%"
-
-    # ── KPIs ─────────────────────────────────────────────────────────────────
-    st.markdown(f"""
-    <div class="kr">
-        <div class="kp" style="--ac:{TL};"><div class="kp-l">Pipeline Value</div><div class="kp-v">{fc(total)}</div><div class="kp-d">{n_opp} opportunities</div></div>
-        <div class="kp" style="--ac:{NY};"><div class="kp-l">Customers</div><div class="kp-v">{n_cust}</div><div class="kp-d">Unique accounts</div></div>
-        <div class="kp" style="--ac:{GD};"><div class="kp-l">Products in Scope</div><div class="kp-v">{n_svc}</div><div class="kp-d">{n_products} tagged product(s)</div></div>
-        <div class="kp" style="--ac:{BA};"><div class="kp-l">Avg Deal Size</div><div class="kp-v">{fc(avg_deal)}</div><div class="kp-d">Per opportunity</div></div>
-        <div class="kp" style="--ac:{TL};"><div class="kp-l">Solutions Received</div><div class="kp-v">{n_received}</div><div class="kp-d">{pct_received} of pipeline</div></div>
-        <div class="kp" style="--ac:{G400};"><div class="kp-l">Avg Stage Duration</div><div class="kp-v">{avg_dur:.0f}d</div><div class="kp-d">{len(aging_60)} over 60 days</div></div>
-        <div class="kp" style="--ac:{RD};"><div class="kp-l">Past Close Date</div><div class="kp-v">{len(past_due)}</div><div class="kp-d">{fc(past_due['Opportunity PAR'].sum())} at risk</div></div>
-    </div>
-    """, unsafe_allow_html=True)
-
-    spacer("lg")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 1 — PIPELINE OVERVIEW
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">1 · Pipeline Overview</div>', unsafe_allow_html=True)
-    spacer("md")
-
+# Each section is a build/show pair. build(v) does the aggregation and figure
+# work for the filtered view `v` and is memoized per (version, filter state);
+# show(r, v) only lays the result out. Sections that are not open never build.
+
+def so(text):
+    st.markdown(f'<p class="so">{text}</p>', unsafe_allow_html=True)
+
+
+STG_COLORS = {"Information Gathering":G400, "Solutions Design":TL, "Proposal/Price Quote":BA,
+              "Proposal Price/Quote":BA, "Negotiations":GD, "Closed/Won":GN, "Closed/Lost":RD}
+
+
+# ── 1 · Pipeline Overview ────────────────────────────────────────────────────
+def build_overview(v):
+    sg = rollup(v.fcube, "Stage")
+    sg["StageOrd"] = sg["Stage"].apply(lambda x: STAGE_ORDER.index(x) if x in STAGE_ORDER else 99)
+    sg = sg.sort_values("StageOrd")
+    colors = []
+    for s in sg["Stage"]:
+        if "Closed/Lost" in s:    colors.append(RD)
+        elif "Closed/Won" in s:   colors.append(GN)
+        elif "Negotiation" in s:  colors.append(GD)
+        elif "Proposal" in s:     colors.append(BA)
+        elif "Design" in s:       colors.append(TL)
+        else:                     colors.append(G400)
+    fig = go.Figure(go.Bar(
+        x=sg["Stage"], y=sg["Value"], marker_color=colors,
+        text=[f"{fc(v)}<br><span style='font-size:9px;color:{G600}'>{c} opps</span>" for v,c in zip(sg["Value"],sg["Count"])],
+        textposition="outside", textfont=dict(size=10.5),
+    ))
+    pl(fig, h=410, mb=16)
+    fig.update_layout(showlegend=False, yaxis=dict(visible=False))
+    fig.update_xaxes(showgrid=False, tickfont=dict(size=10))
+    fig.update_yaxes(showgrid=False, showline=False)
+
+    fig2 = make_subplots(rows=1, cols=2, specs=[[{"type":"pie"},{"type":"pie"}]],
+                         subplot_titles=["By Value","By Count"], horizontal_spacing=0.08)
+    fig2.add_trace(go.Pie(labels=sg["Stage"], values=sg["Value"], hole=.52,
+        marker=dict(colors=colors), textinfo="percent", textfont=dict(size=10),
+        hovertemplate="<b>%{label}</b><br>$%{value:,.0f}<extra></extra>", sort=False), 1, 1)
+    fig2.add_trace(go.Pie(labels=sg["Stage"], values=sg["Count"], hole=.52,
+        marker=dict(colors=colors), textinfo="percent", textfont=dict(size=10),
+        hovertemplate="<b>%{label}</b><br>%{value} opps<extra></extra>", sort=False), 1, 2)
+    pl(fig2, h=410)
+    fig2.update_layout(showlegend=False)
+    fig2.update_annotations(font=dict(size=10, color=G600))
+    return dict(fig=fig, fig2=fig2)
+
+
+def show_overview(r, v):
     p1a, _, p1b = st.columns([1.08, 0.08, 0.84])
-
     with p1a:
-        st.markdown('<p class="so">Solutions Design holds the bulk of pipeline — most value remains in early stages</p>', unsafe_allow_html=True)
-        sg = fdf.groupby("Stage").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count")).reset_index()
-        sg["StageOrd"] = sg["Stage"].apply(lambda x: STAGE_ORDER.index(x) if x in STAGE_ORDER else 99)
-        sg = sg.sort_values("StageOrd")
-        colors = []
-        for s in sg["Stage"]:
-            if "Closed/Lost" in s:    colors.append(RD)
-            elif "Closed/Won" in s:   colors.append(GN)
-            elif "Negotiation" in s:  colors.append(GD)
-            elif "Proposal" in s:     colors.append(BA)
-            elif "Design" in s:       colors.append(TL)
-            else:                     colors.append(G400)
-        fig = go.Figure(go.Bar(
-            x=sg["Stage"], y=sg["Value"], marker_color=colors,
-            text=[f"{fc(v)}<br><span style='font-size:9px;color:{G600}'>{c} opps</span>" for v,c in zip(sg["Value"],sg["Count"])],
-            textposition="outside", textfont=dict(size=10.5),
-        ))
-        pl(fig, h=410, mb=16)
-        fig.update_layout(showlegend=False, yaxis=dict(visible=False))
-        fig.update_xaxes(showgrid=False, tickfont=dict(size=10))
-        fig.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig, use_container_width=True)
-
+        so("Solutions Design holds the bulk of pipeline — most value remains in early stages")
+        st.plotly_chart(r["fig"], use_container_width=True)
     with p1b:
-        st.markdown('<p class="so">Stage composition — value vs. count</p>', unsafe_allow_html=True)
-        sg2 = sg.copy()
-        fig2 = make_subplots(rows=1, cols=2, specs=[[{"type":"pie"},{"type":"pie"}]],
-                             subplot_titles=["By Value","By Count"], horizontal_spacing=0.08)
-        fig2.add_trace(go.Pie(labels=sg2["Stage"], values=sg2["Value"], hole=.52,
-            marker=dict(colors=colors), textinfo="percent", textfont=dict(size=10),
-            hovertemplate="<b>%{label}</b><br>$%{value:,.0f}<extra></extra>", sort=False), 1, 1)
-        fig2.add_trace(go.Pie(labels=sg2["Stage"], values=sg2["Count"], hole=.52,
-            marker=dict(colors=colors), textinfo="percent", textfont=dict(size=10),
-            hovertemplate="<b>%{label}</b><br>%{value} opps<extra></extra>", sort=False), 1, 2)
-        pl(fig2, h=410)
-        fig2.update_layout(showlegend=False)
-        fig2.update_annotations(font=dict(size=10, color=G600))
-        st.plotly_chart(fig2, use_container_width=True)
-
-    spacer("xl")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 2 — STATUS & SOLUTIONS VELOCITY
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">2 · Solutions Status & Velocity</div>', unsafe_allow_html=True)
-    spacer("md")
+        so("Stage composition — value vs. count")
+        st.plotly_chart(r["fig2"], use_container_width=True)
+
+
+# ── 2 · Solutions Status & Velocity ──────────────────────────────────────────
+def build_status(v):
+    stat_g = rollup(v.fcube, "Status").sort_values("Count", ascending=False)
+    stat_colors = [STATUS_COLORS.get(s, G400) for s in stat_g["Status"]]
+    fig_stat = go.Figure(go.Bar(
+        x=stat_g["Status"], y=stat_g["Count"], marker_color=stat_colors,
+        text=[f"{c}<br><span style='font-size:9px;color:{G600}'>{fc(v)}</span>" for c,v in zip(stat_g["Count"],stat_g["Value"])],
+        textposition="outside", textfont=dict(size=11),
+    ))
+    pl(fig_stat, h=380, mb=16)
+    fig_stat.update_layout(showlegend=False, yaxis=dict(visible=False), bargap=0.4)
+    fig_stat.update_xaxes(showgrid=False)
+    fig_stat.update_yaxes(showgrid=False, showline=False)
+
+    fig_stat2 = go.Figure(go.Pie(
+        labels=stat_g["Status"], values=stat_g["Value"], hole=.55,
+        marker=dict(colors=stat_colors),
+        textinfo="label+percent", textfont=dict(size=10.5),
+        hovertemplate="<b>%{label}</b><br>$%{value:,.0f}<br>%{percent}<extra></extra>",
+    ))
+    pl(fig_stat2, h=380)
+    fig_stat2.update_layout(showlegend=False)
 
-    # ── Solutions Coverage KPIs ──────────────────────────────────────────
-    rcv_col = _rcv
-    cls_col = _cls
-    n_closed   = len(cls_col)
-    pct_closed = f"{n_closed/n_opp*100:.0f}%" if n_opp else "0%"
-    cycle_days = fdf["Solutions Cycle Days"].dropna()
-    avg_cycle  = f"{cycle_days.mean():.0f}d" if len(cycle_days) else "—"
+    rs_stat = cross(v.fcube, "Solution Resource", "Status", "Count").astype(int)
+    status_order = ["Working","Pending","Unassigned"]
+    rs_stat = rs_stat[[c for c in status_order if c in rs_stat.columns] + [c for c in rs_stat.columns if c not in status_order]]
+    fig_rs = go.Figure(go.Heatmap(
+        z=rs_stat.values, x=rs_stat.columns.tolist(), y=rs_stat.index.tolist(),
+        colorscale=[[0,W],[.25,TLL],[.6,TL],[1,NY]],
+        text=rs_stat.values, texttemplate="%{text}", textfont=dict(size=12.5),
+        hovertemplate="Resource: %{y}<br>Status: %{x}<br>Count: %{z}<extra></extra>",
+        showscale=False, xgap=4, ygap=4,
+    ))
+    pl(fig_rs, h=max(260, 48*len(rs_stat)), mt=8)
+    fig_rs.update_layout(xaxis=dict(tickfont=dict(size=10.5), side="top"), yaxis=dict(tickfont=dict(size=10.5), autorange="reversed"))
+    fig_rs.update_xaxes(showgrid=False, showline=False)
+    fig_rs.update_yaxes(showgrid=False, showline=False)
 
+    r = dict(fig_stat=fig_stat, fig_stat2=fig_stat2, fig_rs=fig_rs, fig_rcv=None, lf=None)
+    if len(v.rcv):
+        rcv_t = v.rcv.copy()
+        rcv_t["Rcv Week"] = rcv_t["Received by Solutions Parsed"].dt.to_period("W").dt.to_timestamp()
+        wk = rcv_t.groupby("Rcv Week").agg(Count=("Opportunity Name","count"), Value=("Opportunity PAR","sum")).reset_index().sort_values("Rcv Week")
+        fig_rcv = go.Figure()
+        fig_rcv.add_trace(go.Bar(x=wk["Rcv Week"], y=wk["Count"], marker_color=TL, name="Received",
+            text=[f"{c}<br><span style='font-size:9px;color:{G600}'>{fc(v)}</span>" for c,v in zip(wk["Count"],wk["Value"])],
+            textposition="outside", textfont=dict(size=10.5)))
+        pl(fig_rcv, h=380, mb=20)
+        fig_rcv.update_layout(showlegend=False, yaxis=dict(visible=False), bargap=0.35,
+            xaxis=dict(tickformat="%d-%b-%Y", tickfont=dict(size=9.5)))
+        fig_rcv.update_xaxes(showgrid=False)
+        fig_rcv.update_yaxes(showgrid=False, showline=False)
+        r["fig_rcv"] = fig_rcv
+
+        lf = v.rcv[["Account Name","Received by Solutions Parsed","Closed by Solutions Parsed",
+                    "Opportunity PAR","Status"]].copy()
+        lf["End"] = lf["Closed by Solutions Parsed"].fillna(TODAY)
+        r["lf"] = lf
+    return r
+
+
+def lifecycle_fig(lf, w0, w1):
+    """Solutions lifecycle Gantt — one bar trace, per-bar base/length/colour
+    and hover text via customdata."""
+    is_closed = lf["Closed by Solutions Parsed"].notna().to_numpy()
+    acct = lf["Account Name"].astype(str)
+    fig_lf = go.Figure(go.Bar(
+        y=acct.where(acct.str.len() <= 22, acct.str[:22]+"…"),
+        x=(lf["End"]-lf["Received by Solutions Parsed"]).dt.total_seconds()*1000,   # ms on a date axis
+        base=lf["Received by Solutions Parsed"],
+        orientation="h", marker_color=np.where(is_closed, GN, TL), marker_line=dict(width=0),
+        showlegend=False,
+        customdata=np.column_stack([
+            acct, lf["Received by Solutions Parsed"].dt.strftime(DATE_FMT),
+            np.where(is_closed, "Closed: "+lf["Closed by Solutions Parsed"].dt.strftime(DATE_FMT).fillna(""), "Open (in progress)"),
+            [fc(v) for v in lf["Opportunity PAR"]]]),
+        hovertemplate="<b>%{customdata[0]}</b><br>Received: %{customdata[1]}<br>%{customdata[2]}<br>Value: %{customdata[3]}<extra></extra>",
+    ))
+    # Add legend manually
+    fig_lf.add_trace(go.Bar(y=[None], x=[None], marker_color=GN, name="Closed", showlegend=True))
+    fig_lf.add_trace(go.Bar(y=[None], x=[None], marker_color=TL, name="Open", showlegend=True))
+    pl(fig_lf, h=max(380, 48*len(lf)), mb=20)
+    fig_lf.update_layout(
+        barmode="overlay", yaxis=dict(tickfont=dict(size=9.5), autorange="reversed"),
+        xaxis=dict(tickformat="%d-%b-%Y", tickfont=dict(size=9), range=[w0, w1]),
+        legend=dict(font=dict(size=9), orientation="h", y=-0.12, x=0.5, xanchor="center"),
+    )
+    fig_lf.update_xaxes(showgrid=True, gridcolor=G200, gridwidth=0.4, showline=False)
+    fig_lf.update_yaxes(showgrid=False, showline=False)
+    return fig_lf
+
+
+def show_status(r, v):
+    # ── Solutions Coverage KPIs ──────────────────────────────────────────
     st.markdown(f"""
     <div class="kr">
-        <div class="kp" style="--ac:{TL};"><div class="kp-l">Received by Solutions</div><div class="kp-v">{n_received}</div><div class="kp-d">{pct_received} of pipeline</div></div>
-        <div class="kp" style="--ac:{GN};"><div class="kp-l">Closed by Solutions</div><div class="kp-v">{n_closed}</div><div class="kp-d">{pct_closed} of pipeline</div></div>
-        <div class="kp" style="--ac:{BA};"><div class="kp-l">Avg Cycle Time</div><div class="kp-v">{avg_cycle}</div><div class="kp-d">Received → Closed</div></div>
-        <div class="kp" style="--ac:{GN};"><div class="kp-l">Status: Working</div><div class="kp-v">{n_working}</div><div class="kp-d">{n_pending} pending · {n_unassigned} unassigned</div></div>
+        <div class="kp" style="--ac:{TL};"><div class="kp-l">Received by Solutions</div><div class="kp-v">{v.n_received}</div><div class="kp-d">{v.pct_received} of pipeline</div></div>
+        <div class="kp" style="--ac:{GN};"><div class="kp-l">Closed by Solutions</div><div class="kp-v">{v.n_closed}</div><div class="kp-d">{v.pct_closed} of pipeline</div></div>
+        <div class="kp" style="--ac:{BA};"><div class="kp-l">Avg Cycle Time</div><div class="kp-v">{v.avg_cycle}</div><div class="kp-d">Received → Closed</div></div>
+        <div class="kp" style="--ac:{GN};"><div class="kp-l">Status: Working</div><div class="kp-v">{v.n_working}</div><div class="kp-d">{v.n_pending} pending · {v.n_unassigned} unassigned</div></div>
     </div>
     """, unsafe_allow_html=True)
 
@@ -526,167 +546,83 @@ if page == "Dashboard":
 
     # ── Row 1: Status bar + Status donut ─────────────────────────────────
     s2a, _, s2b = st.columns([0.52, 0.06, 0.42])
-
     with s2a:
-        st.markdown('<p class="so">Opportunity status distribution — workload snapshot</p>', unsafe_allow_html=True)
-        stat_g = fdf.groupby("Status").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count")).reset_index().sort_values("Count", ascending=False)
-        stat_colors = [STATUS_COLORS.get(s, G400) for s in stat_g["Status"]]
-        fig_stat = go.Figure(go.Bar(
-            x=stat_g["Status"], y=stat_g["Count"], marker_color=stat_colors,
-            text=[f"{c}<br><span style='font-size:9px;color:{G600}'>{fc(v)}</span>" for c,v in zip(stat_g["Count"],stat_g["Value"])],
-            textposition="outside", textfont=dict(size=11),
-        ))
-        pl(fig_stat, h=380, mb=16)
-        fig_stat.update_layout(showlegend=False, yaxis=dict(visible=False), bargap=0.4)
-        fig_stat.update_xaxes(showgrid=False)
-        fig_stat.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig_stat, use_container_width=True)
-
+        so("Opportunity status distribution — workload snapshot")
+        st.plotly_chart(r["fig_stat"], use_container_width=True)
     with s2b:
-        st.markdown('<p class="so">Status × pipeline value share</p>', unsafe_allow_html=True)
-        fig_stat2 = go.Figure(go.Pie(
-            labels=stat_g["Status"], values=stat_g["Value"], hole=.55,
-            marker=dict(colors=stat_colors),
-            textinfo="label+percent", textfont=dict(size=10.5),
-            hovertemplate="<b>%{label}</b><br>$%{value:,.0f}<br>%{percent}<extra></extra>",
-        ))
-        pl(fig_stat2, h=380)
-        fig_stat2.update_layout(showlegend=False)
-        st.plotly_chart(fig_stat2, use_container_width=True)
+        so("Status × pipeline value share")
+        st.plotly_chart(r["fig_stat2"], use_container_width=True)
 
     spacer("lg")
 
     # ── Row 2: Solutions intake timeline + Lifecycle view ────────────────
     s2c, _, s2d = st.columns([0.52, 0.06, 0.42])
-
     with s2c:
-        st.markdown('<p class="so">Solutions intake timeline — when opportunities were received</p>', unsafe_allow_html=True)
-        if "Received by Solutions Parsed" in fdf.columns and len(rcv_col):
-            rcv_t = rcv_col.copy()
-            rcv_t["Rcv Week"] = rcv_t["Received by Solutions Parsed"].dt.to_period("W").dt.to_timestamp()
-            wk = rcv_t.groupby("Rcv Week").agg(Count=("Opportunity Name","count"), Value=("Opportunity PAR","sum")).reset_index().sort_values("Rcv Week")
-            fig_rcv = go.Figure()
-            fig_rcv.add_trace(go.Bar(x=wk["Rcv Week"], y=wk["Count"], marker_color=TL, name="Received",
-                text=[f"{c}<br><span style='font-size:9px;color:{G600}'>{fc(v)}</span>" for c,v in zip(wk["Count"],wk["Value"])],
-                textposition="outside", textfont=dict(size=10.5)))
-            pl(fig_rcv, h=380, mb=20)
-            fig_rcv.update_layout(showlegend=False, yaxis=dict(visible=False), bargap=0.35,
-                xaxis=dict(tickformat="%d-%b-%Y", tickfont=dict(size=9.5)))
-            fig_rcv.update_xaxes(showgrid=False)
-            fig_rcv.update_yaxes(showgrid=False, showline=False)
-            st.plotly_chart(fig_rcv, use_container_width=True)
-        else:
-            st.info("No 'Received by Solutions' dates populated yet.")
+        so("Solutions intake timeline — when opportunities were received")
+        if r["fig_rcv"] is not None: st.plotly_chart(r["fig_rcv"], use_container_width=True)
+        else: st.info("No 'Received by Solutions' dates populated yet.")
 
     with s2d:
-        st.markdown('<p class="so">Solutions lifecycle — received vs. closed per opportunity</p>', unsafe_allow_html=True)
-        if "Received by Solutions Parsed" in fdf.columns and len(rcv_col):
-            lf = rcv_col[["Account Name","Received by Solutions Parsed","Closed by Solutions Parsed",
-                          "Opportunity PAR","Status"]].copy()
-            lf = lf.sort_values("Received by Solutions Parsed")
-            lf["End"] = lf["Closed by Solutions Parsed"].fillna(TODAY)
-            lf["Acct Short"] = lf["Account Name"].apply(lambda x: (x[:22]+"…") if len(str(x))>22 else x)
-            lf["Is Closed"] = lf["Closed by Solutions Parsed"].notna()
-
-            fig_lf = go.Figure()
-            for idx, row in lf.iterrows():
-                clr = GN if row["Is Closed"] else TL
-                fig_lf.add_trace(go.Bar(
-                    y=[row["Acct Short"]], x=[(row["End"]-row["Received by Solutions Parsed"]).days],
-                    base=[row["Received by Solutions Parsed"]],
-                    orientation="h", marker_color=clr, marker_line=dict(width=0),
-                    showlegend=False,
-                    hovertemplate=(
-                        f"<b>{row['Account Name']}</b><br>"
-                        f"Received: {fmt_date(row['Received by Solutions Parsed'])}<br>"
-                        f"{'Closed: '+fmt_date(row['Closed by Solutions Parsed']) if row['Is Closed'] else 'Open (in progress)'}<br>"
-                        f"Value: {fc(row['Opportunity PAR'])}<extra></extra>"
-                    ),
-                ))
-            # Add legend manually
-            fig_lf.add_trace(go.Bar(y=[None], x=[None], marker_color=GN, name="Closed", showlegend=True))
-            fig_lf.add_trace(go.Bar(y=[None], x=[None], marker_color=TL, name="Open", showlegend=True))
-            pl(fig_lf, h=max(380, 48*len(lf)), mb=20)
-            fig_lf.update_layout(
-                barmode="overlay", yaxis=dict(tickfont=dict(size=9.5), autorange="reversed"),
-                xaxis=dict(tickformat="%d-%b-%Y", tickfont=dict(size=9)),
-                legend=dict(font=dict(size=9), orientation="h", y=-0.12, x=0.5, xanchor="center"),
-            )
-            fig_lf.update_xaxes(showgrid=True, gridcolor=G200, gridwidth=0.4, showline=False)
-            fig_lf.update_yaxes(showgrid=False, showline=False)
-            st.plotly_chart(fig_lf, use_container_width=True)
+        so("Solutions lifecycle — received vs. closed per opportunity")
+        if r["lf"] is not None:
+            lf = r["lf"]
+            # ── View: top-N by value or paged, limited to a time window ──
+            lo, hi = lf["Received by Solutions Parsed"].min().date(), max(lf["End"].max(), lf["Received by Solutions Parsed"].max()).date()
+            v1, v2, v3 = st.columns([0.4, 0.2, 0.4])
+            lf_mode = v1.selectbox("Rows", [f"Top {LF_ROWS} by value", f"All · {LF_ROWS} per page"], key="lf_mode", label_visibility="collapsed")
+            win = v3.date_input("Window", (lo, hi), min_value=lo, max_value=hi, format="DD/MM/YYYY", key="lf_win", label_visibility="collapsed")
+            w0, w1 = (win[0], win[1]) if len(win) == 2 else (lo, hi)
+            w0, w1 = pd.Timestamp(w0), pd.Timestamp(w1) + pd.Timedelta(days=1)
+            lf = lf[(lf["Received by Solutions Parsed"] < w1) & (lf["End"] >= w0)]
+            if lf_mode.startswith("Top"):
+                lf = lf.nlargest(LF_ROWS, "Opportunity PAR")
+                v2.caption(f"{len(lf)} shown")
+            else:
+                n_pg = max(1, -(-len(lf) // LF_ROWS))
+                pg = v2.number_input("Page", 1, n_pg, 1, key="lf_page", label_visibility="collapsed")
+                lf = lf.sort_values("Received by Solutions Parsed").iloc[(pg-1)*LF_ROWS : pg*LF_ROWS]
+            st.plotly_chart(cached(("lifecycle", v.data_ver, v.sig, lf_mode, w0, w1, len(lf) and lf.index[0]),
+                                   lambda: lifecycle_fig(lf.sort_values("Received by Solutions Parsed"), w0, w1)), use_container_width=True)
         else:
             st.info("No lifecycle data available yet.")
 
     spacer("lg")
 
     # ── Resource × Status heatmap ────────────────────────────────────────
-    st.markdown('<p class="so">Solution Resource workload by status — identify capacity constraints and bottlenecks</p>', unsafe_allow_html=True)
-    rs_stat = pd.crosstab(fdf["Solution Resource"], fdf["Status"], values=fdf["Opportunity Name"], aggfunc="count").fillna(0).astype(int)
-    status_order = ["Working","Pending","Unassigned"]
-    rs_stat = rs_stat[[c for c in status_order if c in rs_stat.columns] + [c for c in rs_stat.columns if c not in status_order]]
-    fig_rs = go.Figure(go.Heatmap(
-        z=rs_stat.values, x=rs_stat.columns.tolist(), y=rs_stat.index.tolist(),
+    so("Solution Resource workload by status — identify capacity constraints and bottlenecks")
+    st.plotly_chart(r["fig_rs"], use_container_width=True)
+
+
+# ── 3 · Product Segmentation ─────────────────────────────────────────────────
+def build_product(v):
+    prod_g = rollup(v.fcube, "Product").sort_values("Value", ascending=False)
+    top_prod = prod_g.iloc[0]["Product"] if len(prod_g) else "N/A"
+    top_prod_pct = prod_g.iloc[0]["Value"]/prod_g["Value"].sum()*100 if len(prod_g) and prod_g["Value"].sum()>0 else 0
+    prod_colors = [SEQ[i%len(SEQ)] for i in range(len(prod_g))]
+    fig_prod = go.Figure(go.Bar(
+        x=prod_g["Product"], y=prod_g["Value"], marker_color=prod_colors,
+        text=[f"{fc(v)}<br><span style='font-size:9px;color:{G600}'>{c} opps</span>" for v,c in zip(prod_g["Value"],prod_g["Count"])],
+        textposition="outside", textfont=dict(size=10.5),
+    ))
+    pl(fig_prod, h=400, mb=16)
+    fig_prod.update_layout(showlegend=False, yaxis=dict(visible=False), bargap=0.35)
+    fig_prod.update_xaxes(showgrid=False, tickfont=dict(size=10.5))
+    fig_prod.update_yaxes(showgrid=False, showline=False)
+
+    pr_ht = cross(v.fcube, "Product", "Owner Role")
+    fig_pr = go.Figure(go.Heatmap(
+        z=pr_ht.values, x=pr_ht.columns.tolist(), y=pr_ht.index.tolist(),
         colorscale=[[0,W],[.25,TLL],[.6,TL],[1,NY]],
-        text=rs_stat.values, texttemplate="%{text}", textfont=dict(size=12.5),
-        hovertemplate="Resource: %{y}<br>Status: %{x}<br>Count: %{z}<extra></extra>",
+        text=[[fc(v) for v in row] for row in pr_ht.values], texttemplate="%{text}", textfont=dict(size=11.5),
+        hovertemplate="Product: %{y}<br>Region: %{x}<br>Value: $%{z:,.0f}<extra></extra>",
         showscale=False, xgap=4, ygap=4,
     ))
-    pl(fig_rs, h=max(260, 48*len(rs_stat)), mt=8)
-    fig_rs.update_layout(xaxis=dict(tickfont=dict(size=10.5), side="top"), yaxis=dict(tickfont=dict(size=10.5), autorange="reversed"))
-    fig_rs.update_xaxes(showgrid=False, showline=False)
-    fig_rs.update_yaxes(showgrid=False, showline=False)
-    st.plotly_chart(fig_rs, use_container_width=True)
-
-    spacer("xl")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 3 — PRODUCT ANALYSIS
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">3 · Product Segmentation</div>', unsafe_allow_html=True)
-    spacer("md")
+    pl(fig_pr, h=max(280, 66*len(pr_ht)), mt=8)
+    fig_pr.update_layout(xaxis=dict(tickfont=dict(size=10.5), side="top"), yaxis=dict(tickfont=dict(size=10.5), autorange="reversed"))
+    fig_pr.update_xaxes(showgrid=False, showline=False)
+    fig_pr.update_yaxes(showgrid=False, showline=False)
 
-    p3a, _, p3b = st.columns([0.48, 0.06, 0.46])
-
-    with p3a:
-        prod_g = fdf.groupby("Product").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-            Avg=("Opportunity PAR","mean")).reset_index().sort_values("Value", ascending=False)
-        top_prod = prod_g.iloc[0]["Product"] if len(prod_g) else "N/A"
-        top_prod_pct = prod_g.iloc[0]["Value"]/prod_g["Value"].sum()*100 if len(prod_g) and prod_g["Value"].sum()>0 else 0
-        st.markdown(f'<p class="so">{top_prod} represents {top_prod_pct:.0f}% of pipeline by value</p>', unsafe_allow_html=True)
-        prod_colors = [SEQ[i%len(SEQ)] for i in range(len(prod_g))]
-        fig_prod = go.Figure(go.Bar(
-            x=prod_g["Product"], y=prod_g["Value"], marker_color=prod_colors,
-            text=[f"{fc(v)}<br><span style='font-size:9px;color:{G600}'>{c} opps</span>" for v,c in zip(prod_g["Value"],prod_g["Count"])],
-            textposition="outside", textfont=dict(size=10.5),
-        ))
-        pl(fig_prod, h=400, mb=16)
-        fig_prod.update_layout(showlegend=False, yaxis=dict(visible=False), bargap=0.35)
-        fig_prod.update_xaxes(showgrid=False, tickfont=dict(size=10.5))
-        fig_prod.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig_prod, use_container_width=True)
-
-    with p3b:
-        st.markdown('<p class="so">Product × Region — strategic coverage</p>', unsafe_allow_html=True)
-        pr_ht = pd.crosstab(fdf["Product"], fdf["Owner Role"], values=fdf["Opportunity PAR"], aggfunc="sum").fillna(0)
-        fig_pr = go.Figure(go.Heatmap(
-            z=pr_ht.values, x=pr_ht.columns.tolist(), y=pr_ht.index.tolist(),
-            colorscale=[[0,W],[.25,TLL],[.6,TL],[1,NY]],
-            text=[[fc(v) for v in row] for row in pr_ht.values], texttemplate="%{text}", textfont=dict(size=11.5),
-            hovertemplate="Product: %{y}<br>Region: %{x}<br>Value: $%{z:,.0f}<extra></extra>",
-            showscale=False, xgap=4, ygap=4,
-        ))
-        pl(fig_pr, h=max(280, 66*len(pr_ht)), mt=8)
-        fig_pr.update_layout(xaxis=dict(tickfont=dict(size=10.5), side="top"), yaxis=dict(tickfont=dict(size=10.5), autorange="reversed"))
-        fig_pr.update_xaxes(showgrid=False, showline=False)
-        fig_pr.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig_pr, use_container_width=True)
-
-    spacer("lg")
-
-    # Product × Service
-    st.markdown('<p class="so">Product × Service cross-reference — identifying service-product alignment</p>', unsafe_allow_html=True)
-    ps_ht = pd.crosstab(fdf["Product"], fdf["Main Primary Service"], values=fdf["Opportunity PAR"], aggfunc="sum").fillna(0)
+    ps_ht = cross(v.fcube, "Product", "Main Primary Service")
     fig_ps = go.Figure(go.Heatmap(
         z=ps_ht.values, x=ps_ht.columns.tolist(), y=ps_ht.index.tolist(),
         colorscale=[[0,W],[.25,"#FFF8E1"],[.6,GD],[1,NY]],
@@ -698,104 +634,102 @@ if page == "Dashboard":
     fig_ps.update_layout(xaxis=dict(tickfont=dict(size=10), side="top"), yaxis=dict(tickfont=dict(size=10.5), autorange="reversed"))
     fig_ps.update_xaxes(showgrid=False, showline=False)
     fig_ps.update_yaxes(showgrid=False, showline=False)
-    st.plotly_chart(fig_ps, use_container_width=True)
-
-    spacer("xl")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 4 — CUSTOMER ANALYSIS
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">4 · Customer Concentration</div>', unsafe_allow_html=True)
-    spacer("md")
+    return dict(so=f"{top_prod} represents {top_prod_pct:.0f}% of pipeline by value",
+                fig_prod=fig_prod, fig_pr=fig_pr, fig_ps=fig_ps)
 
-    c2a, _, c2b = st.columns([1.08, 0.08, 0.84])
 
-    with c2a:
-        cu = fdf.groupby("Account Name").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count")).reset_index().sort_values("Value", ascending=False)
-        top5_pct = cu.head(5)["Value"].sum()/cu["Value"].sum()*100 if cu["Value"].sum()>0 else 0
-        st.markdown(f'<p class="so">Top 5 accounts represent {top5_pct:.0f}% of total pipeline — concentration risk to monitor</p>', unsafe_allow_html=True)
-        cu_top = cu.head(10).sort_values("Value", ascending=True)
-        fig3 = go.Figure(go.Bar(
-            y=cu_top["Account Name"], x=cu_top["Value"], orientation="h",
-            marker=dict(color=cu_top["Value"], colorscale=[[0,"#B2DFDB"],[.5,TL],[1,NY]], showscale=False),
-            text=[f"  {fc(v)}  ({c})" for v,c in zip(cu_top["Value"],cu_top["Count"])],
-            textposition="outside", textfont=dict(size=10.5, color=G800),
-        ))
-        pl(fig3, h=max(380, 44*len(cu_top)))
-        fig3.update_layout(showlegend=False, xaxis=dict(visible=False), yaxis=dict(tickfont=dict(size=10)))
-        fig3.update_xaxes(showgrid=False, showline=False)
-        fig3.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig3, use_container_width=True)
-
-    with c2b:
-        st.markdown('<p class="so">Cumulative concentration (Pareto curve)</p>', unsafe_allow_html=True)
-        cu_sorted = cu.sort_values("Value", ascending=False).reset_index(drop=True)
-        cu_sorted["CumVal"] = cu_sorted["Value"].cumsum()
-        cu_sorted["CumPct"] = cu_sorted["CumVal"]/cu_sorted["Value"].sum()*100
-        cu_sorted["Rank"]   = range(1, len(cu_sorted)+1)
-        fig4 = go.Figure()
-        fig4.add_trace(go.Bar(x=cu_sorted["Rank"], y=cu_sorted["Value"], marker_color=TL, name="Individual Value",
-            hovertemplate="<b>%{customdata}</b><br>$%{y:,.0f}<extra></extra>", customdata=cu_sorted["Account Name"]))
-        fig4.add_trace(go.Scatter(x=cu_sorted["Rank"], y=cu_sorted["CumPct"], mode="lines+markers",
-            line=dict(color=NY, width=2.5), marker=dict(size=5, color=NY), name="Cumulative %", yaxis="y2"))
-        fig4.add_hline(y=80, line_dash="dot", line_color=RD, opacity=0.45, annotation_text="80 %",
-            annotation_position="right", annotation_font=dict(size=9, color=RD), yref="y2")
-        pl(fig4, h=max(380, 44*len(cu_top)), mb=50)
-        fig4.update_layout(
-            yaxis=dict(visible=False),
-            yaxis2=dict(title="Cumulative %", titlefont=dict(size=9), side="right", overlaying="y", range=[0,108], showgrid=False),
-            xaxis=dict(title="Customer Rank", titlefont=dict(size=9.5), tickfont=dict(size=9.5)),
-            legend=dict(font=dict(size=8.5)),
-        )
-        fig4.update_xaxes(showgrid=False)
-        fig4.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig4, use_container_width=True)
-
-    spacer("xl")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 5 — PRODUCT / SERVICE MIX
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">5 · Product / Service Mix</div>', unsafe_allow_html=True)
-    spacer("md")
+def show_product(r, v):
+    p3a, _, p3b = st.columns([0.48, 0.06, 0.46])
+    with p3a:
+        so(r["so"])
+        st.plotly_chart(r["fig_prod"], use_container_width=True)
+    with p3b:
+        so("Product × Region — strategic coverage")
+        st.plotly_chart(r["fig_pr"], use_container_width=True)
 
-    s3a, _, s3b = st.columns([0.50, 0.06, 0.44])
+    spacer("lg")
 
-    with s3a:
-        sv = fdf.groupby("Main Primary Service").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-            Avg=("Opportunity PAR","mean")).reset_index().sort_values("Value", ascending=False)
-        top_svc = sv.iloc[0]["Main Primary Service"] if len(sv) else "N/A"
-        top_svc_pct = sv.iloc[0]["Value"]/sv["Value"].sum()*100 if len(sv) and sv["Value"].sum()>0 else 0
-        st.markdown(f'<p class="so">{top_svc} accounts for {top_svc_pct:.0f}% of pipeline value by service</p>', unsafe_allow_html=True)
-        fig5 = go.Figure(go.Pie(
-            labels=sv["Main Primary Service"], values=sv["Value"], hole=.52,
-            marker=dict(colors=SEQ[:len(sv)]),
-            textinfo="label+percent", textfont=dict(size=10.5),
-            hovertemplate="<b>%{label}</b><br>$%{value:,.0f}<br>%{percent}<extra></extra>", sort=True,
-        ))
-        pl(fig5, h=400)
-        fig5.update_layout(showlegend=False)
-        st.plotly_chart(fig5, use_container_width=True)
+    # Product × Service
+    so("Product × Service cross-reference — identifying service-product alignment")
+    st.plotly_chart(r["fig_ps"], use_container_width=True)
+
+
+# ── 4 · Customer Concentration ───────────────────────────────────────────────
+def build_customers(v):
+    cu = rollup(v.fcube, "Account Name").sort_values("Value", ascending=False)
+    top5_pct = cu.head(5)["Value"].sum()/cu["Value"].sum()*100 if cu["Value"].sum()>0 else 0
+    cu_top = cu.head(10).sort_values("Value", ascending=True)
+    fig3 = go.Figure(go.Bar(
+        y=cu_top["Account Name"], x=cu_top["Value"], orientation="h",
+        marker=dict(color=cu_top["Value"], colorscale=[[0,"#B2DFDB"],[.5,TL],[1,NY]], showscale=False),
+        text=[f"  {fc(v)}  ({c})" for v,c in zip(cu_top["Value"],cu_top["Count"])],
+        textposition="outside", textfont=dict(size=10.5, color=G800),
+    ))
+    pl(fig3, h=max(380, 44*len(cu_top)))
+    fig3.update_layout(showlegend=False, xaxis=dict(visible=False), yaxis=dict(tickfont=dict(size=10)))
+    fig3.update_xaxes(showgrid=False, showline=False)
+    fig3.update_yaxes(showgrid=False, showline=False)
+
+    cu_sorted = cu.sort_values("Value", ascending=False).reset_index(drop=True)
+    cu_sorted["CumVal"] = cu_sorted["Value"].cumsum()
+    cu_sorted["CumPct"] = cu_sorted["CumVal"]/cu_sorted["Value"].sum()*100
+    cu_sorted["Rank"]   = range(1, len(cu_sorted)+1)
+    fig4 = go.Figure()
+    fig4.add_trace(go.Bar(x=cu_sorted["Rank"], y=cu_sorted["Value"], marker_color=TL, name="Individual Value",
+        hovertemplate="<b>%{customdata}</b><br>$%{y:,.0f}<extra></extra>", customdata=cu_sorted["Account Name"]))
+    fig4.add_trace(go.Scatter(x=cu_sorted["Rank"], y=cu_sorted["CumPct"], mode="lines+markers",
+        line=dict(color=NY, width=2.5), marker=dict(size=5, color=NY), name="Cumulative %", yaxis="y2"))
+    fig4.add_hline(y=80, line_dash="dot", line_color=RD, opacity=0.45, annotation_text="80 %",
+        annotation_position="right", annotation_font=dict(size=9, color=RD), yref="y2")
+    pl(fig4, h=max(380, 44*len(cu_top)), mb=50)
+    fig4.update_layout(
+        yaxis=dict(visible=False),
+        yaxis2=dict(title="Cumulative %", titlefont=dict(size=9), side="right", overlaying="y", range=[0,108], showgrid=False),
+        xaxis=dict(title="Customer Rank", titlefont=dict(size=9.5), tickfont=dict(size=9.5)),
+        legend=dict(font=dict(size=8.5)),
+    )
+    fig4.update_xaxes(showgrid=False)
+    fig4.update_yaxes(showgrid=False, showline=False)
+    return dict(so=f"Top 5 accounts represent {top5_pct:.0f}% of total pipeline — concentration risk to monitor",
+                fig3=fig3, fig4=fig4)
 
-    with s3b:
-        st.markdown('<p class="so">Average deal size by service type</p>', unsafe_allow_html=True)
-        sv_s = sv.sort_values("Avg", ascending=True)
-        fig6 = go.Figure(go.Bar(
-            y=sv_s["Main Primary Service"], x=sv_s["Avg"], orientation="h", marker_color=NY,
-            text=[f"  {fc(v)}  ({c} opps)" for v,c in zip(sv_s["Avg"],sv_s["Count"])],
-            textposition="outside", textfont=dict(size=10, color=G800),
-        ))
-        pl(fig6, h=400)
-        fig6.update_layout(showlegend=False, xaxis=dict(visible=False), yaxis=dict(tickfont=dict(size=10)))
-        fig6.update_xaxes(showgrid=False, showline=False)
-        fig6.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig6, use_container_width=True)
 
-    spacer("lg")
+def show_customers(r, v):
+    c2a, _, c2b = st.columns([1.08, 0.08, 0.84])
+    with c2a:
+        so(r["so"])
+        st.plotly_chart(r["fig3"], use_container_width=True)
+    with c2b:
+        so("Cumulative concentration (Pareto curve)")
+        st.plotly_chart(r["fig4"], use_container_width=True)
+
+
+# ── 5 · Product / Service Mix ────────────────────────────────────────────────
+def build_services(v):
+    sv = rollup(v.fcube, "Main Primary Service").sort_values("Value", ascending=False)
+    top_svc = sv.iloc[0]["Main Primary Service"] if len(sv) else "N/A"
+    top_svc_pct = sv.iloc[0]["Value"]/sv["Value"].sum()*100 if len(sv) and sv["Value"].sum()>0 else 0
+    fig5 = go.Figure(go.Pie(
+        labels=sv["Main Primary Service"], values=sv["Value"], hole=.52,
+        marker=dict(colors=SEQ[:len(sv)]),
+        textinfo="label+percent", textfont=dict(size=10.5),
+        hovertemplate="<b>%{label}</b><br>$%{value:,.0f}<br>%{percent}<extra></extra>", sort=True,
+    ))
+    pl(fig5, h=400)
+    fig5.update_layout(showlegend=False)
+
+    sv_s = sv.sort_values("Avg", ascending=True)
+    fig6 = go.Figure(go.Bar(
+        y=sv_s["Main Primary Service"], x=sv_s["Avg"], orientation="h", marker_color=NY,
+        text=[f"  {fc(v)}  ({c} opps)" for v,c in zip(sv_s["Avg"],sv_s["Count"])],
+        textposition="outside", textfont=dict(size=10, color=G800),
+    ))
+    pl(fig6, h=400)
+    fig6.update_layout(showlegend=False, xaxis=dict(visible=False), yaxis=dict(tickfont=dict(size=10)))
+    fig6.update_xaxes(showgrid=False, showline=False)
+    fig6.update_yaxes(showgrid=False, showline=False)
 
-    # Service × Region Heatmap
-    st.markdown('<p class="so">Service demand mapped by region</p>', unsafe_allow_html=True)
-    ht = pd.crosstab(fdf["Main Primary Service"], fdf["Owner Role"], values=fdf["Opportunity PAR"], aggfunc="sum").fillna(0)
+    ht = cross(v.fcube, "Main Primary Service", "Owner Role")
     fig7 = go.Figure(go.Heatmap(
         z=ht.values, x=ht.columns.tolist(), y=ht.index.tolist(),
         colorscale=[[0,W],[.25,TLL],[.6,TL],[1,NY]],
@@ -807,103 +741,96 @@ if page == "Dashboard":
     fig7.update_layout(xaxis=dict(tickfont=dict(size=10.5), side="top"), yaxis=dict(tickfont=dict(size=10.5), autorange="reversed"))
     fig7.update_xaxes(showgrid=False, showline=False)
     fig7.update_yaxes(showgrid=False, showline=False)
-    st.plotly_chart(fig7, use_container_width=True)
+    return dict(so=f"{top_svc} accounts for {top_svc_pct:.0f}% of pipeline value by service",
+                fig5=fig5, fig6=fig6, fig7=fig7)
 
-    spacer("xl")
 
-    # ══════════════════════════════════════════════════════════════════════════
-    # 6 — REGIONAL ANALYSIS
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">6 · Regional Split</div>', unsafe_allow_html=True)
-    spacer("md")
+def show_services(r, v):
+    s3a, _, s3b = st.columns([0.50, 0.06, 0.44])
+    with s3a:
+        so(r["so"])
+        st.plotly_chart(r["fig5"], use_container_width=True)
+    with s3b:
+        so("Average deal size by service type")
+        st.plotly_chart(r["fig6"], use_container_width=True)
 
-    r4a, _, r4b = st.columns([1, 0.06, 1])
+    spacer("lg")
 
-    with r4a:
-        rg = fdf.groupby("Owner Role").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-            Avg=("Opportunity PAR","mean"), AvgDur=("Stage Duration","mean")).reset_index().sort_values("Value", ascending=False)
-        top_reg = rg.iloc[0]["Owner Role"] if len(rg) else "N/A"
-        st.markdown(f'<p class="so">{top_reg} leads the pipeline by value</p>', unsafe_allow_html=True)
-        fig8 = go.Figure(go.Bar(
-            x=rg["Owner Role"], y=rg["Value"],
-            marker_color=[NY,TL,GD,BA,G600][:len(rg)],
-            text=[f"{fc(v)}<br><span style='font-size:9px'>{c} opps · Avg {fc(a)}</span>" for v,c,a in zip(rg["Value"],rg["Count"],rg["Avg"])],
-            textposition="inside", textfont=dict(size=11, color=W),
+    # Service × Region Heatmap
+    so("Service demand mapped by region")
+    st.plotly_chart(r["fig7"], use_container_width=True)
+
+
+# ── 6 · Regional Split ───────────────────────────────────────────────────────
+def build_regions(v):
+    rg = rollup(v.fcube, "Owner Role").sort_values("Value", ascending=False)
+    top_reg = rg.iloc[0]["Owner Role"] if len(rg) else "N/A"
+    fig8 = go.Figure(go.Bar(
+        x=rg["Owner Role"], y=rg["Value"],
+        marker_color=[NY,TL,GD,BA,G600][:len(rg)],
+        text=[f"{fc(v)}<br><span style='font-size:9px'>{c} opps · Avg {fc(a)}</span>" for v,c,a in zip(rg["Value"],rg["Count"],rg["Avg"])],
+        textposition="inside", textfont=dict(size=11, color=W),
+    ))
+    pl(fig8, h=390)
+    fig8.update_layout(showlegend=False, yaxis=dict(visible=False), bargap=0.35)
+    fig8.update_xaxes(showgrid=False, tickfont=dict(size=10.5))
+    fig8.update_yaxes(showgrid=False, showline=False)
+
+    rs_ht = cross(v.fcube, "Owner Role", "Stage")
+    ordered = [s for s in STAGE_ORDER if s in rs_ht.columns]
+    extra   = [s for s in rs_ht.columns if s not in STAGE_ORDER]
+    rs_ht   = rs_ht[ordered+extra]
+    fig9 = go.Figure()
+    for col in rs_ht.columns:
+        fig9.add_trace(go.Bar(
+            x=rs_ht.index, y=rs_ht[col], name=col, marker_color=STG_COLORS.get(col, G400),
+            text=[fc(v) if v>0 else "" for v in rs_ht[col]], textposition="inside", textfont=dict(size=9, color=W),
         ))
-        pl(fig8, h=390)
-        fig8.update_layout(showlegend=False, yaxis=dict(visible=False), bargap=0.35)
-        fig8.update_xaxes(showgrid=False, tickfont=dict(size=10.5))
-        fig8.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig8, use_container_width=True)
-
-    with r4b:
-        st.markdown('<p class="so">Region × stage: where is each region in the pipeline?</p>', unsafe_allow_html=True)
-        rs_ht = pd.crosstab(fdf["Owner Role"], fdf["Stage"], values=fdf["Opportunity PAR"], aggfunc="sum").fillna(0)
-        ordered = [s for s in STAGE_ORDER if s in rs_ht.columns]
-        extra   = [s for s in rs_ht.columns if s not in STAGE_ORDER]
-        rs_ht   = rs_ht[ordered+extra]
-        stg_colors = {"Information Gathering":G400, "Solutions Design":TL, "Proposal/Price Quote":BA,
-                      "Proposal Price/Quote":BA, "Negotiations":GD, "Closed/Won":GN, "Closed/Lost":RD}
-        fig9 = go.Figure()
-        for col in rs_ht.columns:
-            fig9.add_trace(go.Bar(
-                x=rs_ht.index, y=rs_ht[col], name=col, marker_color=stg_colors.get(col, G400),
-                text=[fc(v) if v>0 else "" for v in rs_ht[col]], textposition="inside", textfont=dict(size=9, color=W),
-            ))
-        pl(fig9, h=390, mb=16)
-        fig9.update_layout(barmode="stack", yaxis=dict(visible=False), bargap=0.3, legend=dict(font=dict(size=8.5)))
-        fig9.update_xaxes(showgrid=False, tickfont=dict(size=10.5))
-        fig9.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig9, use_container_width=True)
-
-    spacer("xl")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 7 — SOLUTION RESOURCE WORKLOAD
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">7 · Solution Resource Workload</div>', unsafe_allow_html=True)
-    spacer("md")
+    pl(fig9, h=390, mb=16)
+    fig9.update_layout(barmode="stack", yaxis=dict(visible=False), bargap=0.3, legend=dict(font=dict(size=8.5)))
+    fig9.update_xaxes(showgrid=False, tickfont=dict(size=10.5))
+    fig9.update_yaxes(showgrid=False, showline=False)
+    return dict(so=f"{top_reg} leads the pipeline by value", fig8=fig8, fig9=fig9)
 
-    rw = fdf.groupby("Solution Resource").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-        AvgDur=("Stage Duration","mean"), Cust=("Account Name","nunique")).reset_index().sort_values("Value", ascending=False)
-
-    r5a, _, r5b = st.columns([0.56, 0.06, 0.38])
-
-    with r5a:
-        st.markdown(f'<p class="so">{rw.iloc[0]["Solution Resource"]} carries the largest pipeline at {fc(rw.iloc[0]["Value"])}</p>' if len(rw) else '', unsafe_allow_html=True)
-        fig10 = go.Figure()
-        fig10.add_trace(go.Bar(x=rw["Solution Resource"], y=rw["Count"], name="# Opportunities", marker_color=NY,
-            text=rw["Count"], textposition="auto", textfont=dict(color=W, size=10.5)))
-        fig10.add_trace(go.Scatter(x=rw["Solution Resource"], y=rw["Value"], name="Total Value ($)",
-            mode="markers+lines", marker=dict(color=GD, size=10, line=dict(width=1.5, color=NY)),
-            line=dict(color=GD, width=2.5), yaxis="y2"))
-        pl(fig10, h=400, mb=55)
-        fig10.update_layout(
-            yaxis=dict(title="# Opps", titlefont=dict(size=9.5), side="left"),
-            yaxis2=dict(title="Value ($)", titlefont=dict(size=9.5), side="right", overlaying="y", showgrid=False),
-            xaxis=dict(tickangle=15, tickfont=dict(size=9.5)), bargap=0.3,
-        )
-        st.plotly_chart(fig10, use_container_width=True)
-
-    with r5b:
-        st.markdown('<p class="so">Resource detail breakdown</p>', unsafe_allow_html=True)
-        rw_status = fdf.groupby("Solution Resource")["Status"].value_counts().unstack(fill_value=0)
-        rw_merged = rw.set_index("Solution Resource").join(rw_status, how="left").reset_index()
-        rd = rw_merged.rename(columns={"Solution Resource":"Resource","Count":"Opps","Value":"Pipeline","AvgDur":"Avg Days","Cust":"Accounts"}).copy()
-        rd["Pipeline"] = rd["Pipeline"].apply(lambda x: f"${x:,.0f}")
-        rd["Avg Days"] = rd["Avg Days"].apply(lambda x: f"{x:.0f}")
-        display_cols = ["Resource","Opps","Pipeline","Avg Days","Accounts"]
-        for sc in ["Working","Pending","Unassigned"]:
-            if sc in rd.columns:
-                rd[sc] = rd[sc].astype(int)
-                display_cols.append(sc)
-        st.dataframe(rd[display_cols], use_container_width=True, height=400, hide_index=True)
 
-    spacer("lg")
+def show_regions(r, v):
+    r4a, _, r4b = st.columns([1, 0.06, 1])
+    with r4a:
+        so(r["so"])
+        st.plotly_chart(r["fig8"], use_container_width=True)
+    with r4b:
+        so("Region × stage: where is each region in the pipeline?")
+        st.plotly_chart(r["fig9"], use_container_width=True)
+
+
+# ── 7 · Solution Resource Workload ───────────────────────────────────────────
+def build_resources(v):
+    rw = rollup(v.fcube, "Solution Resource", cust=True).sort_values("Value", ascending=False)
+    fig10 = go.Figure()
+    fig10.add_trace(go.Bar(x=rw["Solution Resource"], y=rw["Count"], name="# Opportunities", marker_color=NY,
+        text=rw["Count"], textposition="auto", textfont=dict(color=W, size=10.5)))
+    fig10.add_trace(go.Scatter(x=rw["Solution Resource"], y=rw["Value"], name="Total Value ($)",
+        mode="markers+lines", marker=dict(color=GD, size=10, line=dict(width=1.5, color=NY)),
+        line=dict(color=GD, width=2.5), yaxis="y2"))
+    pl(fig10, h=400, mb=55)
+    fig10.update_layout(
+        yaxis=dict(title="# Opps", titlefont=dict(size=9.5), side="left"),
+        yaxis2=dict(title="Value ($)", titlefont=dict(size=9.5), side="right", overlaying="y", showgrid=False),
+        xaxis=dict(tickangle=15, tickfont=dict(size=9.5)), bargap=0.3,
+    )
 
-    # Resource × Region
-    st.markdown('<p class="so">Resource allocation by region</p>', unsafe_allow_html=True)
-    rr = pd.crosstab(fdf["Solution Resource"], fdf["Owner Role"], values=fdf["Opportunity Name"], aggfunc="count").fillna(0).astype(int)
+    rw_status = cross(v.fcube, "Solution Resource", "Status", "Rows")
+    rw_merged = rw.set_index("Solution Resource").join(rw_status, how="left").reset_index()
+    rd = rw_merged.rename(columns={"Solution Resource":"Resource","Count":"Opps","Value":"Pipeline","AvgDur":"Avg Days","Cust":"Accounts"}).copy()
+    rd["Pipeline"] = rd["Pipeline"].apply(lambda x: f"${x:,.0f}")
+    rd["Avg Days"] = rd["Avg Days"].apply(lambda x: f"{x:.0f}")
+    display_cols = ["Resource","Opps","Pipeline","Avg Days","Accounts"]
+    for sc in ["Working","Pending","Unassigned"]:
+        if sc in rd.columns:
+            rd[sc] = rd[sc].astype(int)
+            display_cols.append(sc)
+
+    rr = cross(v.fcube, "Solution Resource", "Owner Role", "Count").astype(int)
     fig11 = go.Figure(go.Heatmap(
         z=rr.values, x=rr.columns.tolist(), y=rr.index.tolist(),
         colorscale=[[0,W],[.4,TLL],[1,NY]],
@@ -914,65 +841,65 @@ if page == "Dashboard":
     fig11.update_layout(xaxis=dict(tickfont=dict(size=10.5), side="top"), yaxis=dict(tickfont=dict(size=10.5), autorange="reversed"))
     fig11.update_xaxes(showgrid=False, showline=False)
     fig11.update_yaxes(showgrid=False, showline=False)
-    st.plotly_chart(fig11, use_container_width=True)
-
-    spacer("xl")
+    return dict(so=f'{rw.iloc[0]["Solution Resource"]} carries the largest pipeline at {fc(rw.iloc[0]["Value"])}' if len(rw) else "",
+                fig10=fig10, rd=rd[display_cols], fig11=fig11)
 
-    # ══════════════════════════════════════════════════════════════════════════
-    # 8 — TIMELINE & AGING
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">8 · Timeline & Aging Analysis</div>', unsafe_allow_html=True)
-    spacer("md")
-
-    t6a, _, t6b = st.columns([1, 0.06, 1])
 
-    with t6a:
-        st.markdown('<p class="so">Expected revenue by close month</p>', unsafe_allow_html=True)
-        tl = fdf.dropna(subset=["Close Date Parsed"]).copy()
-        tl["Month"] = tl["Close Date Parsed"].dt.to_period("M").dt.to_timestamp()
-        mo = tl.groupby("Month").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count")).reset_index().sort_values("Month")
-        fig12 = go.Figure()
-        fig12.add_trace(go.Bar(x=mo["Month"], y=mo["Value"], marker_color=TL, name="Pipeline Value",
-            text=[f"{fc(v)}" for v in mo["Value"]], textposition="outside", textfont=dict(size=9.5)))
-        fig12.add_trace(go.Scatter(x=mo["Month"], y=mo["Count"], mode="markers+lines",
-            marker=dict(color=NY, size=7), line=dict(color=NY, width=2), name="# Opps", yaxis="y2"))
-        pl(fig12, h=400, mb=50)
-        fig12.update_layout(
-            yaxis=dict(visible=False),
-            yaxis2=dict(title="# Opps", titlefont=dict(size=9.5), side="right", overlaying="y", showgrid=False),
-            xaxis=dict(tickformat="%b '%y", tickfont=dict(size=9.5)),
-        )
-        fig12.update_xaxes(showgrid=False)
-        fig12.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig12, use_container_width=True)
-
-    with t6b:
-        st.markdown('<p class="so">Stage duration distribution — identify outliers and bottlenecks</p>', unsafe_allow_html=True)
-        stages_for_box = [s for s in STAGE_ORDER if s in fdf["Stage"].unique()]
-        fig13 = go.Figure()
-        for s in stages_for_box:
-            sd = fdf[fdf["Stage"]==s]
-            fig13.add_trace(go.Box(y=sd["Stage Duration"], name=s, marker_color=TL, boxmean=True,
-                fillcolor=TLL, line=dict(color=TL)))
-        pl(fig13, h=400)
-        fig13.update_layout(showlegend=False, yaxis=dict(title="Days", titlefont=dict(size=9.5)),
-                            xaxis=dict(tickfont=dict(size=9.5)))
-        st.plotly_chart(fig13, use_container_width=True)
+def show_resources(r, v):
+    r5a, _, r5b = st.columns([0.56, 0.06, 0.38])
+    with r5a:
+        if r["so"]: so(r["so"])
+        st.plotly_chart(r["fig10"], use_container_width=True)
+    with r5b:
+        so("Resource detail breakdown")
+        st.dataframe(r["rd"], use_container_width=True, height=400, hide_index=True)
 
     spacer("lg")
 
+    # Resource × Region
+    so("Resource allocation by region")
+    st.plotly_chart(r["fig11"], use_container_width=True)
+
+
+# ── 8 · Timeline & Aging Analysis ────────────────────────────────────────────
+def build_timeline(v):
+    fdf = v.fdf
+    tl = fdf.dropna(subset=["Close Date Parsed"]).copy()
+    tl["Month"] = tl["Close Date Parsed"].dt.to_period("M").dt.to_timestamp()
+    mo = tl.groupby("Month").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count")).reset_index().sort_values("Month")
+    fig12 = go.Figure()
+    fig12.add_trace(go.Bar(x=mo["Month"], y=mo["Value"], marker_color=TL, name="Pipeline Value",
+        text=[f"{fc(v)}" for v in mo["Value"]], textposition="outside", textfont=dict(size=9.5)))
+    fig12.add_trace(go.Scatter(x=mo["Month"], y=mo["Count"], mode="markers+lines",
+        marker=dict(color=NY, size=7), line=dict(color=NY, width=2), name="# Opps", yaxis="y2"))
+    pl(fig12, h=400, mb=50)
+    fig12.update_layout(
+        yaxis=dict(visible=False),
+        yaxis2=dict(title="# Opps", titlefont=dict(size=9.5), side="right", overlaying="y", showgrid=False),
+        xaxis=dict(tickformat="%b '%y", tickfont=dict(size=9.5)),
+    )
+    fig12.update_xaxes(showgrid=False)
+    fig12.update_yaxes(showgrid=False, showline=False)
+
+    stages_for_box = [s for s in STAGE_ORDER if s in fdf["Stage"].unique()]
+    fig13 = go.Figure()
+    for s in stages_for_box:
+        sd = fdf[fdf["Stage"]==s]
+        fig13.add_trace(go.Box(y=sd["Stage Duration"], name=s, marker_color=TL, boxmean=True,
+            fillcolor=TLL, line=dict(color=TL)))
+    pl(fig13, h=400)
+    fig13.update_layout(showlegend=False, yaxis=dict(title="Days", titlefont=dict(size=9.5)),
+                        xaxis=dict(tickfont=dict(size=9.5)))
+
     # Bubble chart
-    st.markdown('<p class="so">Opportunity landscape: value vs. stage duration — bubble size = deal value, color = stage</p>', unsafe_allow_html=True)
-    bdf = fdf.dropna(subset=["Close Date Parsed"]).copy()
-    stg_c = {"Information Gathering":G400, "Solutions Design":TL, "Proposal/Price Quote":BA,
-             "Proposal Price/Quote":BA, "Negotiations":GD, "Closed/Won":GN, "Closed/Lost":RD}
+    bdf = tl
     fig14 = go.Figure()
     for stg in bdf["Stage"].unique():
         sd = bdf[bdf["Stage"]==stg]
         fig14.add_trace(go.Scatter(
             x=sd["Stage Duration"], y=sd["Opportunity PAR"], mode="markers", name=stg,
             marker=dict(size=sd["Opportunity PAR"].apply(lambda x: max(8, min(40, x/70000))),
-                        color=stg_c.get(stg, G400), line=dict(width=1.2, color=W), opacity=0.82),
+                        color=STG_COLORS.get(stg, G400), line=dict(width=1.2, color=W), opacity=0.82),
             text=sd["Account Name"],
             hovertemplate="<b>%{text}</b><br>Duration: %{x}d<br>Value: $%{y:,.0f}<extra></extra>",
         ))
@@ -985,120 +912,133 @@ if page == "Dashboard":
         yaxis=dict(title="PAR Value ($)", titlefont=dict(size=10.5)),
         legend=dict(font=dict(size=9)),
     )
-    st.plotly_chart(fig14, use_container_width=True)
-
-    spacer("lg")
 
     # Aging table
-    st.markdown('<p class="so">Aging flags — opportunities requiring attention</p>', unsafe_allow_html=True)
     ag = fdf.copy()
     ag["Flag"] = ""
     ag.loc[ag["Stage Duration"]>90, "Flag"] = "🔴 >90d"
     ag.loc[(ag["Stage Duration"]>60)&(ag["Stage Duration"]<=90), "Flag"] = "🟡 >60d"
     ag.loc[ag["Close Date Parsed"]<TODAY, "Flag"] = ag.loc[ag["Close Date Parsed"]<TODAY, "Flag"].astype(str)+" ⚠ Past Due"
     ag_flagged = ag[ag["Flag"].str.len()>0].sort_values("Stage Duration", ascending=False)
-    if len(ag_flagged):
-        disp_ag = ag_flagged[["Flag","Account Name","Opportunity Name","Stage","Status","Product",
-                              "Opportunity PAR","Stage Duration","Close Date Display","Notes"]].copy()
-        disp_ag = disp_ag.rename(columns={"Close Date Display": "Close Date"})
+    disp_ag = ag_flagged[["Flag","Account Name","Opportunity Name","Stage","Status","Product",
+                          "Opportunity PAR","Stage Duration","Close Date Display","Notes"]].copy()
+    disp_ag = disp_ag.rename(columns={"Close Date Display": "Close Date"})
+    return dict(fig12=fig12, fig13=fig13, fig14=fig14, ag=disp_ag)
+
+
+def show_timeline(r, v):
+    t6a, _, t6b = st.columns([1, 0.06, 1])
+    with t6a:
+        so("Expected revenue by close month")
+        st.plotly_chart(r["fig12"], use_container_width=True)
+    with t6b:
+        so("Stage duration distribution — identify outliers and bottlenecks")
+        st.plotly_chart(r["fig13"], use_container_width=True)
+
+    spacer("lg")
+
+    so("Opportunity landscape: value vs. stage duration — bubble size = deal value, color = stage")
+    st.plotly_chart(r["fig14"], use_container_width=True)
+
+    spacer("lg")
+
+    so("Aging flags — opportunities requiring attention")
+    ag = r["ag"]
+    if len(ag):
         st.dataframe(
-            disp_ag.style.format({"Opportunity PAR":"${:,.0f}"}),
-            use_container_width=True, height=min(380, 38*len(ag_flagged)+38), hide_index=True,
+            ag.style.format({"Opportunity PAR":"${:,.0f}"}),
+            use_container_width=True, height=min(380, 38*len(ag)+38), hide_index=True,
         )
     else:
         st.success("No aging flags — all opportunities within normal parameters.")
 
-    spacer("xl")
 
-    # ══════════════════════════════════════════════════════════════════════════
-    # 9 — RISK & CLOSED/LOST
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">9 · Risk & Attention Items</div>', unsafe_allow_html=True)
-    spacer("md")
+# ── 9 · Risk & Attention Items ───────────────────────────────────────────────
+def build_risk(v):
+    fdf = v.fdf
+    lost = fdf[fdf["Stage"]=="Closed/Lost"]
+    cards = "".join(
+        f'<div style="background:{W}; border:1px solid {G200}; border-radius:5px; padding:.8rem 1rem; margin-bottom:.5rem; font-size:.78rem;">'
+        f'<b style="color:{NY};">{r["Account Name"]}</b> · {fc(r["Opportunity PAR"])}<br>'
+        f'<span style="color:{G600};">{r["Notes"] if pd.notna(r["Notes"]) else "No notes"}</span></div>'
+        for _, r in lost.iterrows())
+
+    risk = fdf[~fdf["Stage"].str.contains("Closed", na=False)].copy()
+    risk["RiskScore"] = risk["Opportunity PAR"] * np.log1p(risk["Stage Duration"])
+    risk_top = risk.nlargest(5, "RiskScore")
+    fig15 = None
+    if len(risk_top):
+        fig15 = go.Figure(go.Bar(
+            y=risk_top["Account Name"], x=risk_top["Opportunity PAR"], orientation="h",
+            marker_color=[RD if d>60 else GD if d>30 else TL for d in risk_top["Stage Duration"]],
+            text=[f"  {fc(v)} · {d}d" for v,d in zip(risk_top["Opportunity PAR"],risk_top["Stage Duration"])],
+            textposition="outside", textfont=dict(size=10.5, color=G800),
+        ))
+        pl(fig15, h=300)
+        fig15.update_layout(showlegend=False, xaxis=dict(visible=False), yaxis=dict(tickfont=dict(size=10)))
+        fig15.update_xaxes(showgrid=False, showline=False)
+        fig15.update_yaxes(showgrid=False, showline=False)
+    return dict(n_lost=len(lost), lost_val=lost["Opportunity PAR"].sum(), cards=cards, fig15=fig15)
 
-    r7a, _, r7b = st.columns([1, 0.06, 1])
 
+def show_risk(r, v):
+    r7a, _, r7b = st.columns([1, 0.06, 1])
     with r7a:
-        lost = fdf[fdf["Stage"]=="Closed/Lost"]
-        if len(lost):
-            st.markdown(f'<div class="al al-r"><b>{len(lost)} Closed/Lost</b> opportunities totaling <b>{fc(lost["Opportunity PAR"].sum())}</b></div>', unsafe_allow_html=True)
+        if r["n_lost"]:
+            st.markdown(f'<div class="al al-r"><b>{r["n_lost"]} Closed/Lost</b> opportunities totaling <b>{fc(r["lost_val"])}</b></div>', unsafe_allow_html=True)
             spacer("md")
-            for _, r in lost.iterrows():
-                st.markdown(f"""
-                <div style="background:{W}; border:1px solid {G200}; border-radius:5px; padding:.8rem 1rem; margin-bottom:.5rem; font-size:.78rem;">
-                    <b style="color:{NY};">{r['Account Name']}</b> · {fc(r['Opportunity PAR'])}<br>
-                    <span style="color:{G600};">{r['Notes'] if pd.notna(r['Notes']) else 'No notes'}</span>
-                </div>
-                """, unsafe_allow_html=True)
+            st.markdown(r["cards"], unsafe_allow_html=True)
         else:
             st.success("No Closed/Lost opportunities in current view.")
-
     with r7b:
-        st.markdown('<p class="so">Largest deals at risk (high value × high duration)</p>', unsafe_allow_html=True)
-        risk = fdf[~fdf["Stage"].str.contains("Closed", na=False)].copy()
-        risk["RiskScore"] = risk["Opportunity PAR"] * np.log1p(risk["Stage Duration"])
-        risk_top = risk.nlargest(5, "RiskScore")
-        if len(risk_top):
-            fig15 = go.Figure(go.Bar(
-                y=risk_top["Account Name"], x=risk_top["Opportunity PAR"], orientation="h",
-                marker_color=[RD if d>60 else GD if d>30 else TL for d in risk_top["Stage Duration"]],
-                text=[f"  {fc(v)} · {d}d" for v,d in zip(risk_top["Opportunity PAR"],risk_top["Stage Duration"])],
-                textposition="outside", textfont=dict(size=10.5, color=G800),
-            ))
-            pl(fig15, h=300)
-            fig15.update_layout(showlegend=False, xaxis=dict(visible=False), yaxis=dict(tickfont=dict(size=10)))
-            fig15.update_xaxes(showgrid=False, showline=False)
-            fig15.update_yaxes(showgrid=False, showline=False)
-            st.plotly_chart(fig15, use_container_width=True)
-
-    spacer("xl")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 10 — OPPORTUNITY OWNER ANALYSIS
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">10 · Opportunity Owner Performance</div>', unsafe_allow_html=True)
-    spacer("md")
+        so("Largest deals at risk (high value × high duration)")
+        if r["fig15"] is not None: st.plotly_chart(r["fig15"], use_container_width=True)
+
+
+# ── 10 · Opportunity Owner Performance ───────────────────────────────────────
+def build_owners(v):
+    ow = rollup(v.fcube, "Opportunity Owner").sort_values("Value", ascending=False)
+    ow_top = ow.head(10).sort_values("Value", ascending=True)
+    fig16 = go.Figure(go.Bar(
+        y=ow_top["Opportunity Owner"], x=ow_top["Value"], orientation="h", marker_color=NY,
+        text=[f"  {fc(v)} ({c})" for v,c in zip(ow_top["Value"],ow_top["Count"])],
+        textposition="outside", textfont=dict(size=10, color=G800),
+    ))
+    pl(fig16, h=max(360, 42*len(ow_top)))
+    fig16.update_layout(showlegend=False, xaxis=dict(visible=False), yaxis=dict(tickfont=dict(size=10)))
+    fig16.update_xaxes(showgrid=False, showline=False)
+    fig16.update_yaxes(showgrid=False, showline=False)
+
+    od = ow[["Opportunity Owner","Value","Count","Avg","AvgDur"]].rename(
+        columns={"Opportunity Owner":"Owner","Count":"Opps","Value":"Pipeline","Avg":"Avg Deal","AvgDur":"Avg Days"})
+    od["Pipeline"] = od["Pipeline"].apply(lambda x: f"${x:,.0f}")
+    od["Avg Deal"] = od["Avg Deal"].apply(lambda x: f"${x:,.0f}")
+    od["Avg Days"] = od["Avg Days"].apply(lambda x: f"{x:.0f}")
+    return dict(fig16=fig16, od=od, n_top=len(ow_top))
 
-    ow = fdf.groupby("Opportunity Owner").agg(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
-        Avg=("Opportunity PAR","mean"), AvgDur=("Stage Duration","mean")).reset_index().sort_values("Value", ascending=False)
 
+def show_owners(r, v):
     o8a, _, o8b = st.columns([0.53, 0.06, 0.41])
     with o8a:
-        st.markdown('<p class="so">Top opportunity owners by pipeline value</p>', unsafe_allow_html=True)
-        ow_top = ow.head(10).sort_values("Value", ascending=True)
-        fig16 = go.Figure(go.Bar(
-            y=ow_top["Opportunity Owner"], x=ow_top["Value"], orientation="h", marker_color=NY,
-            text=[f"  {fc(v)} ({c})" for v,c in zip(ow_top["Value"],ow_top["Count"])],
-            textposition="outside", textfont=dict(size=10, color=G800),
-        ))
-        pl(fig16, h=max(360, 42*len(ow_top)))
-        fig16.update_layout(showlegend=False, xaxis=dict(visible=False), yaxis=dict(tickfont=dict(size=10)))
-        fig16.update_xaxes(showgrid=False, showline=False)
-        fig16.update_yaxes(showgrid=False, showline=False)
-        st.plotly_chart(fig16, use_container_width=True)
-
+        so("Top opportunity owners by pipeline value")
+        st.plotly_chart(r["fig16"], use_container_width=True)
     with o8b:
-        st.markdown('<p class="so">Owner performance table</p>', unsafe_allow_html=True)
-        od = ow.rename(columns={"Opportunity Owner":"Owner","Count":"Opps","Value":"Pipeline","Avg":"Avg Deal","AvgDur":"Avg Days"}).copy()
-        od["Pipeline"] = od["Pipeline"].apply(lambda x: f"${x:,.0f}")
-        od["Avg Deal"] = od["Avg Deal"].apply(lambda x: f"${x:,.0f}")
-        od["Avg Days"] = od["Avg Days"].apply(lambda x: f"{x:.0f}")
-        st.dataframe(od, use_container_width=True, height=max(320, 38*len(ow_top)), hide_index=True)
-
-    spacer("xl")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 11 — FULL PIPELINE TABLE
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">11 · Full Pipeline Detail</div>', unsafe_allow_html=True)
-    spacer("md")
+        so("Owner performance table")
+        st.dataframe(r["od"], use_container_width=True, height=max(320, 38*r["n_top"]), hide_index=True)
+
 
-    tbl = fdf[["Stage","Status","Product","Account Name","Opportunity Name","Solution Resource","Opportunity Owner",
-               "Main Primary Service","Opportunity PAR","Stage Duration","Close Date Display",
-               "Received Display","Closed Display","Notes"]].copy()
+# ── 11 · Full Pipeline Detail ────────────────────────────────────────────────
+def build_detail(v):
+    tbl = v.fdf[["Stage","Status","Product","Account Name","Opportunity Name","Solution Resource","Opportunity Owner",
+                 "Main Primary Service","Opportunity PAR","Stage Duration","Close Date Display",
+                 "Received Display","Closed Display","Notes"]].copy()
     tbl = tbl.rename(columns={"Close Date Display":"Close Date", "Received Display":"Received by Solutions",
-                               "Closed Display":"Closed by Solutions"})
-    tbl = tbl.sort_values(["Stage","Opportunity PAR"], ascending=[True,False])
+                              "Closed Display":"Closed by Solutions"})
+    return dict(tbl=tbl.sort_values(["Stage","Opportunity PAR"], ascending=[True,False]))
+
+
+def show_detail(r, v):
+    tbl = r["tbl"]
     st.dataframe(
         tbl.style.format({"Opportunity PAR":"${:,.0f}"}),
         use_container_width=True, height=min(560, 38*len(tbl)+38), hide_index=True,
@@ -1111,42 +1051,44 @@ if page == "Dashboard":
         },
     )
 
-    spacer("xl")
-
-    # ══════════════════════════════════════════════════════════════════════════
-    # 12 — EXECUTIVE SUMMARY
-    # ══════════════════════════════════════════════════════════════════════════
-    st.markdown('<div class="sec">12 · Executive Summary</div>', unsafe_allow_html=True)
-    spacer("md")
 
-    top_c  = fdf.groupby("Account Name")["Opportunity PAR"].sum().idxmax() if n_opp else "N/A"
-    top_cv = fdf.groupby("Account Name")["Opportunity PAR"].sum().max() if n_opp else 0
-    top_sv = fdf.groupby("Main Primary Service")["Opportunity PAR"].sum().idxmax() if n_opp else "N/A"
-    n_des  = len(fdf[fdf["Stage"]=="Solutions Design"])
-    n_pro  = len(fdf[fdf["Stage"].str.contains("Proposal|Price", case=False, na=False)])
-    n_neg  = len(fdf[fdf["Stage"]=="Negotiations"])
+# ── 12 · Executive Summary ───────────────────────────────────────────────────
+def build_summary(v):
+    fcube, n_opp = v.fcube, v.n_opp
+    sg  = rollup(fcube, "Stage").set_index("Stage")
+    acc = rollup(fcube, "Account Name")
+    svc = rollup(fcube, "Main Primary Service")
+    rg  = rollup(fcube, "Owner Role").sort_values("Value", ascending=False)
+    cu  = acc.sort_values("Value", ascending=False)
+    top_c  = acc.set_index("Account Name")["Value"].idxmax() if len(acc) else "N/A"
+    top_cv = acc["Value"].max() if len(acc) else 0
+    top_sv = svc.set_index("Main Primary Service")["Value"].idxmax() if len(svc) else "N/A"
+    n_des  = int(sg["Rows"].get("Solutions Design", 0))
+    n_pro  = int(sg.loc[sg.index.astype(str).str.contains("Proposal|Price", case=False), "Rows"].sum())
+    n_neg  = int(sg["Rows"].get("Negotiations", 0))
+    n_lost, lost_val = int(sg["Rows"].get("Closed/Lost", 0)), sg["Value"].get("Closed/Lost", 0)
     top5p  = cu.head(5)["Value"].sum()/cu["Value"].sum()*100 if len(cu) and cu["Value"].sum()>0 else 0
-    reg_lead = f"with <b>{top_reg}</b> leading at <b>{fc(rg.iloc[0]['Value'])}</b>" if len(rg) else ""
-    prod_tagged = fdf[fdf["Product"]!="General"]
-    n_prod_tagged = len(prod_tagged)
-    prod_list = ", ".join(fdf[fdf["Product"]!="General"]["Product"].unique()) if n_prod_tagged else "None tagged"
+    reg_lead = f"with <b>{rg.iloc[0]['Owner Role']}</b> leading at <b>{fc(rg.iloc[0]['Value'])}</b>" if len(rg) else ""
+    prod_tagged = fcube[fcube["Product"]!="General"]
+    n_prod_tagged = int(prod_tagged["Rows"].sum())
+    prod_list = ", ".join(prod_tagged["Product"].unique()) if n_prod_tagged else "None tagged"
 
-    st.markdown(f"""<div class="es">
+    return dict(html=f"""<div class="es">
 The Solutions team is currently managing <b>{n_opp} active opportunities</b> representing
-a total pipeline value of <b>{fc(total)}</b> across <b>{n_cust} unique customers</b>
-and <b>{n_svc} service categories</b>.
+a total pipeline value of <b>{fc(v.total)}</b> across <b>{v.n_cust} unique customers</b>
+and <b>{v.n_svc} service categories</b>.
 <br><br>
 <b>Stage composition:</b> {n_des} opportunities are in Solutions Design ({pct(n_des,n_opp)}),
-{n_pro} in Proposal/Price Quote, {n_neg} in Negotiations, and {len(lost)} were Closed/Lost
-({fc(lost['Opportunity PAR'].sum())} lost value).
+{n_pro} in Proposal/Price Quote, {n_neg} in Negotiations, and {n_lost} were Closed/Lost
+({fc(lost_val)} lost value).
 <br><br>
-<b>Status overview:</b> Of all opportunities, <b>{n_working} are actively being worked</b>,
-{n_pending} are pending action, and {n_unassigned} remain unassigned.
+<b>Status overview:</b> Of all opportunities, <b>{v.n_working} are actively being worked</b>,
+{v.n_pending} are pending action, and {v.n_unassigned} remain unassigned.
 This signals capacity for re-prioritization across the Solutions team.
 <br><br>
-<b>Solutions velocity:</b> <b>{n_received} of {n_opp}</b> opportunities ({pct_received}) have been
-formally received by Solutions, and <b>{n_closed}</b> have been closed.
-Average cycle time (Received → Closed) is <b>{avg_cycle}</b>.
+<b>Solutions velocity:</b> <b>{v.n_received} of {n_opp}</b> opportunities ({v.pct_received}) have been
+formally received by Solutions, and <b>{v.n_closed}</b> have been closed.
+Average cycle time (Received → Closed) is <b>{v.avg_cycle}</b>.
 <br><br>
 <b>Product tagging:</b> <b>{n_prod_tagged} of {n_opp}</b> opportunities have a product classification
 ({prod_list}). Expanding product tagging will improve pipeline segmentation and forecasting accuracy.
@@ -1155,15 +1097,100 @@ Average cycle time (Received → Closed) is <b>{avg_cycle}</b>.
 led by <b>{top_c}</b> at {fc(top_cv)}. This is a notable concentration risk.
 The dominant service type is <b>{top_sv}</b>.
 <br><br>
-<b>Regional coverage:</b> Pipeline spans <b>{fdf['Owner Role'].nunique()} regions</b>
+<b>Regional coverage:</b> Pipeline spans <b>{fcube['Owner Role'].nunique()} regions</b>
 {reg_lead}.
-<b>{fdf['Solution Resource'].nunique()} Solution Resources</b> are actively engaged.
+<b>{fcube['Solution Resource'].nunique()} Solution Resources</b> are actively engaged.
 <br><br>
-<b>Attention items:</b> <b>{len(past_due)} opportunities</b> ({fc(past_due['Opportunity PAR'].sum())})
+<b>Attention items:</b> <b>{len(v.past_due)} opportunities</b> ({fc(v.past_due['Opportunity PAR'].sum())})
 have close dates that have already passed.
-<b>{len(aging_60)} opportunities</b> have been in their current stage for over 60 days.
-Average stage duration stands at <b>{avg_dur:.0f} days</b>.
-</div>""", unsafe_allow_html=True)
+<b>{len(v.aging_60)} opportunities</b> have been in their current stage for over 60 days.
+Average stage duration stands at <b>{v.avg_dur:.0f} days</b>.
+</div>""")
+
+
+def show_summary(r, v):
+    st.markdown(r["html"], unsafe_allow_html=True)
+
+
+# (id, title, build, show) — in report order
+SECTIONS = [
+    ("overview",  "1 · Pipeline Overview",             build_overview,  show_overview),
+    ("status",    "2 · Solutions Status & Velocity",   build_status,    show_status),
+    ("product",   "3 · Product Segmentation",          build_product,   show_product),
+    ("customers", "4 · Customer Concentration",        build_customers, show_customers),
+    ("services",  "5 · Product / Service Mix",         build_services,  show_services),
+    ("regions",   "6 · Regional Split",                build_regions,   show_regions),
+    ("resources", "7 · Solution Resource Workload",    build_resources, show_resources),
+    ("timeline",  "8 · Timeline & Aging Analysis",     build_timeline,  show_timeline),
+    ("risk",      "9 · Risk & Attention Items",        build_risk,      show_risk),
+    ("owners",    "10 · Opportunity Owner Performance", build_owners,   show_owners),
+    ("detail",    "11 · Full Pipeline Detail",         build_detail,    show_detail),
+    ("summary",   "12 · Executive Summary",            build_summary,   show_summary),
+]
+FULL_REPORT = "Full report — all sections"
+
+
+def render_section(sid, title, build, show, v):
+    """Section header + body; build() runs once per data version and filter
+    state, its figures served from the figure cache after that."""
+    st.markdown(f'<div class="sec">{title}</div>', unsafe_allow_html=True)
+    spacer("md")
+    with stage(title, len(v.fdf)):
+        show(cached((sid, v.data_ver, v.sig), lambda: build(v)), v)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  DASHBOARD
+# ═══════════════════════════════════════════════════════════════════════════════
+if page == "Dashboard":
+
+    # ── Filters ──────────────────────────────────────────────────────────────
+    with st.expander("Filters", expanded=False):
+        f1,f2,f3 = st.columns(3)
+        sel_st = f1.multiselect("Stage", opts["Stage"], default=opts["Stage"])
+        sel_sv = f2.multiselect("Service", opts["Main Primary Service"], default=opts["Main Primary Service"])
+        sel_rg = f3.multiselect("Region", opts["Owner Role"], default=opts["Owner Role"])
+        f4,f5,f6 = st.columns(3)
+        sel_rs = f4.multiselect("Solution Resource", opts["Solution Resource"], default=opts["Solution Resource"])
+        sel_status = f5.multiselect("Status", opts["Status"], default=opts["Status"])
+        sel_product = f6.multiselect("Product", opts["Product"], default=opts["Product"])
+        # Large stores: only a close-year window is loaded (undated opportunities always are)
+        win = None
+        if pushdown and years:
+            y0, y1 = years
+            win = st.slider("Close year", y0, y1, (max(y0, min(y1, TODAY.year - PUSHDOWN_YEARS + 1)), y1)) if y1 > y0 else years
+
+    sel = dict(zip(FILTER_COLS, [sel_st, sel_sv, sel_rg, sel_rs, sel_status, sel_product]))
+    sig = (filter_sig(opts, sel), win, TODAY)
+    with stage("Filters & KPIs", n_rows):
+        if pushdown:
+            fdf, fcube = filtered_view(sig, lambda: (prepare_frame(store.load(sel, opts, win)), store.cube(sel, opts, win)))
+        else:
+            fdf   = df[filter_mask(fidx, sel)]
+            fcube = cube[filter_mask(cidx, sel)]     # rollups below cost ~distinct dim values, not rows
+        v = SimpleNamespace(fdf=fdf, fcube=fcube, data_ver=data_ver, sig=sig, **kpis(fdf, fcube, TODAY))
+
+    # ── KPIs ─────────────────────────────────────────────────────────────────
+    st.markdown(f"""
+    <div class="kr">
+        <div class="kp" style="--ac:{TL};"><div class="kp-l">Pipeline Value</div><div class="kp-v">{fc(v.total)}</div><div class="kp-d">{v.n_opp} opportunities</div></div>
+        <div class="kp" style="--ac:{NY};"><div class="kp-l">Customers</div><div class="kp-v">{v.n_cust}</div><div class="kp-d">Unique accounts</div></div>
+        <div class="kp" style="--ac:{GD};"><div class="kp-l">Products in Scope</div><div class="kp-v">{v.n_svc}</div><div class="kp-d">{v.n_products} tagged product(s)</div></div>
+        <div class="kp" style="--ac:{BA};"><div class="kp-l">Avg Deal Size</div><div class="kp-v">{fc(v.avg_deal)}</div><div class="kp-d">Per opportunity</div></div>
+        <div class="kp" style="--ac:{TL};"><div class="kp-l">Solutions Received</div><div class="kp-v">{v.n_received}</div><div class="kp-d">{v.pct_received} of pipeline</div></div>
+        <div class="kp" style="--ac:{G400};"><div class="kp-l">Avg Stage Duration</div><div class="kp-v">{v.avg_dur:.0f}d</div><div class="kp-d">{len(v.aging_60)} over 60 days</div></div>
+        <div class="kp" style="--ac:{RD};"><div class="kp-l">Past Close Date</div><div class="kp-v">{len(v.past_due)}</div><div class="kp-d">{fc(v.past_due['Opportunity PAR'].sum())} at risk</div></div>
+    </div>
+    """, unsafe_allow_html=True)
+
+    spacer("lg")
+
+    # ── Sections: one at a time (only that one is computed) or the full report ──
+    nav = st.selectbox("Section", [t for _, t, _, _ in SECTIONS] + [FULL_REPORT], key="dash_section")
+    spacer("sm")
+    for i, (sid, title, build, show) in enumerate(s for s in SECTIONS if nav in (FULL_REPORT, s[1])):
+        if i: spacer("xl")
+        render_section(sid, title, build, show, v)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -1186,71 +1213,173 @@ elif page == "Masterfile Manager":
     spacer("lg")
 
     st.markdown('<div class="sec">Upload New Salesforce Export to Merge</div>', unsafe_allow_html=True)
-    mf = st.file_uploader("Upload new SF export. Team columns will be preserved.", type=["xlsx","xls","csv"], key="mu")
-    if mf:
-        raw = pd.read_csv(mf) if mf.name.endswith(".csv") else pd.read_excel(mf)
-        new_sf = clean_upload(raw)
-        merged, stats = merge_masterfile(st.session_state.master.copy(), new_sf)
-        st.session_state.master = merged
-        st.success(f"Merge complete — **{stats['updated']}** updated · **{stats['added']}** added · **{stats['removed']}** flagged · **{stats['total']}** total")
-        st.rerun()
+    mfs = st.file_uploader("Upload new SF export(s). Team columns will be preserved. Several exports are merged oldest first.",
+                           type=UPLOAD_TYPES, key="mu", accept_multiple_files=True)
+    # The uploader keeps its file across reruns — merge each upload once
+    new = [f for f in mfs or [] if f.file_id not in st.session_state.setdefault("merged_ids", set())]
+    if new:
+        with stage("Merge · parse uploads"):
+            if len(new) > 1: parsed = ingest_uploads(new)
+            else:                                   # one file: parsed here, with its progress bar
+                try: parsed = [(new[0].name, None, ingest_upload(new[0]))]
+                except Exception as e: parsed = [(new[0].name, None, e)]
+        for name, _, e in parsed:
+            if isinstance(e, Exception): st.error(f"Could not read **{name}** — {type(e).__name__}: {e}")
+        exports = [(name, cl) for name, _, cl in parsed if not isinstance(cl, Exception)]
+        st.session_state.merged_ids.update(f.file_id for f in new)
+        if exports:
+            with stage("Merge · merge into masterfile", sum(len(cl) for _, cl in exports)):
+                # read, fold every export in and write back once, under one lock
+                stats = store.merge(exports if len(exports) > 1 else exports[0][1], ", ".join(n for n, _ in exports))[1]
+            dated = {name: d for name, d, _ in parsed}
+            unparsed = {name: cl.attrs.get("par_unparsed", 0) for name, cl in exports}
+            for r in stats.get("files", []):
+                r["Exported"] = dated[r["File"]].strftime(DATE_FMT) if dated.get(r["File"]) is not None else "—"
+                r["Unparsed PAR"] = unparsed.get(r["File"], 0)
+            stats["par_unparsed"] = sum(unparsed.values())
+            sync_master()
+            st.session_state.merge_stats = stats
+            st.rerun()
+    stats = st.session_state.get("merge_stats")
+    if stats:
+        st.success(f"Merge complete — **{stats['updated']}** updated · **{stats['unchanged']}** unchanged · **{stats['added']}** added · "
+                   f"**{stats['removed']}** flagged · **{stats['total']}** total")
+        ch = stats["changes"]
+        if len(ch) or stats["added_keys"] or stats["removed_keys"]:
+            with st.expander("What changed"):
+                if stats.get("files"):
+                    st.caption("Exports merged in this order:")
+                    st.dataframe(pd.DataFrame(stats["files"]), use_container_width=True, hide_index=True)
+                if len(ch):
+                    st.caption(" · ".join(f"**{f}** {n:,}" for f, n in ch["Field"].value_counts().items()))
+                    cell = lambda v: "—" if pd.isna(v) else v.strftime(DATE_FMT) if isinstance(v, pd.Timestamp) else str(v)
+                    st.dataframe(ch.assign(Before=ch["Before"].map(cell), After=ch["After"].map(cell)),
+                                 use_container_width=True, hide_index=True)
+                for label, keys in [("Added", stats["added_keys"]), ("Removed from SF", stats["removed_keys"])]:
+                    if keys: st.caption(f"**{label}** ({len(keys)}): " + ", ".join(map(str, keys[:50])) + (" …" if len(keys) > 50 else ""))
+        if stats.get("par_unparsed"):
+            st.warning(f"{stats['par_unparsed']:,} Opportunity PAR value(s) in the export could not be read as a number and were set to 0.")
+        if stats["duplicates"]:
+            st.warning(f"{len(stats['duplicates'])} Opportunity Name(s) appear more than once in the export — the first row was used: "
+                       + ", ".join(stats["duplicates"][:10]) + (" …" if len(stats["duplicates"]) > 10 else ""))
 
     spacer("md")
 
     st.markdown('<div class="sec">Masterfile — Editable</div>', unsafe_allow_html=True)
     st.caption("Salesforce columns are locked. Edit the four team columns (teal-highlighted in Excel download).")
 
-    edf = st.session_state.master.copy()
-    for c in TEAM_COLS:
-        if c not in edf.columns: edf[c] = ""
-
-    # Format date columns for display
-    for dc in ["Close Date", "Received by Solutions", "Closed by Solutions"]:
-        if dc in edf.columns:
-            edf[dc] = pd.to_datetime(edf[dc], errors="coerce").apply(fmt_date)
-
-    edited = st.data_editor(
-        edf, use_container_width=True, height=min(620, 38*len(edf)+38), num_rows="dynamic",
-        column_config={
-            "Stage": st.column_config.TextColumn("Stage", disabled=True),
-            "Account Name": st.column_config.TextColumn("Customer", disabled=True),
-            "Opportunity Name": st.column_config.TextColumn("Opportunity", disabled=True, width="large"),
-            "Opportunity PAR": st.column_config.NumberColumn("PAR ($)", format="$%d", disabled=True),
-            "Stage Duration": st.column_config.NumberColumn("Days", disabled=True),
-            "Close Date": st.column_config.TextColumn("Close Date", disabled=True),
-            "Owner Role": st.column_config.TextColumn("Region", disabled=True),
-            "Opportunity Owner": st.column_config.TextColumn("Opp Owner", disabled=True),
-            "Solution Resource": st.column_config.TextColumn("Sol. Resource", disabled=True),
-            "Main Primary Service": st.column_config.TextColumn("Service", disabled=True),
-            "Notes": st.column_config.TextColumn("SF Notes", disabled=True),
-            "Status": st.column_config.TextColumn("Status", disabled=True),
-            "Received by Solutions": st.column_config.TextColumn("Received", disabled=True),
-            "Closed by Solutions": st.column_config.TextColumn("Closed", disabled=True),
-            "Product": st.column_config.TextColumn("Product", disabled=True),
-            "Solutions Notes": st.column_config.TextColumn("Solutions Notes", width="large"),
-            "Tasks": st.column_config.TextColumn("Tasks", width="large"),
-            "Action Items": st.column_config.TextColumn("Action Items", width="large"),
-            "Comments / Results": st.column_config.TextColumn("Comments / Results", width="large"),
-        },
-        hide_index=True, key="editor",
-    )
+    with stage("Editor · build frame", n_rows):
+        # The editor works on the whole masterfile, also in pushdown mode: its
+        # edit state is by row position over every row. current_master() is the
+        # process-wide memory-mapped snapshot, so sessions share it.
+        master = current_master()
+        edf = derived("edf", lambda: editor_frame(master, derived("df", lambda: prepare_frame(master))))
+
+    with stage("Editor · render", len(edf)):
+        st.data_editor(
+            edf, use_container_width=True, height=min(620, 38*len(edf)+38), num_rows="dynamic",
+            column_config={
+                "Stage": st.column_config.TextColumn("Stage", disabled=True),
+                "Account Name": st.column_config.TextColumn("Customer", disabled=True),
+                "Opportunity Name": st.column_config.TextColumn("Opportunity", disabled=True, width="large"),
+                "Opportunity PAR": st.column_config.NumberColumn("PAR ($)", format="$%d", disabled=True),
+                "Stage Duration": st.column_config.NumberColumn("Days", disabled=True),
+                "Close Date": st.column_config.TextColumn("Close Date", disabled=True),
+                "Owner Role": st.column_config.TextColumn("Region", disabled=True),
+                "Opportunity Owner": st.column_config.TextColumn("Opp Owner", disabled=True),
+                "Solution Resource": st.column_config.TextColumn("Sol. Resource", disabled=True),
+                "Main Primary Service": st.column_config.TextColumn("Service", disabled=True),
+                "Notes": st.column_config.TextColumn("SF Notes", disabled=True),
+                "Status": st.column_config.TextColumn("Status", disabled=True),
+                "Received by Solutions": st.column_config.TextColumn("Received", disabled=True),
+                "Closed by Solutions": st.column_config.TextColumn("Closed", disabled=True),
+                "Product": st.column_config.TextColumn("Product", disabled=True),
+                "Solutions Notes": st.column_config.TextColumn("Solutions Notes", width="large"),
+                "Tasks": st.column_config.TextColumn("Tasks", width="large"),
+                "Action Items": st.column_config.TextColumn("Action Items", width="large"),
+                "Comments / Results": st.column_config.TextColumn("Comments / Results", width="large"),
+            },
+            hide_index=True, key="editor",
+        )
 
+    if st.session_state.get("save_note"): st.success(st.session_state.pop("save_note"))
     if st.button("Save edits", type="primary"):
-        st.session_state.master = edited.copy()
-        st.success("Edits saved to session.")
+        # Unsaved edits are this session's overlay: the editor's own cell/row
+        # deltas, applied to the shared masterfile only on save
+        edits = st.session_state.editor
+        if not any(edits.get(k) for k in ("edited_rows", "added_rows", "deleted_rows")):
+            st.info("No edits to save.")
+        else:
+            with stage("Editor · save", len(master)):
+                n = set_master(apply_edits(master, edits), "edit")
+            if n:
+                # The page below (downloads, memo entries) must be built from the new version
+                st.session_state.save_note = "Edits saved to the masterfile."
+                del st.session_state["editor"]         # saved: the editor starts clean on the new version
+                st.rerun()
+            st.info("The edits leave the masterfile unchanged — nothing saved.")
+
+    spacer("lg")
+    st.markdown('<div class="sec">Version History</div>', unsafe_allow_html=True)
+    st.caption("Every upload, merge and save is a version. Undo and redo step through them; restore brings back any listed version.")
+    can_undo, can_redo = store.undo_redo()
+    h1, h2, _ = st.columns([1,1,4])
+    for col, label, ok, fn in [(h1, "↶ Undo", can_undo, store.undo), (h2, "↷ Redo", can_redo, store.redo)]:
+        if col.button(label, disabled=not ok, use_container_width=True):
+            with stage(f"History · {label[2:].lower()}", n_rows):
+                fn()
+            sync_master()
+            st.rerun()
+    hist = store.history()
+    if len(hist):
+        st.dataframe(hist.assign(Checkpoint=hist["Checkpoint"].astype(bool)), use_container_width=True, hide_index=True,
+                     height=min(300, 35*len(hist)+38))
+        r1, r2, _ = st.columns([2,1,3])
+        desc = {r.Version: f"v{r.Version} · {r.Kind} · {r.Saved.replace('T', ' ')}" for r in hist.itertuples()}
+        pick = r1.selectbox("Version", hist["Version"], format_func=desc.get, label_visibility="collapsed")
+        if r2.button("Restore version", disabled=pick == hist["Version"].iloc[0], use_container_width=True):
+            with stage("History · restore", n_rows):
+                store.restore(pick)
+            sync_master()
+            st.rerun()
 
     spacer("lg")
     st.markdown("---")
     spacer("md")
     d1, d2, _ = st.columns([1,1,2])
-    with d1:
-        st.download_button("Download Masterfile (.xlsx)", data=to_excel(st.session_state.master),
+    n_master = len(master)
+    with d1, stage("Export · Excel", n_master):
+        st.download_button("Download Masterfile (.xlsx)", data=derived("xlsx", lambda: to_excel(master)),
             file_name=f"Solutions_Masterfile_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    with d2:
-        st.download_button("Download Masterfile (.csv)", data=st.session_state.master.to_csv(index=False).encode(),
+    with d2, stage("Export · CSV", n_master):
+        st.download_button("Download Masterfile (.csv)", data=derived("csv", lambda: master.to_csv(index=False).encode()),
             file_name=f"Solutions_Masterfile_{datetime.now().strftime('%Y-%m-%d')}.csv", mime="text/csv")
 
 # Footer
 spacer("lg")
 st.markdown(f'<div class="ft">MARKEN · UPS HEALTHCARE PRECISION LOGISTICS &nbsp;|&nbsp; SOLUTIONS TEAM PIPELINE REPORT &nbsp;|&nbsp; CONFIDENTIAL</div>', unsafe_allow_html=True)
+
+# Debug panel (?debug=1) — shared cache counters
+if st.query_params.get("debug"):
+    with st.sidebar.expander("Debug · caches", expanded=True):
+        for name, c in [("Figures", figure_cache()), ("Uploads", ingest_cache())]:
+            n = c.hits + c.misses
+            st.caption(f"**{name}** — {c.hits} hits / {c.misses} misses ({c.hits/n*100 if n else 0:.0f}%) · "
+                       f"{len(c)} entries · {c.size/2**20:.1f} of {c.max_bytes/2**20:.0f} MB")
+
+# Profile panel (sidebar toggle or ?profile=1) — this run's stages, slowest highlighted
+if st.session_state.profile:
+    log = pd.DataFrame(st.session_state.prof_log, columns=["Run","Page","Stage","Rows","wall_ms","peak_mb"])
+    log = log.rename(columns={"wall_ms": "Wall ms", "peak_mb": "Peak MB"})
+    cur = log[log["Run"] == st.session_state.prof_run]
+    with st.expander(f"Profile · run {st.session_state.prof_run} · {cur['Wall ms'].sum():,.0f} ms across {len(cur)} stages", expanded=True):
+        slow = cur["Wall ms"].nlargest(3).index
+        st.dataframe(cur.drop(columns="Run").style
+                        .apply(lambda r: ["background-color:#FDECEA; font-weight:600" if r.name in slow else ""] * len(r), axis=1)
+                        .format({"Wall ms": "{:,.1f}", "Peak MB": "{:,.2f}", "Rows": lambda x: "" if pd.isna(x) else f"{x:,.0f}"}),
+                     use_container_width=True, hide_index=True)
+        st.caption("The three slowest stages are highlighted. Peaks are tracemalloc (process-wide) above the memory in use "
+                   "when the stage started. Cached stages show the cost of a cache hit.")
+        st.download_button("Download profile log (.csv)", data=log.to_csv(index=False).encode(),
+                           file_name=f"Solutions_profile_{datetime.now().strftime('%Y-%m-%d_%H%M')}.csv", mime="text/csv")
@@ -0,0 +1,135 @@
+"""Nightly batch report — a directory of Salesforce exports through the engine,
+no browser involved.
+
+    python batch.py EXPORT_DIR [-o OUT_DIR] [--master MASTERFILE] [-j WORKERS]
+
+Each export is read, cleaned and summarised (dashboard KPIs) in a process
+pool, one file per task. Merging is a fold — every merge builds on the one
+before — so it runs afterwards in file-name order, starting from --master or
+from the first export. Writes the merged masterfile and a summary workbook
+with per-file KPIs, merge stats, timings, the field-level change log and the
+merged pipeline's rollups."""
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+from itertools import repeat
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from engine import read_upload, merge_masterfile, prepare_frame, build_cube, rollup, kpis, to_excel
+
+EXPORT_EXT = (".xlsx", ".xls", ".csv", ".gz", ".zip")
+ROLLUPS = [("By Stage", "Stage"), ("By Region", "Owner Role"), ("By Service", "Main Primary Service"),
+           ("By Resource", "Solution Resource"), ("By Status", "Status"), ("By Product", "Product")]
+
+
+def summarize(master, today):
+    """Masterfile → (KPI row as on the unfiltered dashboard, aggregation cube)."""
+    df = prepare_frame(master)
+    cube = build_cube(df)
+    k = kpis(df, cube, today)
+    return {"Rows": len(master), "Pipeline Value": k["total"], "Opportunities": k["n_opp"],
+            "Customers": k["n_cust"], "Services": k["n_svc"], "Avg Deal": k["avg_deal"],
+            "Avg Stage Days": k["avg_dur"], "Over 60 Days": len(k["aging_60"]),
+            "Past Close Date": len(k["past_due"]), "Past Due Value": k["past_due"]["Opportunity PAR"].sum(),
+            "Received": k["n_received"], "Closed": k["n_closed"], "Avg Cycle": k["avg_cycle"]}, cube
+
+
+def file_report(path, today):
+    """One export → (clean masterfile frame or None, KPI + timing row).
+    Runs in a worker process; a bad file is reported, not raised."""
+    t0 = time.perf_counter()
+    row, cl = {"File": path.name}, None
+    try:
+        data = path.read_bytes()
+        t1 = time.perf_counter()
+        cl = read_upload(path.name.lower(), data)
+        t2 = time.perf_counter()
+        row.update(summarize(cl, today)[0])
+        row["Unparsed PAR"] = cl.attrs.get("par_unparsed", 0)
+        row.update({"Read s": t1-t0, "Clean s": t2-t1, "Aggregate s": time.perf_counter()-t2})
+    except Exception as e:
+        cl, row["Error"] = None, f"{type(e).__name__}: {e}"
+    row["Total s"] = time.perf_counter()-t0
+    return cl, row
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Merge a directory of Salesforce exports into the Solutions masterfile "
+                                             "and write a summary workbook.")
+    ap.add_argument("exports", type=Path, help="directory of exports (.xlsx / .xls / .csv, also gzip/zip), merged in file-name order")
+    ap.add_argument("-o", "--out", type=Path, default=Path("."), help="output directory (default: current)")
+    ap.add_argument("--master", type=Path, help="existing masterfile to merge into (default: the first export)")
+    ap.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    a = ap.parse_args(argv)
+
+    if not a.exports.is_dir(): ap.error(f"not a directory: {a.exports}")
+    files = sorted(p for p in a.exports.iterdir()
+                   if p.suffix.lower() in EXPORT_EXT and not p.name.startswith(("~$", ".")))
+    if not files: ap.error(f"no exports in {a.exports}")
+    today = pd.Timestamp.now().normalize()
+    t0 = time.perf_counter()
+
+    # ── Ingest + per-file KPIs: one task per file across the pool ──────────
+    with ProcessPoolExecutor(max_workers=max(1, min(a.workers, len(files)))) as ex:
+        results = list(ex.map(file_report, files, repeat(today)))
+    for _, row in results:
+        status = row.get("Error") or f"{row['Rows']:,} rows · {row['Total s']:.2f}s"
+        print(f"  {row['File']}: {status}", file=sys.stderr)
+    t_ingest = time.perf_counter()-t0
+
+    # ── Merge: sequential fold in file-name order ──────────────────────────
+    t = time.perf_counter()
+    master, merges, changes = None, [], []
+    if a.master:
+        master = read_upload(a.master.name.lower(), a.master.read_bytes())
+        merges.append({"File": a.master.name, "Step": "Base", "Total": len(master)})
+    for cl, row in results:
+        if cl is None: continue
+        tm = time.perf_counter()
+        if master is None:
+            master = cl
+            merges.append({"File": row["File"], "Step": "Base", "Total": len(master)})
+            continue
+        master, stats = merge_masterfile(master, cl)
+        merges.append({"File": row["File"], "Step": "Merge", "Updated": stats["updated"], "Unchanged": stats["unchanged"],
+                       "Added": stats["added"], "Removed": stats["removed"], "Total": stats["total"],
+                       "Duplicates": len(stats["duplicates"]), "Merge s": time.perf_counter()-tm})
+        changes.append(stats["changes"].assign(File=row["File"]))
+    if master is None:
+        print("No export could be read — nothing written.", file=sys.stderr)
+        return 1
+    t_merge = time.perf_counter()-t
+
+    # ── Outputs: masterfile + summary workbook ──────────────────────────────
+    t = time.perf_counter()
+    kp, cube = summarize(master, today)
+    stamp = datetime.now().strftime("%Y-%m-%d")
+    a.out.mkdir(parents=True, exist_ok=True)
+    mf_path = a.out / f"Solutions_Masterfile_{stamp}.xlsx"
+    mf_path.write_bytes(to_excel(master))
+    sm_path = a.out / f"Solutions_Batch_Summary_{stamp}.xlsx"
+    with pd.ExcelWriter(sm_path, engine="xlsxwriter") as w:
+        pd.DataFrame([{"File": "Merged masterfile", **kp}] + [r for _, r in results]).to_excel(w, sheet_name="Files", index=False)
+        pd.DataFrame(merges).to_excel(w, sheet_name="Merge", index=False)
+        if changes:
+            pd.concat(changes, ignore_index=True)[["File", "Opportunity Name", "Field", "Before", "After"]] \
+              .to_excel(w, sheet_name="Changes", index=False)
+        for name, by in ROLLUPS:
+            rollup(cube, by, cust=True)[[by,"Value","Count","Avg","AvgDur","Cust"]].to_excel(w, sheet_name=name, index=False)
+    t_out = time.perf_counter()-t
+
+    n_bad = sum(cl is None for cl, _ in results)
+    busy = sum(r["Total s"] for _, r in results)
+    print(f"{len(files)} file(s), {n_bad} failed · {len(master):,} rows in masterfile\n"
+          f"ingest {t_ingest:.2f}s wall ({busy:.2f}s across workers) · merge {t_merge:.2f}s · summary + write {t_out:.2f}s\n"
+          f"→ {mf_path}\n→ {sm_path}", file=sys.stderr)
+    return 1 if n_bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
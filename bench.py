@@ -0,0 +1,179 @@
+"""Engine benchmarks on synthetic exports — wall time and peak memory per
+stage at each size, saved as JSON so runs can be compared across commits.
+
+    python bench.py [--sizes 1k,10k,100k,1M] [--repeat 3] [-o FILE.json] [--compare OLD.json]
+
+Stages run in pipeline order on the same data, each on the previous stage's
+output. Wall time is the best of --repeat untraced runs. Peak memory is
+measured in a separate tracemalloc pass, because tracing slows
+allocation-heavy code. Per-row Python loops are only timed up to
+--scalar-max rows."""
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+import tracemalloc
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from engine import (clean_upload, fix_excel_eu_date, fix_excel_eu_date_batch, apply_schema, read_upload,
+                    merge_masterfile, prepare_frame, build_cube, rollup, cross, build_filter_index,
+                    filter_mask, kpis, to_excel, TEAM_COLS, ALL_COLS)
+from synth import synth_export, synth_update, parse_size
+
+DASH_ROLLUPS = ["Stage", "Account Name", "Main Primary Service", "Owner Role", "Opportunity Owner", "Status", "Product"]
+DASH_CROSSES = [("Main Primary Service","Owner Role","Value"), ("Owner Role","Stage","Value"),
+                ("Product","Main Primary Service","Value"), ("Product","Owner Role","Value"),
+                ("Solution Resource","Owner Role","Count"), ("Solution Resource","Status","Rows")]
+
+
+def dashboard_rows(df):
+    """The dashboard's aggregations as per-row groupby/crosstab (pre-cube)."""
+    agg = dict(Value=("Opportunity PAR","sum"), Count=("Opportunity Name","count"),
+               Avg=("Opportunity PAR","mean"), AvgDur=("Stage Duration","mean"))
+    out = [df.groupby(by, observed=True).agg(**agg) for by in DASH_ROLLUPS]
+    out.append(df.groupby("Solution Resource", observed=True).agg(**agg, Cust=("Account Name","nunique")))
+    out += [pd.crosstab(df[a], df[b], values=df["Opportunity PAR"], aggfunc="sum") for a, b, _ in DASH_CROSSES]
+    return out
+
+
+def dashboard_cube(df):
+    """The same aggregations as the app computes them: one cube, then rollups."""
+    cube = build_cube(df)
+    return [rollup(cube, by) for by in DASH_ROLLUPS] + [rollup(cube, "Solution Resource", cust=True)] \
+         + [cross(cube, a, b, m) for a, b, m in DASH_CROSSES]
+
+
+def dashboard_filter(df):
+    """A partial filter selection through the bitmap index, plus the KPIs."""
+    cube = build_cube(df)
+    fidx, cidx = build_filter_index(df), build_filter_index(cube)
+    sel = {c: fidx[c][0][::2] for c in ("Owner Role", "Stage")}
+    fdf, fcube = df[filter_mask(fidx, sel)], cube[filter_mask(cidx, sel)]
+    return kpis(fdf, fcube, pd.Timestamp.now().normalize())
+
+
+def masterfile(cl):
+    """Cleaned export → masterfile frame, as read_upload builds it."""
+    for c in TEAM_COLS:
+        if c not in cl.columns: cl[c] = ""
+    return apply_schema(cl[[c for c in ALL_COLS if c in cl.columns]])
+
+
+# Stage: (name, inputs from ctx, fn, output key or None, scalar?)
+STAGES = [
+    ("generate",                 [],                 None,                                          "raw",    False),
+    ("fix_excel_eu_date",        ["raw"],            lambda r: r["Received by Solutions"].map(fix_excel_eu_date), None, True),
+    ("fix_excel_eu_date_batch",  ["raw"],            lambda r: fix_excel_eu_date_batch(r["Received by Solutions"]), None, False),
+    ("clean_upload",             ["raw"],            lambda r: clean_upload(r),                     "clean",  False),
+    ("apply_schema",             ["clean"],          masterfile,                                    "master", False),
+    ("read_upload_csv",          ["csv"],            lambda b: read_upload("export.csv", b),        None,     False),
+    ("merge_masterfile",         ["master", "next"], lambda m, n: merge_masterfile(m, n)[0], "merged", False),
+    ("prepare_frame",            ["merged"],         prepare_frame,                                 "df",     False),
+    ("dashboard_groupbys_rows",  ["df"],             dashboard_rows,                                None,     False),
+    ("dashboard_groupbys_cube",  ["df"],             dashboard_cube,                                None,     False),
+    ("dashboard_filter_kpis",    ["df"],             dashboard_filter,                              None,     False),
+    ("to_excel",                 ["merged"],         to_excel,                                      None,     False),
+]
+
+
+def timed(fn, args, repeat, trace):
+    """(result, best wall seconds, peak MB or None)."""
+    best, peak, out = float("inf"), None, None
+    for _ in range(repeat):
+        out = None
+        t = time.perf_counter(); out = fn(*args); best = min(best, time.perf_counter()-t)
+    if trace:
+        out = None
+        tracemalloc.start()
+        out = fn(*args)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return out, best, peak
+
+
+def run_size(n, seed, repeat, trace, scalar_max, only):
+    ctx, rows = {}, []
+    def gen():
+        raw = synth_export(n, seed)
+        ctx["csv"] = raw.to_csv(index=False).encode()
+        ctx["next"] = clean_upload(synth_update(raw, seed + 1))
+        return raw
+    for name, keys, fn, key, scalar in STAGES:
+        fn = fn or gen
+        if only and name not in only:               # not timed; run once if a later stage needs it
+            if key: ctx[key] = fn(*[ctx[k] for k in keys])
+            continue
+        if scalar and n > scalar_max:
+            rows.append({"size": n, "stage": name, "skipped": True})
+            print(f"{n:>10,}  {name:<26} skipped", file=sys.stderr)
+            continue
+        out, wall, peak = timed(fn, [ctx[k] for k in keys], 1 if name == "generate" else repeat, trace and name != "generate")
+        if key: ctx[key] = out
+        rows.append({"size": n, "stage": name, "wall_s": round(wall, 5),
+                     "peak_mb": None if peak is None else round(peak, 2),
+                     "rows_per_s": round(n / wall) if wall else None})
+        print(f"{n:>10,}  {name:<26} {wall:9.3f}s" + (f"  {peak:9.1f} MB" if peak is not None else ""), file=sys.stderr)
+    return rows
+
+
+def git_info():
+    """(short commit, dirty?) of the tree being benchmarked, or (None, None)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                                    capture_output=True, text=True).stdout.strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(old, new):
+    """Print new vs old wall time / peak memory per (size, stage)."""
+    prev = {(r["size"], r["stage"]): r for r in old["results"] if not r.get("skipped")}
+    print(f"\nvs {old.get('commit') or old['file']}:\n{'size':>10}  {'stage':<26} {'wall':>9} {'Δ':>7}  {'peak MB':>9} {'Δ':>7}")
+    for r in new["results"]:
+        o = prev.get((r["size"], r["stage"]))
+        if r.get("skipped") or not o: continue
+        ratio = lambda a, b: f"{a/b:6.2f}x" if a is not None and b else "     —"
+        print(f"{r['size']:>10,}  {r['stage']:<26} {r['wall_s']:8.3f}s {ratio(r['wall_s'], o['wall_s'])}  "
+              f"{r['peak_mb'] if r['peak_mb'] is not None else '—':>9} {ratio(r['peak_mb'], o.get('peak_mb'))}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the engine stages on synthetic Salesforce exports.")
+    ap.add_argument("--sizes", default="1k,10k,100k,1M", help="comma-separated row counts (default: 1k,10k,100k,1M)")
+    ap.add_argument("--repeat", type=int, default=3, help="timed runs per stage, best kept (default: 3)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--stages", help="comma-separated stages to time (stages feeding them still run once)")
+    ap.add_argument("--scalar-max", type=parse_size, default=100_000, help="largest size for per-row scalar stages")
+    ap.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak-memory pass")
+    ap.add_argument("-o", "--out", help="results JSON (default: bench_<commit>.json)")
+    ap.add_argument("--compare", help="earlier results JSON to compare against")
+    a = ap.parse_args(argv)
+
+    sha, dirty = git_info()
+    only = set(a.stages.split(",")) if a.stages else None
+    res = {"commit": sha, "dirty": dirty, "when": datetime.now().isoformat(timespec="seconds"),
+           "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+           "machine": platform.machine(), "platform": platform.platform(), "seed": a.seed, "repeat": a.repeat,
+           "results": []}
+    for n in map(parse_size, a.sizes.split(",")):
+        res["results"] += run_size(n, a.seed, a.repeat, not a.no_memory, a.scalar_max, only)
+    out = a.out or f"bench_{sha or 'local'}{'-dirty' if dirty else ''}.json"
+    with open(out, "w") as f: json.dump(res, f, indent=1)
+    print(f"→ {out}", file=sys.stderr)
+    if a.compare:
+        with open(a.compare) as f: old = json.load(f)
+        old["file"] = a.compare
+        compare(old, res)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,909 @@
+"""Solutions pipeline engine — ingest, clean, merge, derive, aggregate and
+export the masterfile. No Streamlit or Plotly imports: app.py and app1.py
+render on top of it, and batch jobs, benchmarks and profiling import it
+directly."""
+import re
+import gzip
+import time
+import zipfile
+import hashlib
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from collections import OrderedDict
+from io import BytesIO
+from datetime import datetime, date
+
+import numpy as np
+import pandas as pd
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PALETTE & FORMATS
+# ═══════════════════════════════════════════════════════════════════════════════
+# ── Marken Brand Palette ─────────────────────────────────────────────────────
+NY    = "#002B49"
+NY2   = "#003A63"
+TL    = "#00857C"
+TLL   = "#E8F5F3"
+GD    = "#FFB500"
+W     = "#FFFFFF"
+G50   = "#FAFBFC"
+G100  = "#F4F5F7"
+G200  = "#E1E4E8"
+G400  = "#A0A8B4"
+G600  = "#6B7280"
+G800  = "#2D3748"
+BA    = "#2E86AB"
+RD    = "#DC3545"
+GN    = "#28A745"
+OR    = "#E06C47"
+AM    = "#F6AD55"
+SEQ   = [NY, TL, GD, BA, "#6C5B7B", OR, GN, "#9B59B6", "#F39C12", "#1ABC9C"]
+
+# Date display format
+DATE_FMT = "%d-%b-%Y"   # e.g. 09-Feb-2026
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SCHEMA
+# ═══════════════════════════════════════════════════════════════════════════════
+SF_COLS   = ["Stage","Solution Resource","Account Name","Owner Role","Opportunity Name",
+             "Opportunity Owner","Main Primary Service","Opportunity PAR","Stage Duration",
+             "Close Date","Notes","Status","Received by Solutions","Closed by Solutions","Product"]
+TEAM_COLS = ["Solutions Notes","Tasks","Action Items","Comments / Results"]
+ALL_COLS  = SF_COLS + TEAM_COLS
+
+STAGE_ORDER = ["Information Gathering","Solutions Design","Proposal/Price Quote",
+               "Proposal Price/Quote","Negotiations","Closed/Won","Closed/Lost"]
+
+# Dimension columns — stored as categoricals, rolled up by the dashboard cube
+DIM_COLS = ["Stage", "Status", "Product", "Main Primary Service", "Owner Role",
+            "Solution Resource", "Opportunity Owner", "Account Name"]
+
+STATUS_COLORS = {"Working": GN, "Pending": AM, "Completed": BA, "Unassigned": G400}
+
+# Excel exports above this many rows are streamed (constant memory, inline strings)
+EXCEL_STREAM_ROWS = 50_000
+
+# Excel ingestion: rows scanned per sheet for the header, known column names it must hold
+HEADER_SCAN_ROWS = 25
+HEADER_MIN_MATCH = 3
+
+# CSV ingestion: rows per chunk; compressed exports are recognised by content
+CSV_EXT = (".csv", ".gz", ".zip")
+CSV_CHUNK_ROWS = 100_000
+
+# Parse plans kept per process, one per export header layout
+PLAN_CACHE_LAYOUTS = 64
+
+# Bump whenever read_upload/clean_upload output changes — invalidates cached parses
+PARSER_VERSION = 4
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# INGEST & CLEAN
+# ═══════════════════════════════════════════════════════════════════════════════
+def parse_par(val):
+    if pd.isna(val): return 0.0
+    if isinstance(val, (int, float)): return float(val)
+    s = str(val).strip().upper().replace("USD","").replace("$","").replace(",","").strip()
+    try: return float(s)
+    except ValueError: return 0.0
+
+
+def parse_par_batch(s):
+    """Column-at-once parse_par. Returns (values, bad) — bad flags non-blank
+    cells that could not be read as a number and were set to 0.0."""
+    s = pd.Series(s)
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype(float).fillna(0.0), pd.Series(False, index=s.index)
+    # Exports repeat the same amounts a lot — normalise each distinct value once
+    codes, uniq = pd.factorize(s)
+    u = pd.Series(uniq, dtype=object)
+    txt = (u.astype(str).str.upper().str.replace("USD", "", regex=False)
+            .str.replace("$", "", regex=False).str.replace(",", "", regex=False).str.strip())
+    blank = txt == ""
+    try:
+        vals = txt.mask(blank, "0").to_numpy(dtype=object).astype(float)
+        miss = np.zeros(len(u), dtype=bool)
+    except ValueError:
+        vals = pd.to_numeric(txt.mask(blank, "0"), errors="coerce").to_numpy(dtype=float, copy=True)
+        # Anything to_numeric refused goes through the scalar parser so results stay identical
+        miss = np.isnan(vals) & (txt.str.upper() != "NAN").to_numpy()
+        vals[miss] = u[miss].map(parse_par).to_numpy(dtype=float)
+    bad_u = miss & (vals == 0.0) & ~blank.to_numpy()
+    # codes == -1 (blank/NaN) pick the appended 0.0 / False — also when every cell is blank
+    out = np.append(vals, 0.0)[codes]
+    bad = np.append(bad_u, False)[codes]
+    return pd.Series(out, index=s.index), pd.Series(bad, index=s.index)
+
+
+def fix_excel_eu_date(val):
+    """Robust parser for Solutions date columns with mixed formats.
+    Handles: DD/M/YYYY strings, M/D/YY strings (2-digit year),
+    and Excel datetimes where month↔day was swapped on import.
+    Examples:
+        '27/1/2026'  → 27-Jan-2026   (DD/M/YYYY string)
+        '2/10/26'    → 10-Feb-2026   (M/DD/YY string)
+        '2/9/26'     → 09-Feb-2026   (M/D/YY string)
+        datetime(2026,10,2) → 10-Feb-2026  (Excel swapped 2/10/26)
+    """
+    if pd.isna(val):
+        return pd.NaT
+
+    # ── String input ─────────────────────────────────────────────────────
+    if isinstance(val, str):
+        val = val.strip()
+        if not val:
+            return pd.NaT
+        parts = re.split(r'[/\-]', val)
+        if len(parts) == 3:
+            try:
+                a, b, c = [int(p) for p in parts]
+            except ValueError:
+                return pd.to_datetime(val, dayfirst=True, errors="coerce")
+            # Fix 2-digit year → 4-digit
+            yr = c if c > 100 else (2000 + c)
+            if a > 12:
+                # First number > 12 → must be the day → DD/MM/YYYY
+                return pd.Timestamp(year=yr, month=b, day=a)
+            elif b > 12:
+                # Second number > 12 → must be the day → MM/DD/YYYY
+                return pd.Timestamp(year=yr, month=a, day=b)
+            else:
+                # Both ≤ 12 — ambiguous: use M/D/YY (US short, common in SF)
+                try:
+                    return pd.Timestamp(year=yr, month=a, day=b)
+                except Exception:
+                    return pd.Timestamp(year=yr, month=b, day=a)
+        return pd.to_datetime(val, dayfirst=True, errors="coerce")
+
+    # ── Datetime / Timestamp from Excel ──────────────────────────────────
+    try:
+        ts = pd.Timestamp(val)
+        # Excel read '2/10/26' as 2026-10-02 (Oct 2) — should be Feb 10
+        if ts.day <= 12 and ts.month > 2:
+            return pd.Timestamp(year=ts.year, month=ts.day, day=ts.month)
+        return ts
+    except Exception:
+        return pd.NaT
+
+
+_DMY_RE = r"^\s*([0-9]{1,9})\s*[/\-]\s*([0-9]{1,9})\s*[/\-]\s*([0-9]{1,9})\s*$"
+_ISO_RE = r"^[0-9]{4}-[0-9]{2}-[0-9]{2}(?:[ T][0-9]{2}:[0-9]{2}(?::[0-9]{2}(?:\.[0-9]+)?)?)?$"
+
+
+def _ymd(yr, mo, dy):
+    """Bulk datetime64[ns] from year/month/day arrays + mask of valid dates."""
+    ok = (yr > 1677) & (yr < 2262) & (mo >= 1) & (mo <= 12) & (dy >= 1)
+    m = np.where(ok, (yr - 1970) * 12 + mo - 1, 0)
+    first = m.astype("M8[M]").astype("M8[D]")
+    ok &= dy <= ((m + 1).astype("M8[M]").astype("M8[D]") - first).astype(int)
+    return (first + np.where(ok, dy - 1, 0).astype("m8[D]")).astype("M8[ns]"), ok
+
+
+def _swap_excel_dates(v):
+    """fix_excel_eu_date's datetime rule over a datetime64[ns] array."""
+    di = pd.DatetimeIndex(v)
+    fixed, _ = _ymd(di.year.to_numpy(), di.day.to_numpy(), di.month.to_numpy())
+    return np.where(np.asarray((di.day <= 12) & (di.month > 2)), fixed, di.to_numpy())
+
+
+def fix_excel_eu_date_batch(s):
+    """Column-at-once fix_excel_eu_date — same rules, same outputs.
+    Each distinct value is resolved once; values the fast path cannot settle
+    (free-text dates, impossible day/month combinations) go through the
+    scalar parser."""
+    s = pd.Series(s)
+    if isinstance(s.dtype, pd.DatetimeTZDtype):
+        return s.apply(fix_excel_eu_date)
+    if s.dtype.kind == "M":
+        return pd.Series(_swap_excel_dates(s.to_numpy(dtype="M8[ns]")), index=s.index)
+
+    codes, u = pd.factorize(s)
+    u = np.asarray(u, dtype=object)
+    res = np.full(len(u), np.datetime64("NaT"), dtype="M8[ns]")
+    is_str = np.fromiter((isinstance(v, str) for v in u), bool, len(u))
+    is_dt = np.fromiter((isinstance(v, (datetime, date, np.datetime64)) for v in u), bool, len(u))
+    rest = ~is_str & ~is_dt
+
+    # ── Strings: one regex pass for the three parts, rules as NumPy masks ──
+    if is_str.any():
+        txt = pd.Series(u[is_str], dtype=object)
+        p = txt.str.extract(_DMY_RE)
+        a, b, c = (pd.to_numeric(p[i]).fillna(0).to_numpy(dtype=np.int64) for i in range(3))
+        yr = np.where(c > 100, c, 2000 + c)
+        dmy = a > 12                                   # first > 12 → DD/MM
+        ts, ok = _ymd(yr, np.where(dmy, b, a), np.where(dmy, a, b))
+        amb = ~dmy & (b <= 12) & ~ok                   # ambiguous M/D failed → try D/M
+        ts2, ok2 = _ymd(yr, b, a)
+        ts = np.where(amb & ok2, ts2, ts)
+        good = p[0].notna().to_numpy() & (ok | (amb & ok2))
+        idx = np.flatnonzero(is_str)
+        res[idx[good]] = ts[good]
+        rest[idx[~good & (txt.str.strip() != "").to_numpy()]] = True
+
+    # ── Excel datetimes: swap month↔day where Excel mis-read M/D as D/M ─
+    if is_dt.any():
+        dt = pd.to_datetime(pd.Series(u[is_dt]), errors="coerce")
+        if dt.dtype != "M8[ns]":
+            rest |= is_dt
+        else:
+            idx = np.flatnonzero(is_dt)
+            res[idx] = _swap_excel_dates(dt.to_numpy())
+            rest[idx[dt.isna().to_numpy()]] = True
+
+    # ── ISO timestamps (Excel datetimes written out as CSV text): unambiguous ─
+    iso = rest & is_str
+    if iso.any():
+        idx = np.flatnonzero(iso)
+        txt = pd.Series(u[idx], dtype=object).str.strip()
+        ts = pd.to_datetime(txt.where(txt.str.match(_ISO_RE)), format="ISO8601", errors="coerce")
+        hit = ts.notna().to_numpy()
+        if hit.any():
+            # With a time part it is an Excel datetime saved as text: read as the
+            # scalar parser's dayfirst does — year-day-month whenever the day fits
+            # a month. A plain YYYY-MM-DD date is taken as written.
+            d = pd.DatetimeIndex(ts[hit])
+            timed = (txt[hit].str.len() > 10).to_numpy()
+            sw, _ = _ymd(d.year.to_numpy(), d.day.to_numpy(), d.month.to_numpy())
+            res[idx[hit]] = np.where(timed & (d.day <= 12), sw + (d - d.normalize()).to_numpy(), d.to_numpy())
+            rest[idx[hit]] = False
+
+    if rest.any():
+        fill = pd.Series(u[rest], dtype=object).map(fix_excel_eu_date)
+        if fill.dtype != res.dtype: res = pd.Series(res).astype(object).to_numpy(copy=True)
+        res[rest] = fill.to_numpy()
+    # codes == -1 (missing) reindexes to NaT
+    return pd.Series(pd.Series(res).reindex(codes, fill_value=pd.NaT).to_numpy(), index=s.index)
+
+
+def fmt_date(val):
+    """Format a date value to DD-MMM-YYYY. Returns '—' for NaT/None."""
+    if pd.isna(val): return "—"
+    try:
+        ts = pd.Timestamp(val)
+        return ts.strftime(DATE_FMT)
+    except Exception:
+        return str(val)
+
+
+# ── Parse plans ──────────────────────────────────────────────────────────────
+_col_key = lambda c: str(c).strip().lower().replace(" ", "")      # header matching: case, spaces
+_CANON = {_col_key(c): c for c in ALL_COLS}
+_KNOWN = set(_CANON)
+
+
+def layout_key(columns):
+    """Fingerprint of an export's header row — same report layout, same key."""
+    return hashlib.sha1("\x1f".join(map(str, columns)).encode()).hexdigest()[:16]
+
+
+def build_plan(columns):
+    """Header row → parse plan: the "Unnamed" columns to drop, the rename map
+    onto ALL_COLS and the dtype plan for a CSV read. Nothing taken from the
+    values — those are each file's own."""
+    cols = [c for c in dict.fromkeys(columns)]
+    rename = {c: _CANON[_col_key(c)] for c in cols if _col_key(c) in _CANON}
+    return {"key": layout_key(columns),
+            "drop": [c for c in cols if str(c).startswith("Unnamed")],
+            "rename": rename,
+            # numbers are left to the C parser (numeric when clean, text for clean_upload otherwise)
+            "dtypes": {c: object for c, k in rename.items() if k not in ("Opportunity PAR", "Stage Duration")}}
+
+
+def plan_for(columns):
+    """The cached parse plan for this header layout, built on first sight."""
+    key = layout_key(columns)
+    plan = _PLANS.get(key)
+    if plan is None:
+        plan = build_plan(columns)
+        _PLANS.put(key, plan, 1)
+    return plan
+
+
+def close_dates(s, plan):
+    """Close Date (US M/D/YYYY) → datetime64. Like pandas' inference, the
+    format is the one guessed from the file's first string. A plan carrying
+    "dates" (read_csv_chunked's per-file copy) keeps the first chunk's guess
+    for the chunks after it; the cached layout plan never holds one."""
+    first = next((v for v in s.dropna() if isinstance(v, str)), None)
+    fmt = plan.get("dates", {}).get("Close Date")
+    if first is not None and fmt is None:
+        fmt = pd.tseries.api.guess_datetime_format(first) or "mixed"
+        if "dates" in plan: plan["dates"]["Close Date"] = fmt
+    if first is None or fmt == "mixed": return pd.to_datetime(s, errors="coerce", dayfirst=False)
+    return pd.to_datetime(s, format=fmt, errors="coerce")
+
+
+def clean_upload(df, plan=None):
+    """Raw export → SF_COLS/TEAM_COLS names and types, through the parse plan
+    for its header layout (plan_for) — header matching runs once per layout."""
+    plan = plan or plan_for(df.columns)
+    df = df.drop(columns=[c for c in plan["drop"] if c in df.columns]).rename(columns=plan["rename"])
+    if "Opportunity PAR" in df.columns:
+        df["Opportunity PAR"], bad = parse_par_batch(df["Opportunity PAR"])
+        df.attrs["par_unparsed"] = int(bad.sum())     # a count, not the rows: pandas deep-copies attrs on every operation
+    if "Stage Duration" in df.columns:
+        df["Stage Duration"] = compact_int(df["Stage Duration"])
+    # Close Date uses US format (MM/DD/YYYY)
+    if "Close Date" in df.columns:
+        df["Close Date"] = close_dates(df["Close Date"], plan)
+    # Received / Closed by Solutions use EU format (DD/MM/YYYY) — fix Excel swap
+    if "Received by Solutions" in df.columns:
+        df["Received by Solutions"] = fix_excel_eu_date_batch(df["Received by Solutions"])
+    if "Closed by Solutions" in df.columns:
+        df["Closed by Solutions"] = fix_excel_eu_date_batch(df["Closed by Solutions"])
+    if "Status" in df.columns:  df["Status"] = df["Status"].fillna("Unassigned")
+    if "Product" in df.columns: df["Product"] = df["Product"].fillna("General")
+    return df.reset_index(drop=True)
+
+
+def compact_int(s):
+    """Numeric column → smallest integer dtype that holds it (blanks → 0)."""
+    return pd.to_numeric(pd.to_numeric(s, errors="coerce").fillna(0).astype(int), downcast="integer")
+
+
+def to_dates(s):
+    """Date column → datetime64. Editor strings are DD-MMM-YYYY ('—' for blank);
+    anything else falls back to pandas' parser."""
+    if pd.api.types.is_datetime64_any_dtype(s): return s
+    out = pd.to_datetime(s, format=DATE_FMT, errors="coerce")
+    miss = out.isna() & s.notna() & (s.astype(str).str.strip() != "—")
+    if miss.any(): out[miss] = pd.to_datetime(s[miss].astype(str), errors="coerce")
+    return out
+
+
+def cow_copy(df):
+    """df.copy() that costs nothing under pandas copy-on-write (columns are
+    copied on first write) and is a deep copy otherwise."""
+    return df.copy(deep=not pd.get_option("mode.copy_on_write"))
+
+
+def apply_schema(df):
+    """Typed, compact masterfile: DIM_COLS as categoricals (Stage ordered by
+    STAGE_ORDER), Stage Duration as the smallest int, PAR float, dates
+    datetime64. Idempotent — applied at ingestion, after merge and on save."""
+    df = cow_copy(df)
+    for c in DIM_COLS:
+        if c not in df.columns: continue
+        seen = set(df[c].dropna().unique())
+        if c == "Stage":
+            cats, ordered = STAGE_ORDER + sorted(seen - set(STAGE_ORDER), key=str), True
+        else:
+            cats, ordered = sorted(seen | {"Status":{"Unassigned"}, "Product":{"General"}}.get(c, set()), key=str), False
+        df[c] = pd.Categorical(df[c], categories=cats, ordered=ordered)
+    if "Opportunity PAR" in df.columns: df["Opportunity PAR"] = parse_par_batch(df["Opportunity PAR"])[0]
+    if "Stage Duration" in df.columns:  df["Stage Duration"] = compact_int(df["Stage Duration"])
+    for c in ["Close Date", "Received by Solutions", "Closed by Solutions"]:
+        if c in df.columns: df[c] = to_dates(df[c])
+    return df
+
+
+def plain_frame(df):
+    """Categoricals back to object — for the data editor, which would
+    otherwise restrict edits to the existing categories."""
+    return df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+
+
+def schema_memory(df):
+    """(bytes in memory, bytes saved vs object dimensions and int64 durations)."""
+    now = df.memory_usage(deep=True).sum()
+    plain = plain_frame(df)
+    if "Stage Duration" in plain.columns: plain["Stage Duration"] = plain["Stage Duration"].astype("int64")
+    return now, plain.memory_usage(deep=True).sum() - now
+
+
+def find_header(rows):
+    """(row index, [(column index, name)]) of the row among `rows` naming the
+    most ALL_COLS columns, or None when none names HEADER_MIN_MATCH."""
+    best = None
+    for i, row in enumerate(rows):
+        cols, seen = [], set()
+        for j, v in enumerate(row):
+            if v is not None and _col_key(v) in _KNOWN and _col_key(v) not in seen:
+                cols.append((j, str(v).strip())); seen.add(_col_key(v))
+        if len(cols) >= HEADER_MIN_MATCH and (best is None or len(cols) > len(best[1])): best = (i, cols)
+    return best
+
+
+def read_excel_stream(data):
+    """Workbook bytes → raw frame of just the ALL_COLS columns, streamed with
+    openpyxl in read-only mode. The data sheet and header row are the first
+    (sheet, row within HEADER_SCAN_ROWS) naming the most known columns, so
+    report title rows and extra summary sheets are skipped; other columns
+    are never materialised. None if no sheet has such a header."""
+    from openpyxl import load_workbook
+    wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        found = []
+        for ws in wb.worksheets:
+            hit = find_header(list(ws.iter_rows(max_row=HEADER_SCAN_ROWS, values_only=True)))
+            if hit: found.append((len(hit[1]), -len(found), ws, hit))
+        if not found: return None
+        _, _, ws, (h, cols) = max(found, key=lambda t: t[:2])
+        idx = [j for j, _ in cols]
+        out = [[] for _ in idx]
+        for row in ws.iter_rows(min_row=h + 2, values_only=True):
+            vals = [row[j] if j < len(row) else None for j in idx]
+            if all(v is None for v in vals): continue
+            for o, v in zip(out, vals): o.append(v)
+        return pd.DataFrame({name: pd.Series(o, dtype=object) for (_, name), o in zip(cols, out)}).infer_objects()
+    finally:
+        wb.close()
+
+
+def open_csv(data):
+    """CSV bytes → (text stream, underlying buffer). gzip and zip (the first
+    .csv member) are unpacked on the fly; buffer.tell() is how far in the
+    upload the reader has got."""
+    buf = BytesIO(data)
+    if data[:2] == b"\x1f\x8b": return gzip.GzipFile(fileobj=buf), buf
+    if data[:4] == b"PK\x03\x04":
+        z = zipfile.ZipFile(buf)
+        names = [n for n in z.namelist() if not n.endswith("/")]
+        return z.open(next((n for n in names if n.lower().endswith(".csv")), names[0])), buf
+    return buf, buf
+
+
+def read_csv_chunked(data, progress=None):
+    """CSV export (plain, gzip or zip bytes) → cleaned frame, parsed in
+    CSV_CHUNK_ROWS chunks with its layout's dtype plan instead of inference:
+    only the ALL_COLS columns, text ones (dimensions, raw date strings) read
+    as text, PAR and Stage Duration as numbers. Each chunk is cleaned on the way in and its DIM_COLS
+    turned categorical, so the object columns never exist for the whole file.
+    progress(fraction) is called after every chunk."""
+    f, buf = open_csv(data)
+    with f:
+        plan = {**plan_for(pd.read_csv(f, nrows=0).columns), "dates": {}}      # this file's Close Date format
+    cols = list(plan["rename"])
+    f, buf = open_csv(data)
+    chunks, bad = [], 0
+    with f:
+        for raw in pd.read_csv(f, usecols=cols, dtype=plan["dtypes"], chunksize=CSV_CHUNK_ROWS):
+            cl = clean_upload(raw, plan)          # one Close Date format for the whole file, as pandas would
+            bad += cl.attrs.pop("par_unparsed", 0)
+            chunks.append(cl.astype({c: "category" for c in DIM_COLS if c in cl.columns}))
+            if progress: progress(min(1.0, buf.tell() / max(1, len(data))))
+    if not chunks: return clean_upload(pd.DataFrame(columns=cols))
+    dims = [c for c in chunks[0].columns if c in DIM_COLS]
+    df = pd.concat([ch.drop(columns=dims) for ch in chunks], ignore_index=True)
+    for c in dims: df[c] = pd.api.types.union_categoricals([ch[c] for ch in chunks])
+    df = df[list(chunks[0].columns)]
+    df.attrs["par_unparsed"] = bad
+    return df
+
+
+def read_upload(name, data, progress=None):
+    """Uploaded export or masterfile (raw bytes) → clean masterfile frame.
+    CSV (also .csv.gz / .zip) goes through read_csv_chunked; .xlsx through
+    read_excel_stream, falling back to pd.read_excel for a workbook without
+    a recognisable header (and for .xls)."""
+    raw = cl = None
+    if name.lower().endswith(CSV_EXT): cl = read_csv_chunked(data, progress)
+    elif name.lower().endswith((".xlsx", ".xlsm")): raw = read_excel_stream(data)
+    if cl is None: cl = clean_upload(raw if raw is not None else pd.read_excel(BytesIO(data)))
+    for c in TEAM_COLS:
+        if c not in cl.columns: cl[c] = ""
+    return apply_schema(cl[[c for c in ALL_COLS if c in cl.columns]])
+
+
+_NAME_DATE = re.compile(r"(?<!\d)(20\d\d)[-_.]?(\d\d)[-_.]?(\d\d)(?!\d)")
+_NAME_EPOCH = re.compile(r"(?<!\d)(1\d{12})(?!\d)")      # SF "report1712345678901.xlsx": epoch ms
+_CORE_DATE = re.compile(r"<dcterms:(created|modified)[^>]*>([^<]+)<")
+
+
+def export_date(name, data=None):
+    """When an export was taken, for ordering a batch: a YYYY-MM-DD /
+    YYYYMMDD date or a Salesforce epoch-ms stamp in the file name, else the
+    workbook's created (or modified) time; None if none of these."""
+    m = _NAME_DATE.search(name)
+    if m:
+        try: return pd.Timestamp(int(m[1]), int(m[2]), int(m[3]))
+        except ValueError: pass
+    m = _NAME_EPOCH.search(name)
+    if m: return pd.Timestamp(int(m[1]), unit="ms")
+    if data is not None and name.lower().endswith(".xlsx"):
+        try:
+            with zipfile.ZipFile(BytesIO(data)) as z:
+                props = dict(_CORE_DATE.findall(z.read("docProps/core.xml").decode("utf-8", "replace")))
+            stamp = props.get("created") or props.get("modified")
+            if stamp: return pd.Timestamp(stamp).tz_localize(None)
+        except (KeyError, ValueError, zipfile.BadZipFile):
+            pass
+    return None
+
+
+def export_order(names, dates):
+    """Indexes of a batch of exports, oldest first — undated ones after the
+    dated, in their given order."""
+    return sorted(range(len(names)), key=lambda i: (dates[i] is None, dates[i] or pd.Timestamp.min, i))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# MERGE
+# ═══════════════════════════════════════════════════════════════════════════════
+def row_fingerprints(df, cols=SF_COLS):
+    """64-bit hash per row of `cols` (missing ones count as blank). Compares
+    values, not dtypes: a category and its string, an int and its float hash
+    the same, so a masterfile and a fresh export line up."""
+    canon = {}
+    for c in cols:
+        s = df[c] if c in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+        if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s): s = s.astype("float64")
+        canon[c] = s
+    return pd.util.hash_pandas_object(pd.DataFrame(canon, index=df.index), index=False).to_numpy()
+
+
+def merge_masterfile(master, new_sf):
+    """Upsert a cleaned SF export into the masterfile, keyed on Opportunity Name.
+    Matching rows whose SF fingerprint changed get those fields refreshed
+    (first export row per key); the rest are not touched. New keys are
+    appended with blank team columns and keys gone from SF are tagged in
+    Solutions Notes. stats has the counts, `changes` (one row per changed
+    field: Opportunity Name, Field, Before, After), the `added_keys` /
+    `removed_keys` and the keys that repeat in the export (`duplicates`).
+    `master` itself is left as it was."""
+    master = master.copy(deep=False)            # columns are replaced, never written in place
+    for c in TEAM_COLS:
+        if c not in master.columns: master[c] = ""
+    key = "Opportunity Name"
+    mk, nk = master[key], new_sf[key]
+    old_o, new_o = pd.Index(mk.dropna().unique()), pd.Index(nk.dropna().unique())
+    dups = sorted(map(str, nk[nk.notna() & nk.duplicated()].unique()))
+
+    # ── Update: fingerprints pick the matched rows whose SF fields moved ──
+    src = new_sf[nk.notna()].drop_duplicates(key).set_index(key)
+    cols = [c for c in SF_COLS if c != key and c in new_sf.columns]
+    hit = np.flatnonzero(mk.isin(new_o).to_numpy())
+    fp_new = pd.Series(row_fingerprints(src, cols), index=src.index)
+    pos = hit[row_fingerprints(master.iloc[hit], cols) != fp_new.reindex(mk.iloc[hit]).to_numpy()]
+    rows, keys, log = src.reindex(mk.iloc[pos]), mk.iloc[pos].to_numpy(), []
+    moved = np.zeros(len(pos), dtype=bool)
+    for c in cols:
+        col = master[c] if c in master.columns else pd.Series(np.nan, index=master.index, dtype=object)
+        old, vals = col.iloc[pos].astype(object).to_numpy(), rows[c].astype(object).to_numpy()
+        d = ~((pd.isna(old) & pd.isna(vals)) | (old == vals))
+        if not d.any(): continue
+        moved |= d
+        log.append(pd.DataFrame({key: keys[d], "Field": c, "Before": old[d], "After": vals[d]}))
+        vals = rows[c].to_numpy()[d]
+        col = cow_copy(col) if col.dtype == vals.dtype else col.astype(object)
+        col.iloc[pos[d]] = vals
+        master[c] = col.infer_objects() if col.dtype == object else col
+
+    # ── Append new keys, tag removed ones ─────────────────────────────────
+    added, removed = new_o.difference(old_o), old_o.difference(new_o)
+    nr = new_sf[nk.isin(added)].copy()
+    for c in TEAM_COLS: nr[c] = ""
+    master = pd.concat([master,nr], ignore_index=True)
+    mask = master[key].isin(removed)
+    master.loc[mask,"Solutions Notes"] = master.loc[mask,"Solutions Notes"].fillna("").astype(str)+" [Removed from SF]"
+    cols = [c for c in ALL_COLS if c in master.columns]
+    changes = pd.concat(log, ignore_index=True) if log else pd.DataFrame(columns=[key, "Field", "Before", "After"])
+    return apply_schema(master[cols].reset_index(drop=True)), {
+        "updated": int(moved.sum()), "unchanged": len(hit) - int(moved.sum()), "added": len(added), "removed": len(removed),
+        "total": len(master), "duplicates": dups, "changes": changes,
+        "added_keys": list(added), "removed_keys": list(removed)}
+
+
+def merge_exports(master, exports):
+    """Fold several cleaned exports, oldest first, into the masterfile (or,
+    with master None, into the first of them) — one merge_masterfile per
+    export, one combined stats dict: the counts are masterfile before vs
+    after, `changes` gains a File column and `files` has a row per export."""
+    exports = list(exports)
+    if master is None:
+        (name, master), exports = exports[0], exports[1:]
+        files = [{"File": name, "Step": "Base", "Rows": len(master), "Total": len(master)}]
+    else:
+        files = []
+    before = pd.Index(master["Opportunity Name"].dropna().unique())
+    logs, dups, stats = [], set(), None
+    for name, new_sf in exports:
+        master, stats = merge_masterfile(master, new_sf)
+        logs.append(stats["changes"].assign(File=name))
+        dups.update(stats["duplicates"])
+        files.append({"File": name, "Step": "Merge", "Rows": len(new_sf), "Updated": stats["updated"],
+                      "Added": stats["added"], "Removed": stats["removed"], "Total": stats["total"]})
+    changes = pd.concat(logs, ignore_index=True) if logs else pd.DataFrame(columns=["Opportunity Name", "Field", "Before", "After", "File"])
+    after = pd.Index(master["Opportunity Name"].dropna().unique())
+    removed = stats["removed_keys"] if stats else []
+    touched = before.intersection(pd.Index(changes["Opportunity Name"].unique()))
+    return master, {"updated": len(touched), "unchanged": len(before) - len(touched) - len(before.intersection(pd.Index(removed))),
+                    "added": len(after.difference(before)), "removed": len(removed), "total": len(master),
+                    "duplicates": sorted(dups), "changes": changes, "added_keys": list(after.difference(before)),
+                    "removed_keys": removed, "files": files}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# DERIVE
+# ═══════════════════════════════════════════════════════════════════════════════
+def prepare_frame(master):
+    """Masterfile → dashboard frame: typed PAR/duration, parsed + display
+    dates, Status/Product fills and Solutions cycle days."""
+    df = cow_copy(master)
+    df["Opportunity PAR"] = parse_par_batch(df["Opportunity PAR"])[0]
+    df["Stage Duration"]  = compact_int(df.get("Stage Duration", pd.Series(0, index=df.index)))
+    df["Close Date Parsed"] = pd.to_datetime(df["Close Date"], errors="coerce")
+
+    # Format display date columns
+    df["Close Date Display"] = df["Close Date Parsed"].apply(fmt_date)
+
+    if "Received by Solutions" in df.columns:
+        df["Received by Solutions Parsed"] = pd.to_datetime(df["Received by Solutions"], errors="coerce")
+        df["Received Display"] = df["Received by Solutions Parsed"].apply(fmt_date)
+    else:
+        df["Received by Solutions Parsed"] = pd.NaT
+        df["Received Display"] = "—"
+
+    if "Closed by Solutions" in df.columns:
+        df["Closed by Solutions Parsed"] = pd.to_datetime(df["Closed by Solutions"], errors="coerce")
+        df["Closed Display"] = df["Closed by Solutions Parsed"].apply(fmt_date)
+    else:
+        df["Closed by Solutions Parsed"] = pd.NaT
+        df["Closed Display"] = "—"
+
+    if "Status" not in df.columns: df["Status"] = "Unassigned"
+    else: df["Status"] = df["Status"].fillna("Unassigned")
+    if "Product" not in df.columns: df["Product"] = "General"
+    else: df["Product"] = df["Product"].fillna("General")
+
+    # Solutions Cycle Time
+    df["Solutions Cycle Days"] = (df["Closed by Solutions Parsed"] - df["Received by Solutions Parsed"]).dt.days
+    return df
+
+
+def editor_frame(master, df):
+    """Masterfile as shown in the data editor — the master's own columns with
+    dates taken from the prepared frame's DD-MMM-YYYY display columns."""
+    edf = plain_frame(master)
+    for c in TEAM_COLS:
+        if c not in edf.columns: edf[c] = ""
+    for dc, disp in [("Close Date","Close Date Display"), ("Received by Solutions","Received Display"),
+                     ("Closed by Solutions","Closed Display")]:
+        if dc in edf.columns: edf[dc] = df[disp]
+    return edf
+
+
+def apply_edits(master, edits):
+    """Masterfile + the data editor's edit state ({"edited_rows": {row: {col: value}},
+    "deleted_rows": [row], "added_rows": [{col: value}]}, rows by position) →
+    new masterfile, applied in the editor's order. Under copy-on-write only
+    the edited columns are copied."""
+    out = cow_copy(master)
+    cells = {}
+    for r, changes in (edits.get("edited_rows") or {}).items():
+        for c, val in changes.items(): cells.setdefault(c, {})[int(r)] = val
+    for c, rv in cells.items():
+        col = out[c].astype(object) if c in out.columns else pd.Series("", index=out.index, dtype=object)
+        col.iloc[list(rv)] = list(rv.values())
+        out[c] = col
+    out = out.drop(index=out.index[list(edits.get("deleted_rows") or [])])
+    if edits.get("added_rows"):
+        out = pd.concat([out, pd.DataFrame(edits["added_rows"])], ignore_index=True)
+    for c in TEAM_COLS:
+        if c in out.columns: out[c] = out[c].fillna("")
+    return apply_schema(out.reset_index(drop=True))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# AGGREGATE
+# ═══════════════════════════════════════════════════════════════════════════════
+# ── Aggregation cube ─────────────────────────────────────────────────────────
+def build_cube(df):
+    """One pass over the rows: additive measures per distinct combination of
+    DIM_COLS. Means are derived on roll-up; nunique comes from the dims."""
+    return (df.assign(_named=df["Opportunity Name"].notna())
+              .groupby(DIM_COLS, observed=True, dropna=False, sort=False)
+              .agg(Value=("Opportunity PAR","sum"), Count=("_named","sum"),
+                   Rows=("Opportunity PAR","size"), DurSum=("Stage Duration","sum"))
+              .reset_index())
+
+
+def rollup(cube, by, cust=False):
+    """Roll a (filtered) cube up to one dimension — same table as
+    fdf.groupby(by).agg(Value=sum, Count=count, Avg=mean, AvgDur=mean[, Cust=nunique])."""
+    g = cube.groupby(by, observed=True)
+    r = g[["Value","Count","Rows","DurSum"]].sum()
+    r["Avg"], r["AvgDur"] = r["Value"]/r["Rows"], r["DurSum"]/r["Rows"]
+    if cust: r["Cust"] = g["Account Name"].nunique()
+    return r.reset_index()
+
+
+def cross(cube, a, b, m="Value"):
+    """Two-dimension pivot of a cube measure — replaces pd.crosstab over rows."""
+    return cube.groupby([a,b], observed=True)[m].sum().unstack(fill_value=0)
+
+
+# ── Filter index ─────────────────────────────────────────────────────────────
+FILTER_COLS = ["Stage", "Main Primary Service", "Owner Role", "Solution Resource", "Status", "Product"]
+
+def build_filter_index(t):
+    """Per filter dimension: sorted distinct values (the multiselect options),
+    a packed row bitmap per value and the 'has any value' bitmap."""
+    idx = {"_n": len(t)}
+    for c in FILTER_COLS:
+        codes, uniq = pd.factorize(t[c])
+        bits = {v: np.packbits(codes == i) for i, v in enumerate(uniq)}
+        idx[c] = (sorted(bits), bits, np.packbits(codes >= 0))
+    return idx
+
+
+def filter_mask(idx, sel):
+    """{dimension: selected values} → boolean row mask — value bitmaps ORed
+    within a dimension, ANDed across. Selecting every option (the default)
+    is the precomputed 'has any value' bitmap, same as isin over all values."""
+    m = None
+    for c, chosen in sel.items():
+        opts, bits, anyv = idx[c]
+        if len(chosen) == len(opts): b = anyv
+        else:
+            b = np.zeros_like(anyv)
+            for v in chosen:
+                if v in bits: b |= bits[v]
+        m = b if m is None else m & b
+    return np.unpackbits(m, count=idx["_n"]).astype(bool)
+
+
+def filter_sig(opts, sel):
+    """Canonical filter state: '*' for a full selection, else the sorted picks.
+    `opts` maps each dimension to its options (e.g. build_filter_index's)."""
+    return tuple("*" if len(vals) == len(opts[c]) else tuple(sorted(vals)) for c, vals in sel.items())
+
+
+def kpis(fdf, fcube, today):
+    """Headline metrics of a filtered view — pipeline value and counts from the
+    cube, date-based risk and Solutions-cycle metrics from the row frame."""
+    n_opp = int(fcube["Rows"].sum())
+    stat_n = fcube.groupby("Status", observed=True)["Rows"].sum()
+    rcv = fdf.dropna(subset=["Received by Solutions Parsed"])
+    n_closed = int(fdf["Closed by Solutions Parsed"].notna().sum())
+    cycle_days = fdf["Solutions Cycle Days"].dropna()
+    total = fcube["Value"].sum()
+    return dict(
+        total=total, n_opp=n_opp,
+        n_cust=fcube["Account Name"].nunique(),
+        n_svc=fcube["Main Primary Service"].nunique(),
+        avg_deal=total/n_opp if n_opp else 0,
+        avg_dur=fcube["DurSum"].sum()/n_opp if n_opp else 0,
+        past_due=fdf[fdf["Close Date Parsed"] < today],
+        aging_60=fdf[fdf["Stage Duration"] > 60],
+        n_working=int(stat_n.get("Working", 0)),
+        n_pending=int(stat_n.get("Pending", 0)),
+        n_unassigned=int(stat_n.get("Unassigned", 0)),
+        n_products=fcube[fcube["Product"]!="General"]["Product"].nunique(),
+        rcv=rcv, n_received=len(rcv), pct_received=pct(len(rcv), n_opp),
+        n_closed=n_closed, pct_closed=pct(n_closed, n_opp),
+        avg_cycle=f"{cycle_days.mean():.0f}d" if len(cycle_days) else "—",
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FORMAT & EXPORT
+# ═══════════════════════════════════════════════════════════════════════════════
+def fc(v):
+    if pd.isna(v) or v==0: return "$0"
+    if abs(v)>=1e6: return f"${v/1e6:,.1f}M"
+    if abs(v)>=1e3: return f"${v/1e3:,.0f}K"
+    return f"${v:,.0f}"
+
+
+def pct(part, whole):
+    return f"{part/whole*100:.0f}%" if whole else "0%"
+
+
+def pl(fig, h=380, mb=40, mt=32):
+    """Apply MBB-style layout to any Plotly figure — generous spacing."""
+    fig.update_layout(
+        font=dict(family="DM Sans, sans-serif", size=11.5, color=G800),
+        paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)",
+        height=h, margin=dict(l=16, r=16, t=mt, b=mb),
+        legend=dict(font=dict(size=9.5), orientation="h", y=-0.18, x=0.5, xanchor="center",
+                    bgcolor="rgba(0,0,0,0)"),
+    )
+    fig.update_xaxes(gridcolor=G200, gridwidth=0.5, showline=True, linecolor=G200, linewidth=0.8,
+                     tickfont=dict(size=10, color=G600))
+    fig.update_yaxes(gridcolor=G200, gridwidth=0.5, showline=True, linecolor=G200, linewidth=0.8,
+                     tickfont=dict(size=10, color=G600))
+    return fig
+
+
+def to_excel(df):
+    """Masterfile → styled .xlsx bytes. Formats are defined once per column
+    (team columns teal) instead of per cell; large masterfiles are streamed
+    row by row with xlsxwriter's constant_memory mode."""
+    import xlsxwriter
+    exp = df.copy()
+    # Format date columns for export — each distinct date formatted once
+    for dc in ["Close Date", "Received by Solutions", "Closed by Solutions"]:
+        if dc in exp.columns:
+            codes, uniq = pd.factorize(pd.to_datetime(exp[dc], errors="coerce"))
+            exp[dc] = np.append(pd.DatetimeIndex(uniq).strftime(DATE_FMT).to_numpy(dtype=object), "")[codes]
+    # Width from header + first 50 rows, as before
+    ml = exp.head(50).astype(str).map(len).max() if len(exp) else pd.Series(0, index=exp.columns)
+
+    buf = BytesIO()
+    wb = xlsxwriter.Workbook(buf, {"constant_memory": len(exp) > EXCEL_STREAM_ROWS, "nan_inf_to_errors": True,
+                                   "strings_to_formulas": False, "strings_to_urls": False})
+    ws = wb.add_worksheet("Masterfile")
+    base = {"font_name":"Calibri", "font_size":10, "border":1, "border_color":"#E1E4E8", "valign":"vcenter", "text_wrap":True}
+    hf = wb.add_format({**base, "bold":True, "font_color":"#FFFFFF", "bg_color":"#002B49", "align":"center"})
+    bf = wb.add_format(base)
+    tf = wb.add_format({**base, "bg_color":"#E8F5F3"})
+    for ci, cn in enumerate(exp.columns):
+        ws.set_column(ci, ci, min(max(len(str(cn)), ml[cn]) + 4, 42), tf if cn in TEAM_COLS else bf)
+        ws.write_string(0, ci, str(cn), hf)
+    # Unformatted cells pick up the column format; None cells stay empty
+    for ri, row in enumerate(exp.astype(object).where(exp.notna(), None).itertuples(index=False, name=None), 1):
+        ws.write_row(ri, 0, row)
+    wb.close()
+    return buf.getvalue()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CACHE
+# ═══════════════════════════════════════════════════════════════════════════════
+class LRUCache:
+    """Thread-safe LRU map bounded by the total size (bytes) of its values."""
+    def __init__(self, max_bytes):
+        self.max_bytes, self.size, self.hits, self.misses = max_bytes, 0, 0, 0
+        self._d, self._lock = OrderedDict(), threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._d:
+                self.misses += 1
+                return None
+            self._d.move_to_end(key)
+            self.hits += 1
+            return self._d[key][0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            if key in self._d: self.size -= self._d.pop(key)[1]
+            if nbytes > self.max_bytes: return
+            self._d[key] = (value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self.size -= self._d.popitem(last=False)[1][1]
+
+    def __len__(self):
+        return len(self._d)
+
+
+_PLANS = LRUCache(PLAN_CACHE_LAYOUTS)      # parse plans (plan_for), charged 1 each: bounded by layout count
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PROFILING
+# ═══════════════════════════════════════════════════════════════════════════════
+# Open measure() blocks across the process, and whether they started tracing
+_TRACE, _TRACE_LOCK = {"open": 0, "owned": False}, threading.Lock()
+
+
+@contextmanager
+def measure(rec):
+    """Time a block into the dict `rec`: wall_ms, and peak_mb — the tracemalloc
+    peak above what was allocated on entry. Tracing is process-wide, so
+    concurrent work shows up in the peak. If tracemalloc is off, the first
+    of the measures open at once starts it and the last to finish stops it:
+    tracing runs only while some block is being measured."""
+    with _TRACE_LOCK:
+        if not _TRACE["open"] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _TRACE["owned"] = True
+        _TRACE["open"] += 1
+    tracemalloc.reset_peak()
+    m0, t0 = tracemalloc.get_traced_memory()[0], time.perf_counter()
+    try:
+        yield rec
+    finally:
+        rec["wall_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        rec["peak_mb"] = round(max(0, tracemalloc.get_traced_memory()[1] - m0) / 2**20, 2)
+        with _TRACE_LOCK:
+            _TRACE["open"] -= 1
+            if not _TRACE["open"] and _TRACE["owned"]:
+                tracemalloc.stop()
+                _TRACE["owned"] = False
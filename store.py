@@ -0,0 +1,387 @@
+"""SQLite-backed masterfile store — the masterfile persists between sessions
+and restarts, and filters and cube rollups can run as SQL, so a session
+never has to hold years of opportunities to draw a filtered dashboard.
+
+One table, `master`: the ALL_COLS columns plus `pos` for row order, with
+dates stored as ISO text, indexed on Opportunity Name, the six filter
+dimensions and Close Date. Every write bumps `meta.version` inside a single
+IMMEDIATE transaction, so readers see either the old masterfile or the new
+one, and concurrent merges queue rather than interleave. WAL mode lets
+readers proceed during a write. A write rewrites only the rows whose
+fingerprint differs from the stored version (read from its snapshot, else
+from SQL) and drops any past the new end.
+
+The unfiltered masterfile is read through a snapshot: an uncompressed Arrow
+IPC (Feather v2) file per store version, next to the database, written by
+the first reader of that version. Opening it memory-maps the file, so every
+process reading the same version shares the page cache instead of
+re-parsing SQL rows, and a restart starts from the file already on disk.
+
+Every write is also kept in `history` as a columnar delta — the rows it
+wrote, by position, plus the new length, as a zstd-compressed Arrow stream.
+Every HISTORY_CHECKPOINT-th version (and any write touching half the rows)
+is kept whole instead, so any version is rebuilt from the checkpoint at or
+before it plus fewer than HISTORY_CHECKPOINT deltas. Undo, redo and restore
+are writes like any other: they append a version, never rewind the counter."""
+import os
+import glob
+import uuid
+import sqlite3
+from datetime import datetime
+from contextlib import closing, contextmanager
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from engine import ALL_COLS, TEAM_COLS, DIM_COLS, FILTER_COLS, apply_schema, merge_masterfile, merge_exports, row_fingerprints
+
+DATE_COLS = ["Close Date", "Received by Solutions", "Closed by Solutions"]
+SQL_TYPES = {"Opportunity PAR": "REAL", "Stage Duration": "INTEGER"}
+# Filled on write, as clean_upload does, so filters on them stay index lookups
+FILL = {"Status": "Unassigned", "Product": "General"}
+HISTORY_CHECKPOINT = 10     # versions between full copies in the history
+HISTORY_KEEP = 200          # versions kept; older ones go, a whole checkpoint span at a time
+
+
+def q(c):
+    """Quoted SQL identifier — column names carry spaces and slashes."""
+    return '"' + c.replace('"', '""') + '"'
+
+
+class MasterStore:
+    """Masterfile persisted in a SQLite file. Thread-safe: each call opens its own connection."""
+    def __init__(self, path):
+        self.path = str(path)
+        with closing(self._con()) as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            cols = ", ".join(f"{q(c)} {SQL_TYPES.get(c, 'TEXT')}" for c in ALL_COLS)
+            con.execute(f"CREATE TABLE IF NOT EXISTS master (pos INTEGER PRIMARY KEY, {cols})")
+            con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            con.execute("INSERT OR IGNORE INTO meta VALUES ('version', '0'), ('store_id', ?)", (uuid.uuid4().hex,))
+            # parent: live version before this write; base: the version whose
+            # content this one repeats (itself, unless undo/redo/restore); ref:
+            # the version undone / undo reversed / version restored
+            con.execute("CREATE TABLE IF NOT EXISTS history (version INTEGER PRIMARY KEY, parent INTEGER, base INTEGER, "
+                        "ref INTEGER, kind TEXT, label TEXT, at TEXT, rows INTEGER, changed INTEGER, "
+                        "checkpoint INTEGER, data BLOB)")
+            for i, c in enumerate(["Opportunity Name"] + FILTER_COLS + ["Close Date"]):
+                con.execute(f"CREATE INDEX IF NOT EXISTS ix_master_{i} ON master ({q(c)})")
+
+    def _con(self):
+        # Autocommit; writes open their own BEGIN IMMEDIATE transaction
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+
+    # ── Version ──────────────────────────────────────────────────────────────
+    def version(self):
+        """(store id, write counter) — changes on every write, never repeats for this file."""
+        with closing(self._con()) as con:
+            return self._version(con)
+
+    @staticmethod
+    def _version(con):
+        m = dict(con.execute("SELECT key, value FROM meta"))
+        return m["store_id"], int(m["version"])
+
+    def count(self):
+        with closing(self._con()) as con:
+            return con.execute("SELECT COUNT(*) FROM master").fetchone()[0]
+
+    # ── Read ─────────────────────────────────────────────────────────────────
+    def close_years(self):
+        """(first, last) Close Date year in the store, or None."""
+        with closing(self._con()) as con:
+            lo, hi = con.execute(f"SELECT MIN({q('Close Date')}), MAX({q('Close Date')}) FROM master").fetchone()
+        return (int(lo[:4]), int(hi[:4])) if lo else None
+
+    def load(self, sel=None, opts=None, years=None, version=None):
+        """The masterfile (or the rows matching a filter selection and close-year
+        window), typed by apply_schema; None while the store is empty.
+        Unfiltered reads come from the version's Arrow snapshot — with
+        `version`, only while that is still the stored one (None otherwise)."""
+        if sel is None and years is None:
+            path = self.snapshot(version)
+            return path and read_snapshot(path)
+        with closing(self._con()) as con:
+            return self._read(con, sel, opts, years)
+
+    def _read(self, con, sel=None, opts=None, years=None):
+        where, params = self.where(sel, opts, years)
+        have = [r[1] for r in con.execute("PRAGMA table_info(master)") if r[1] in ALL_COLS]
+        df = pd.read_sql_query(f"SELECT {', '.join(map(q, have))} FROM master{where} ORDER BY pos", con, params=params)
+        if not len(df) and sel is None and years is None: return None
+        return typed(df)
+
+    def options(self):
+        """Distinct values per filter dimension — the multiselect options."""
+        with closing(self._con()) as con:
+            return {c: [r[0] for r in con.execute(f"SELECT DISTINCT {q(c)} FROM master WHERE {q(c)} IS NOT NULL ORDER BY 1")]
+                    for c in FILTER_COLS}
+
+    @staticmethod
+    def where(sel, opts, years=None):
+        """{dimension: selected values} [+ (first, last) close year] → (' WHERE …',
+        params). A full selection keeps rows with any value (NULLs out), as
+        filter_mask does; undated rows stay in any close-year window."""
+        conds, params = [], []
+        if years:
+            conds.append(f"({q('Close Date')} IS NULL OR {q('Close Date')} BETWEEN ? AND ?)")
+            params += [f"{years[0]}-01-01", f"{years[1]}-12-31"]
+        for c, vals in (sel or {}).items():
+            if opts is not None and len(vals) == len(opts[c]):
+                conds.append(f"{q(c)} IS NOT NULL")
+            else:
+                conds.append(f"{q(c)} IN ({', '.join('?' * len(vals))})" if len(vals) else "0")
+                params += list(vals)
+        return (" WHERE " + " AND ".join(conds) if conds else ""), params
+
+    def cube(self, sel=None, opts=None, years=None):
+        """build_cube as SQL GROUP BY over the filtered rows — same columns,
+        dtypes and first-seen row order, so rollup()/cross() work on it unchanged."""
+        where, params = self.where(sel, opts, years)
+        dims = ", ".join(map(q, DIM_COLS))
+        sql = (f"SELECT {dims}, SUM({q('Opportunity PAR')}) AS Value, COUNT({q('Opportunity Name')}) AS Count, "
+               f"COUNT(*) AS Rows, SUM({q('Stage Duration')}) AS DurSum FROM master{where} GROUP BY {dims} ORDER BY MIN(pos)")
+        with closing(self._con()) as con:
+            c = pd.read_sql_query(sql, con, params=params)
+        c[["Value", "DurSum"]] = c[["Value", "DurSum"]].fillna(0)
+        return apply_schema(c)
+
+    # ── Snapshot ─────────────────────────────────────────────────────────────
+    def snapshot(self, version=None):
+        """Path of the current version's Arrow snapshot, written first if
+        missing; None while the store is empty, or when it has moved on from
+        `version`. The version and the rows are read in one transaction, so
+        a snapshot never mixes two versions."""
+        with closing(self._con()) as con:
+            con.execute("BEGIN")
+            ver = self._version(con)
+            if version is not None and ver != tuple(version): return None
+            path = self._snapshot_path(ver)
+            if os.path.exists(path): return path
+            df = self._read(con)
+            if df is None: return None
+        # Unique temp name + rename: concurrent first readers each write a
+        # complete file and the last rename wins; readers never see a partial one
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        feather.write_feather(df, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+        for old in glob.glob(f"{glob.escape(self.path)}.*.arrow"):
+            if old != path:
+                try: os.remove(old)             # open maps stay valid; on Windows the file stays until closed
+                except OSError: pass
+        return path
+
+    def _snapshot_path(self, ver):
+        return f"{self.path}.{ver[0][:8]}-{ver[1]}.arrow"
+
+    def _current(self, con):
+        """The stored masterfile (None if empty) — from this version's snapshot
+        when one was written, else from SQL on `con`."""
+        path = self._snapshot_path(self._version(con))
+        return read_snapshot(path) if os.path.exists(path) else self._read(con)
+
+    # ── Write ────────────────────────────────────────────────────────────────
+    @contextmanager
+    def _tx(self):
+        """Connection inside a write transaction — committed on success, rolled back on error."""
+        with closing(self._con()) as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+
+    def _write(self, con, df, cur=None, kind="save", label="", ref=None, base=None):
+        """Store df as the masterfile (inside the caller's transaction) and
+        record it in the history. Given the stored frame `cur`, only positions
+        whose row fingerprint differs are written and rows past the end
+        dropped — and nothing at all, no version either, when df is the
+        stored frame (except for undo/redo); otherwise the table is replaced. Returns the rows written."""
+        if cur is None:
+            con.execute("DELETE FROM master")
+            pos = np.arange(len(df))
+        else:
+            n = min(len(cur), len(df))
+            pos = np.flatnonzero(row_fingerprints(df.iloc[:n], ALL_COLS) != row_fingerprints(cur.iloc[:n], ALL_COLS))
+            pos = np.concatenate([pos, np.arange(n, len(df))])
+            # Nothing changed: no write, no version. Undo/redo still step, so an
+            # older no-op entry in the history cannot stall them
+            if not len(pos) and len(df) == len(cur) and kind not in ("undo", "redo"): return 0
+            con.execute("DELETE FROM master WHERE pos >= ?", (len(df),))
+        out = stored_form(df.iloc[pos])
+        con.executemany(f"INSERT OR REPLACE INTO master (pos, {', '.join(map(q, ALL_COLS))}) VALUES (?{', ?' * len(ALL_COLS)})",
+                        ((int(i), *(None if isinstance(v, float) and np.isnan(v) else v for v in row))
+                         for i, row in zip(pos, out.itertuples(index=False, name=None))))
+        con.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+
+        # History: the delta just written, or the whole frame at a checkpoint
+        ver = self._version(con)[1]
+        last_cp = con.execute("SELECT MAX(version) FROM history WHERE checkpoint").fetchone()[0]
+        full = (last_cp is None or ver - last_cp >= HISTORY_CHECKPOINT or 2*len(pos) >= len(df)
+                or con.execute("SELECT 1 FROM history WHERE version = ?", (ver-1,)).fetchone() is None)
+        written = len(pos)                      # rows that changed; a checkpoint then stores them all
+        if full and len(pos) < len(df):
+            pos, out = np.arange(len(df)), stored_form(df)
+        con.execute("INSERT INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (ver, ver-1, ver if base is None else base, ref, kind, label, datetime.now().isoformat(timespec="seconds"),
+                     len(df), written, int(full), pack(out.assign(pos=pos))))
+        # Prune whole checkpoint spans older than HISTORY_KEEP versions
+        keep = con.execute("SELECT MAX(version) FROM history WHERE checkpoint AND version <= ?", (ver - HISTORY_KEEP,)).fetchone()[0]
+        if keep is not None: con.execute("DELETE FROM history WHERE version < ?", (keep,))
+        return written
+
+    def save(self, df, kind="save", label=""):
+        """Replace the stored masterfile with df, atomically. Returns the rows
+        written — 0, and no new version, when nothing changed."""
+        with self._tx() as con:
+            return self._write(con, df, self._current(con), kind, label)
+
+    def merge(self, new_sf, label=""):
+        """merge_masterfile against the stored masterfile and write the result
+        through, all under one write lock — a merge from another session
+        lands before or after this one, never in between. A list of
+        (name, frame) exports, oldest first, goes through merge_exports and
+        is written once, as one version."""
+        with self._tx() as con:
+            cur = self._current(con)
+            if not isinstance(new_sf, pd.DataFrame):
+                merged, stats = merge_exports(cur, new_sf)
+            elif cur is None:
+                merged, stats = new_sf, {"updated": 0, "unchanged": 0, "added": len(new_sf), "removed": 0,
+                                         "total": len(new_sf), "duplicates": [], "changes": pd.DataFrame(),
+                                         "added_keys": list(new_sf["Opportunity Name"].dropna()), "removed_keys": []}
+            else:
+                merged, stats = merge_masterfile(cur, new_sf)
+            stats["rows_written"] = self._write(con, merged, cur, "merge", label)
+        return merged, stats
+
+    # ── History ──────────────────────────────────────────────────────────────
+    def history(self, limit=50):
+        """Newest-first list of versions still in the history."""
+        with closing(self._con()) as con:
+            return pd.read_sql_query("SELECT version AS Version, at AS Saved, kind AS Kind, label AS Label, rows AS Rows, "
+                                     "changed AS Changed, checkpoint AS Checkpoint FROM history ORDER BY version DESC LIMIT ?",
+                                     con, params=(limit,))
+
+    def at(self, version):
+        """The masterfile as it was at `version`, or None if it is not in the history."""
+        with closing(self._con()) as con:
+            return self._rebuild(con, version)
+
+    def _entry(self, con, version):
+        r = con.execute("SELECT version, parent, base, ref, kind FROM history WHERE version = ?", (version,)).fetchone()
+        return r and dict(zip(["version", "parent", "base", "ref", "kind"], r))
+
+    def _rebuild(self, con, version):
+        """Checkpoint at or before `version`, then the deltas after it, in order."""
+        cp = con.execute("SELECT MAX(version) FROM history WHERE checkpoint AND version <= ?", (version,)).fetchone()[0]
+        if cp is None: return None
+        steps = con.execute("SELECT rows, data FROM history WHERE version BETWEEN ? AND ? ORDER BY version", (cp, version)).fetchall()
+        if len(steps) != version - cp + 1: return None
+        cols = {}
+        for n, data in steps:
+            d = unpack(data)
+            pos = d.pop("pos").to_numpy()
+            for c in ALL_COLS:
+                a = cols.get(c, np.empty(0, dtype=object))
+                a = a[:n] if len(a) >= n else np.concatenate([a, np.full(n - len(a), None, dtype=object)])
+                a[pos] = d[c].to_numpy(dtype=object) if c in d.columns else None
+                cols[c] = a
+        return typed(pd.DataFrame(cols)) if cols and len(cols[ALL_COLS[0]]) else None
+
+    def _targets(self, con):
+        """(version undo would bring back, undo entry redo would reverse) — either None."""
+        live = self._entry(con, self._version(con)[1])
+        if not live: return None, None
+        content = self._entry(con, live["base"])
+        back = content and self._entry(con, content["parent"])
+        fwd = None
+        if live["kind"] == "undo": fwd = live
+        elif live["kind"] == "redo":
+            before = self._entry(con, (self._entry(con, live["ref"]) or {}).get("parent"))
+            if before and before["kind"] == "undo": fwd = before
+        return back and back["version"], fwd and fwd["version"]
+
+    def undo_redo(self):
+        """(can undo, can redo) for the current version."""
+        with closing(self._con()) as con:
+            back, fwd = self._targets(con)
+        return back is not None, fwd is not None
+
+    def _restore(self, con, version, kind, label, ref):
+        """Write `version`'s content as a new version. Undo and redo keep the
+        content's base, so a further undo steps back from it; a restore is
+        a fresh edit, which undo takes back to what was live before it."""
+        df = self._rebuild(con, version)
+        if df is None: return None
+        base = self._entry(con, version)["base"] if kind in ("undo", "redo") else None
+        self._write(con, df, self._current(con), kind, label, ref, base)
+        return df
+
+    def undo(self):
+        """Bring back the content from before the current one; the new
+        masterfile, or None if there is nothing to undo."""
+        with self._tx() as con:
+            back, _ = self._targets(con)
+            live = self._entry(con, self._version(con)[1])
+            return None if back is None else self._restore(con, back, "undo", f"undo v{live['base']}", live["base"])
+
+    def redo(self):
+        """Reverse the last undo; the new masterfile, or None if the last write was not an undo (or redo)."""
+        with self._tx() as con:
+            _, fwd = self._targets(con)
+            if fwd is None: return None
+            undone = self._entry(con, fwd)["ref"]
+            return self._restore(con, undone, "redo", f"redo v{undone}", fwd)
+
+    def restore(self, version):
+        """Make a past version current again; the new masterfile, or None if it is not in the history."""
+        with self._tx() as con:
+            return self._restore(con, version, "restore", f"restore v{version}", version)
+
+
+def read_snapshot(path):
+    """Masterfile from an Arrow snapshot, memory-mapped. Columns Arrow can hand
+    over as-is (numbers and dates without gaps, category codes) stay views of
+    the mapped file — read-only, shared with every process mapping it."""
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+
+def stored_form(df):
+    """Frame → the values written to SQLite: ISO date strings, Status/Product
+    filled, None for blanks."""
+    out = pd.DataFrame(index=df.index)
+    for c in ALL_COLS:
+        s = df[c] if c in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if c in DATE_COLS:
+            s = pd.to_datetime(s, errors="coerce").dt.strftime("%Y-%m-%d")
+        elif c in FILL:
+            s = s.astype(object).fillna(FILL[c])
+        out[c] = s.astype(object).where(s.notna(), None)
+    return out
+
+
+def typed(df):
+    """Stored values (SQL rows, history) → masterfile frame, typed by apply_schema."""
+    for c in DATE_COLS:
+        df[c] = pd.to_datetime(df[c], format="%Y-%m-%d", errors="coerce")
+    for c in TEAM_COLS:
+        df[c] = df[c].fillna("")
+    return apply_schema(df)
+
+
+def pack(df):
+    """Frame → zstd-compressed Arrow IPC stream bytes."""
+    t = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, t.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as w:
+        w.write_table(t)
+    return sink.getvalue().to_pybytes()
+
+
+def unpack(data):
+    return pa.ipc.open_stream(data).read_all().to_pandas()
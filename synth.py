@@ -0,0 +1,150 @@
+"""Deterministic synthetic Salesforce exports — the real SF_COLS schema with the
+mess the parser has to cope with, at any size, for benchmarks and load tests.
+
+    python synth.py 100k -o SF_export.csv [--seed 7] [--update]
+
+Same (n, seed) → same frame, byte for byte. What is in it:
+  · Opportunity PAR as numbers, "USD 1,200", "$3,400", bare "1200", blanks
+    and the odd unparseable "TBD"
+  · Close Date as US M/D/YYYY strings, with a share already parsed by Excel
+  · Received / Closed by Solutions as EU D/M/YYYY strings, US M/D/YY strings
+    (ambiguous when both parts ≤ 12) and Excel datetimes with month↔day
+    swapped on import
+  · skewed cardinalities: a few dozen services/resources, hundreds of
+    owners, thousands of accounts with a long tail, unique opportunity names
+synth_update() derives next week's export from one: fields change, some
+opportunities drop out and new ones appear — the input merge_masterfile sees."""
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from engine import SF_COLS
+
+REGIONS   = ["NORAM", "EMEA", "APAC", "LATAM"]
+SERVICES  = ["Next Flight Out", "Courier", "Depot Storage", "Direct-to-Patient", "Kit Assembly",
+             "Clinical Trial Logistics", "Cold Chain Packaging", "Customs Brokerage", "Sample Return",
+             "Biological Storage", "Ancillary Supplies", "Home Healthcare"]
+STAGES    = ["Information Gathering", "Solutions Design", "Proposal/Price Quote", "Proposal Price/Quote",
+             "Negotiations", "Closed/Won", "Closed/Lost"]
+STAGE_P   = [.14, .30, .16, .04, .14, .12, .10]
+STATUSES  = ["Working", "Pending", "Completed", None]
+PRODUCTS  = ["Cell & Gene Therapy", "Radiopharma", "Vaccines", "Biologics", None]
+NOTES     = ["Awaiting customer volumes", "Pricing under review", "RFP due end of month",
+             "Lane analysis requested", "Site visit scheduled", None]
+
+
+def _pick(rng, n, k, a=1.1):
+    """n draws from k categories with a Zipf-like skew — a few heavy hitters, long tail."""
+    w = 1 / np.arange(1, k+1)**a
+    return rng.choice(k, size=n, p=w/w.sum())
+
+
+def _names(prefix, k):
+    return np.array([f"{prefix} {i:0{len(str(k))}d}" for i in range(k)], dtype=object)
+
+
+def _par(rng, v):
+    """PAR amounts → the mixed formats SF and hand edits produce."""
+    kind = rng.choice(5, size=len(v), p=[.45, .25, .2, .07, .03])
+    s = pd.Series(v.astype(float), dtype=object)
+    txt = pd.Series(v, dtype=object).map("{:,}".format)
+    s[kind == 1] = "USD " + txt[kind == 1]
+    s[kind == 2] = "$" + txt[kind == 2]
+    s[kind == 3] = None
+    s[kind == 4] = "TBD"
+    return s
+
+
+def _mdy(d, yy=False, dmy=False):
+    """datetime64 array → 'M/D/YYYY' (or 'D/M/YYYY', or 2-digit-year) strings."""
+    di = pd.DatetimeIndex(d)
+    y = (di.year % 100) if yy else di.year
+    a, b = (di.day, di.month) if dmy else (di.month, di.day)
+    return pd.Series(a.astype(str)).str.cat([pd.Series(b.astype(str)), pd.Series(y.astype(str))], sep="/").to_numpy(dtype=object)
+
+
+def _solutions_dates(rng, d):
+    """Received/Closed column: EU strings, US short strings, Excel-swapped datetimes, blanks."""
+    di = pd.DatetimeIndex(d)
+    kind = rng.choice(4, size=len(d), p=[.35, .2, .2, .25])
+    out = np.full(len(d), None, dtype=object)
+    out[kind == 0] = _mdy(d[kind == 0], dmy=True)
+    out[kind == 1] = _mdy(d[kind == 1], yy=True)
+    # Excel read '2/10/26' day-first → 2 Oct 2026; only possible when the real day ≤ 12
+    sw = (kind == 2) & (di.day <= 12)
+    out[sw] = list(pd.to_datetime(pd.DataFrame({"year": di.year[sw], "month": di.day[sw], "day": di.month[sw]})))
+    out[(kind == 2) & ~sw] = _mdy(d[(kind == 2) & ~sw], dmy=True)
+    return out
+
+
+def synth_export(n, seed=0, start="2024-01-01"):
+    """n opportunities as a raw Salesforce export (pre-clean_upload)."""
+    rng = np.random.default_rng(seed)
+    n_acct, n_owner = max(20, n // 8), max(10, n // 150)
+    close = np.datetime64(start) + rng.integers(0, 3*365, n).astype("m8[D]")
+    rcv = close - rng.integers(20, 200, n).astype("m8[D]")
+    done = rcv + rng.integers(1, 90, n).astype("m8[D]")
+    close_s = pd.Series(_mdy(close), dtype=object)
+    xl = rng.random(n) < .15                          # already a datetime in the sheet
+    close_s[xl] = list(pd.DatetimeIndex(close[xl]))
+    dur = pd.Series(rng.gamma(2, 35, n).astype(int), dtype=object)
+    dur[rng.random(n) < .02] = None
+    df = pd.DataFrame({
+        "Stage": np.array(STAGES, dtype=object)[rng.choice(len(STAGES), n, p=STAGE_P)],
+        "Solution Resource": _names("Resource", 24)[_pick(rng, n, 24, .6)],
+        "Account Name": _names("Account", n_acct)[_pick(rng, n, n_acct)],
+        "Owner Role": np.array(REGIONS, dtype=object)[rng.choice(4, n, p=[.4, .35, .15, .1])],
+        "Opportunity Name": [f"OPP-{seed:03d}-{i:07d}" for i in range(n)],
+        "Opportunity Owner": _names("Owner", n_owner)[_pick(rng, n, n_owner, .8)],
+        "Main Primary Service": np.array(SERVICES, dtype=object)[_pick(rng, n, len(SERVICES))],
+        "Opportunity PAR": _par(rng, (rng.lognormal(11.5, 1.3, n) // 100 * 100).astype(np.int64)),
+        "Stage Duration": dur,
+        "Close Date": close_s,
+        "Notes": np.array(NOTES, dtype=object)[rng.choice(len(NOTES), n, p=[.1, .1, .1, .1, .1, .5])],
+        "Status": np.array(STATUSES, dtype=object)[rng.choice(4, n, p=[.35, .25, .15, .25])],
+        "Received by Solutions": _solutions_dates(rng, rcv),
+        "Closed by Solutions": np.where(rng.random(n) < .5, _solutions_dates(rng, done), None),
+        "Product": np.array(PRODUCTS, dtype=object)[rng.choice(len(PRODUCTS), n, p=[.08, .06, .05, .06, .75])],
+    })
+    return df[SF_COLS]
+
+
+def synth_update(df, seed=1, change=.2, drop=.03, add=.05):
+    """Next export after df: `change` of rows get a new stage/PAR/duration,
+    `drop` disappear, `add`×len(df) new opportunities are appended."""
+    rng = np.random.default_rng(seed)
+    n = len(df)
+    out = df[rng.random(n) >= drop].copy()
+    ch = rng.random(len(out)) < change
+    out.loc[ch, "Stage"] = np.array(STAGES, dtype=object)[rng.choice(len(STAGES), ch.sum(), p=STAGE_P)]
+    out.loc[ch, "Opportunity PAR"] = _par(rng, (rng.lognormal(11.5, 1.3, ch.sum()) // 100 * 100).astype(np.int64)).to_numpy()
+    out.loc[ch, "Stage Duration"] = rng.integers(0, 30, ch.sum())
+    new = synth_export(int(n * add), seed=seed + 1000)
+    return pd.concat([out, new], ignore_index=True)
+
+
+def parse_size(s):
+    """'10k' / '1M' / '2500' → int."""
+    s = str(s).strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Write a synthetic Salesforce export.")
+    ap.add_argument("size", help="number of opportunities, e.g. 5000, 10k, 1M")
+    ap.add_argument("-o", "--out", default="SF_synthetic.csv", help=".csv or .xlsx (default: SF_synthetic.csv)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--update", action="store_true", help="write the follow-up export (synth_update) instead")
+    a = ap.parse_args(argv)
+    df = synth_export(parse_size(a.size), a.seed)
+    if a.update: df = synth_update(df, a.seed + 1)
+    if a.out.endswith(".xlsx"): df.to_excel(a.out, index=False)
+    else: df.to_csv(a.out, index=False)
+    print(f"{len(df):,} rows → {a.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Regression tests for the engine's ingest path.
+
+    python -m pytest -q"""
+import os
+import sys
+from io import BytesIO
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import parse_par_batch, fix_excel_eu_date_batch, read_upload, export_date, export_order, SF_COLS
+
+
+def export(**cols):
+    """A three-row export with SF_COLS, overridden by `cols`."""
+    df = pd.DataFrame({c: [None] * 3 for c in SF_COLS}, dtype=object)
+    df["Opportunity Name"] = ["OPP-1", "OPP-2", "OPP-3"]
+    df["Stage"] = "Negotiations"
+    for c, v in cols.items(): df[c] = v
+    return df
+
+
+def xlsx(df):
+    b = BytesIO()
+    df.to_excel(b, index=False)
+    return b.getvalue()
+
+
+def test_par_all_blank_object_column():
+    vals, bad = parse_par_batch(pd.Series([None, float("nan"), None], dtype=object))
+    assert vals.tolist() == [0.0, 0.0, 0.0] and not bad.any()
+
+
+def test_read_upload_xlsx_with_empty_par_column():
+    df = read_upload("export.xlsx", xlsx(export()))
+    assert df["Opportunity PAR"].tolist() == [0.0, 0.0, 0.0]
+    assert df.attrs["par_unparsed"] == 0
+
+
+def test_unparsed_par_counted():
+    df = read_upload("export.csv", export(**{"Opportunity PAR": ["USD 1,200", "TBD", None]}).to_csv(index=False).encode())
+    assert df["Opportunity PAR"].tolist() == [1200.0, 0.0, 0.0]
+    assert df.attrs["par_unparsed"] == 1
+
+
+def test_solutions_dates_iso_strings():
+    s = pd.Series(["2026-10-02", "2026-10-13", "2026-10-02 00:00:00", "2026-10-13 00:00:00", "27/1/2026"], dtype=object)
+    assert fix_excel_eu_date_batch(s).tolist() == [pd.Timestamp("2026-10-02"), pd.Timestamp("2026-10-13"),
+                                                   pd.Timestamp("2026-02-10"), pd.Timestamp("2026-10-13"),
+                                                   pd.Timestamp("2026-01-27")]
+
+
+def test_csv_plain_iso_dates_not_swapped():
+    csv = export(**{"Received by Solutions": ["2026-10-02", "2026-03-04", None]}).to_csv(index=False).encode()
+    assert read_upload("export.csv", csv)["Received by Solutions"].tolist()[:2] == [pd.Timestamp("2026-10-02"), pd.Timestamp("2026-03-04")]
+
+
+def test_close_date_format_is_per_file():
+    # A day-first file must not change how a later file with the same header parses
+    first = export(**{"Close Date": ["25/12/2026", "1/2/2026", None]}).to_csv(index=False).encode()
+    later = export(**{"Close Date": ["1/5/2026", "12/31/2026", None]}).to_csv(index=False).encode()
+    read_upload("first.csv", first)
+    assert read_upload("later.csv", later)["Close Date"].tolist()[:2] == [pd.Timestamp("2026-01-05"), pd.Timestamp("2026-12-31")]
+
+
+def test_export_date_from_name():
+    assert export_date("report1712320250101.xlsx") == pd.Timestamp(1712320250101, unit="ms")
+    assert export_date("SF_2026-03-04.xlsx") == pd.Timestamp("2026-03-04")
+    assert export_date("weekly_20260105.csv") == pd.Timestamp("2026-01-05")
+    assert export_date("export.csv") is None
+    names = ["export.csv", "SF_2026-03-04.xlsx", "report1712320250101.xlsx"]
+    assert export_order(names, [export_date(n) for n in names]) == [2, 1, 0]
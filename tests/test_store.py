@@ -0,0 +1,74 @@
+"""MasterStore history: versions, undo/redo and restore.
+
+    python -m pytest -q"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import read_upload
+from store import MasterStore, HISTORY_CHECKPOINT
+from synth import synth_export
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MasterStore(str(tmp_path / "master.db"))
+
+
+@pytest.fixture
+def master():
+    return read_upload("export.csv", synth_export(200, seed=3).to_csv(index=False).encode())
+
+
+def edit(df, row, text):
+    out = df.copy()
+    out.loc[row, "Tasks"] = text
+    return out
+
+
+def ver(store):
+    return store.version()[1]
+
+
+def test_at_rebuilds_every_version_across_checkpoints(store, master):
+    frames, df = {}, master
+    store.save(df)
+    frames[ver(store)] = store.load()
+    for i in range(2 * HISTORY_CHECKPOINT + 3):
+        df = edit(df, i, f"task {i}")
+        assert store.save(df, "edit") == 1            # rows written, also on checkpoint versions
+        frames[ver(store)] = store.load()
+    assert store.history(limit=100)["Checkpoint"].sum() >= 3
+    for v, expect in frames.items():
+        pd.testing.assert_frame_equal(store.at(v), expect)
+
+
+def test_undo_undo_redo_redo(store, master):
+    a, b, c = master, edit(master, 0, "b"), edit(edit(master, 0, "b"), 1, "c")
+    for df in (a, b, c): store.save(df)
+    expect = [b, a, b, c]
+    for step, df in zip([store.undo, store.undo, store.redo, store.redo], expect):
+        assert step() is not None
+        pd.testing.assert_frame_equal(store.load(), store.at(ver(store)))
+        assert store.load()["Tasks"].tolist() == df["Tasks"].tolist()
+    assert store.undo_redo() == (True, False)
+    assert store.redo() is None
+
+
+def test_undo_after_restore_goes_back_to_what_was_live(store, master):
+    a, b, c = master, edit(master, 0, "b"), edit(master, 1, "c")
+    for df in (a, b, c): store.save(df)
+    store.restore(1)
+    assert store.load()["Tasks"].tolist() == a["Tasks"].tolist()
+    store.undo()
+    assert store.load()["Tasks"].tolist() == c["Tasks"].tolist()
+
+
+def test_noop_save_creates_no_version(store, master):
+    store.save(master)
+    v, n = ver(store), len(store.history())
+    assert store.save(store.load()) == 0
+    assert ver(store) == v and len(store.history()) == n